@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+"""
+-------------------------------------------------
+   File Name：     bench_execl
+   Description :  XlsxWriterToExport导出性能测试。
+                  每个用例在独立子进程中运行，记录耗时、每秒行数、峰值内存、格式数量和文件大小，
+                  结果保存为json，可以和其他版本的结果对比。
+   Author :       caiwanpeng
+   date：          2026/10/18
+-------------------------------------------------
+   usage:
+       python benchmarks/bench_execl.py --quick
+       python benchmarks/bench_execl.py --rows 10000,100000,1000000 --sources dict,object,callable --json new.json
+       python benchmarks/bench_execl.py --json new.json --compare old.json
+       python benchmarks/bench_execl.py --rows 50000 --profiles none,fast,balanced,small
+-------------------------------------------------
+"""
+__author__ = 'caiwanpeng'
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from queue import Empty
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import xlsxwriter
+
+from caibox.execl_utils import XlsxWriterToExport
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class BenchRow(object):
+    __slots__ = ('c0', 'c1', 'c2', 'c3', 'c4', 'c5', 'c6', 'c7', 'c8', 'c9', 'c10', 'c11',
+                 'c12', 'c13', 'c14', 'c15', 'c16', 'c17', 'c18', 'c19')
+
+    def __init__(self, values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+
+def make_values(index, cols):
+    # 数字、文本交替，模拟一般报表
+    return [index * (col + 1) if col % 2 == 0 else u'文本{}-{}'.format(index, col) for col in range(cols)]
+
+
+def make_source(source, rows, cols):
+    if source == 'object':
+        for index in range(rows):
+            yield BenchRow(make_values(index, cols))
+    else:
+        codes = ['c{}'.format(col) for col in range(cols)]
+        for index in range(rows):
+            yield dict(zip(codes, make_values(index, cols)))
+
+
+class BenchExport(XlsxWriterToExport):
+    export_name = 'bench'
+
+    def add_sheets(self):
+        case = self.kwargs['case']
+        cols = case['cols']
+        ws = self.workbook.add_worksheet(u'bench')
+        options = {'source': self.data, 'head_format': self.head_format}
+        child_list = []
+        for col in range(cols):
+            child = {'code': 'c{}'.format(col), 'head': u'列{}'.format(col)}
+            if case['source'] == 'callable':
+                child['code'] = lambda obj, code=child['code']: obj[code]
+            if col < case['formats']:
+                child['format'] = {'num_format': '#,##0.00', 'font_color': '#{:06x}'.format(col * 4099), 'border': 1}
+            if case['sum'] and col % 2 == 0:
+                child['type'] = 'sum'
+            child_list.append(child)
+        self.add_table_head(ws, options, u'测试', child_list=child_list)
+        self.add_table_data(ws, options, add_sum_line=case['sum'])
+
+
+def peak_rss():
+    # 当前进程的峰值内存，单位MB
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / 1024.0 / 1024.0 if sys.platform == 'darwin' else usage / 1024.0
+
+
+def run_case(case, queue):
+    file_dir = tempfile.mkdtemp()
+    try:
+        BenchExport.file_dir = file_dir
+        data = make_source(case['source'], case['rows'], case['cols'])
+        if case['materialize']:
+            data = list(data)
+        start = time.time()
+        kwargs = {'profile': case['profile']} if case['profile'] != 'none' else {}
+        if case['constant_memory']:
+            kwargs['constant_memory'] = True
+        manager = BenchExport(data=data, create=case['output'] == 'disk', case=case, **kwargs)
+        wall = time.time() - start
+        if case['output'] == 'disk':
+            size = os.path.getsize(manager.get_excel_url())
+        else:
+            size = len(manager.get_excel_url())
+        result = dict(case)
+        result.update({
+            'wall': round(wall, 4),
+            'rows_per_sec': round(case['rows'] / wall, 1) if wall else None,
+            'peak_rss_mb': peak_rss(),
+            'format_count': len(manager.formats),
+            'output_bytes': size,
+        })
+        queue.put(result)
+    except Exception:
+        queue.put(dict(case, error=traceback.format_exc()))
+    finally:
+        shutil.rmtree(file_dir, ignore_errors=True)
+
+
+def run_isolated(case, timeout=None):
+    # 每个用例单独一个进程，峰值内存互不影响；子进程异常退出(如内存不足被杀)或超时时返回带error的结果，不会一直等待
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_case, args=(case, queue))
+    process.start()
+    deadline = None if timeout is None else time.time() + timeout
+    result = None
+    try:
+        while result is None:
+            try:
+                result = queue.get(timeout=1)
+            except Empty:
+                if not process.is_alive():
+                    # 子进程可能在退出前刚放入结果
+                    try:
+                        result = queue.get(timeout=1)
+                    except Empty:
+                        result = dict(case, error=u'子进程异常退出，exitcode={}'.format(process.exitcode))
+                elif deadline is not None and time.time() > deadline:
+                    process.terminate()
+                    result = dict(case, error=u'超过{}秒没有完成'.format(timeout))
+    finally:
+        process.join()
+    return result
+
+
+def case_name(case):
+    return '{source}-r{rows}-c{cols}-f{formats}-{output}'.format(**case) + ''.join([
+        '-sum' if case['sum'] else '', '-cm' if case['constant_memory'] else '',
+        '-list' if case['materialize'] else '', '-' + case['profile'] if case['profile'] != 'none' else ''])
+
+
+def split(value, cast=str):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=u'XlsxWriterToExport性能测试')
+    parser.add_argument('--rows', default='10000,100000,1000000', help=u'行数，逗号分隔')
+    parser.add_argument('--cols', default='10', help=u'列数，逗号分隔，最多20')
+    parser.add_argument('--formats', default='0,10', help=u'带格式的列数，逗号分隔')
+    parser.add_argument('--sources', default='dict,object,callable', help=u'数据源类型：dict、object、callable')
+    parser.add_argument('--sum', default='0,1', help=u'是否加合计行：0、1')
+    parser.add_argument('--outputs', default='disk,memory', help=u'输出位置：disk、memory')
+    parser.add_argument('--constant-memory', default='0', help=u'是否开启constant_memory：0、1')
+    parser.add_argument('--profiles', default='none', help=u'导出性能配置：none、fast、balanced、small')
+    parser.add_argument('--materialize', action='store_true', help=u'数据源先转成列表')
+    parser.add_argument('--repeat', type=int, default=1, help=u'每个用例重复次数，取耗时最短的一次')
+    parser.add_argument('--timeout', type=float, default=3600, help=u'每次运行的最长秒数，超过后结束子进程并记为失败')
+    parser.add_argument('--quick', action='store_true', help=u'只跑一万行的少量用例')
+    parser.add_argument('--json', help=u'结果保存路径')
+    parser.add_argument('--compare', help=u'对比的历史结果json')
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.rows, args.formats, args.sum, args.outputs = '10000', '10', '1', 'disk'
+    return args
+
+
+def build_cases(args):
+    cases = []
+    for rows, cols, formats, source, with_sum, output, constant_memory, profile in itertools.product(
+            split(args.rows, int), split(args.cols, int), split(args.formats, int), split(args.sources),
+            split(args.sum, int), split(args.outputs), split(args.constant_memory, int), split(args.profiles)):
+        cases.append({'rows': rows, 'cols': min(cols, 20), 'formats': min(formats, cols), 'source': source,
+                      'sum': bool(with_sum), 'output': output, 'constant_memory': bool(constant_memory),
+                      'materialize': args.materialize, 'profile': profile})
+    return cases
+
+
+def compare(results, path):
+    with open(path) as f:
+        old = dict((case_name(item), item) for item in json.load(f)['results'])
+    print(u'\n对比 {}'.format(path))
+    for result in results:
+        before = old.get(case_name(result))
+        if before:
+            print(u'{:<48} wall {:>8.3f}s -> {:>8.3f}s  ({:+.1%})'.format(
+                case_name(result), before['wall'], result['wall'], result['wall'] / before['wall'] - 1))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    failures = []
+    print(u'{:<48} {:>9} {:>12} {:>9} {:>8} {:>12}'.format('case', 'wall(s)', 'rows/s', 'rss(MB)', 'formats', 'bytes'))
+    for case in build_cases(args):
+        runs = [run_isolated(case, args.timeout) for _ in range(max(args.repeat, 1))]
+        failed = [run for run in runs if run.get('error')]
+        if failed:
+            failures.append(failed[0])
+            print(u'{:<48} 失败：{}'.format(case_name(case), failed[0]['error'].strip().splitlines()[-1]))
+            continue
+        result = min(runs, key=lambda item: item['wall'])
+        results.append(result)
+        print(u'{:<48} {:>9.3f} {:>12.0f} {:>9} {:>8} {:>12}'.format(
+            case_name(result), result['wall'], result['rows_per_sec'] or 0,
+            '-' if result['peak_rss_mb'] is None else '{:.1f}'.format(result['peak_rss_mb']),
+            result['format_count'], result['output_bytes']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'xlsxwriter': xlsxwriter.__version__, 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'results': results, 'failures': failures}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+"""
+-------------------------------------------------
+   File Name：     bench_proxys
+   Description :  代理类访问开销测试。对比直接访问真实对象、ObjProxy代理对象和工厂函数、各种上下文代理，
+                  以及specialized_proxy生成的专用代理类，每种操作取多次重复中最快的一次，结果为每次访问的纳秒数。
+   Author :       caiwanpeng
+   date：          2026/10/18
+-------------------------------------------------
+   usage:
+       python benchmarks/bench_proxys.py
+       python benchmarks/bench_proxys.py --number 200000 --ops getitem,len --json proxys.json
+       python benchmarks/bench_proxys.py --suites specialized,number
+-------------------------------------------------
+"""
+__author__ = 'caiwanpeng'
+
+import argparse
+import contextvars
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caibox.proxys import (CachedObjProxy, ContextProxy, LazyObjProxy, LocalStack, ObjProxy, ProfilingObjProxy,
+                           ThreadLocalProxy, specialized_proxy)
+
+# 各种操作，obj是真实对象或代理
+OPS = {
+    'getitem': "obj['name']",
+    'getattr': "obj.get",
+    'len': "len(obj)",
+    'contains': "'name' in obj",
+    'iter': "for _ in obj: pass",
+}
+# 数字的运算
+NUMBER_OPS = {
+    'add': "obj + 1",
+    'radd': "1 + obj",
+    'mul': "obj * 3",
+    'lt': "obj < 10",
+    'hash': "hash(obj)",
+}
+
+
+class Registry(object):
+    """模拟按名称查找的注册表，工厂函数代理的典型用法"""
+    lock = threading.Lock()
+    items = {}
+
+    @classmethod
+    def lookup(cls, name):
+        with cls.lock:
+            return cls.items[name]
+
+
+def build_targets():
+    # 返回[(名称, 对象)]，所有对象最终都指向同一个字典
+    config = {'name': u'导出配置', 'profile': 'fast'}
+    Registry.items['config'] = config
+    current = contextvars.ContextVar('config')
+    current.set(config)
+    local = threading.local()
+    local.config = config
+
+    context_proxy = ContextProxy('config_proxy')
+    context_proxy._bind(config)
+    stack = LocalStack('config_stack')
+    stack.push(config)
+    thread_proxy = ThreadLocalProxy()
+    thread_proxy._bind(config)
+    lazy_proxy = LazyObjProxy(lambda: Registry.lookup('config'), name='config')
+    # 只测初始化之后的访问
+    bool(lazy_proxy)
+    return [
+        ('direct', config),
+        ('objproxy-object', ObjProxy(config)),
+        ('objproxy-registry', ObjProxy(lambda: Registry.lookup('config'))),
+        ('objproxy-contextvar', ObjProxy(current.get)),
+        ('objproxy-threadlocal', ObjProxy(lambda: local.config)),
+        ('cached', CachedObjProxy(lambda: Registry.lookup('config'))),
+        ('context', context_proxy),
+        ('stack', stack.proxy()),
+        ('threadlocal', thread_proxy),
+        ('lazy', lazy_proxy),
+        ('profiling-1%', ProfilingObjProxy(config, sample_rate=0.01)),
+    ]
+
+
+def build_specialized_targets():
+    config = {'name': u'导出配置', 'profile': 'fast'}
+    return [
+        ('direct', config),
+        ('objproxy-object', ObjProxy(config)),
+        ('specialized-object', specialized_proxy(dict)(config)),
+        ('objproxy-factory', ObjProxy(lambda: config)),
+        ('specialized-factory', specialized_proxy(dict, factory=True)(lambda: config)),
+    ]
+
+
+def build_number_targets():
+    return [
+        ('direct', 5),
+        ('objproxy-object', ObjProxy(5)),
+        ('specialized-object', specialized_proxy(int)(5)),
+    ]
+
+
+# 测试组：(生成测试对象的函数, 操作)
+SUITES = {
+    'context': (build_targets, OPS),
+    'specialized': (build_specialized_targets, OPS),
+    'number': (build_number_targets, NUMBER_OPS),
+}
+
+
+def measure(stmt, obj, number, repeat):
+    # 每次访问的纳秒数
+    best = min(timeit.repeat(stmt, globals={'obj': obj}, number=number, repeat=repeat))
+    return best / number * 1e9
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=u'代理类访问开销测试')
+    parser.add_argument('--number', type=int, default=500000, help=u'每次计时的访问次数')
+    parser.add_argument('--repeat', type=int, default=5, help=u'重复次数，取最快的一次')
+    parser.add_argument('--suites', default='context,specialized,number', help=u'测试组，逗号分隔：context、specialized、number')
+    parser.add_argument('--ops', default='', help=u'只测这些操作，逗号分隔：' + u'、'.join(sorted(OPS) + sorted(NUMBER_OPS)))
+    parser.add_argument('--json', help=u'结果保存路径')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    only = set(op for op in args.ops.split(',') if op)
+    results = []
+    for suite in [suite for suite in args.suites.split(',') if suite]:
+        build, suite_ops = SUITES[suite]
+        ops = [op for op in sorted(suite_ops) if not only or op in only]
+        if not ops:
+            continue
+        print(u'\n[{}]'.format(suite))
+        print(u'{:<24}'.format('target') + ''.join(u'{:>12}'.format(op + '(ns)') for op in ops))
+        for name, obj in build():
+            result = {'suite': suite, 'target': name}
+            for op in ops:
+                result[op] = round(measure(suite_ops[op], obj, args.number, args.repeat), 1)
+            results.append(result)
+            print(u'{:<24}'.format(name) + ''.join(u'{:>12.1f}'.format(result[op]) for op in ops))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+"""
+-------------------------------------------------
+   File Name：     execl_address
+   Description :  单元格和区域的A1地址。导入时预先生成全部16384个列名，列号和列名互相转换只查表，
+                  并提供批量把行列号数组转换成地址的函数。行号、列号都从0开始。
+   Author :       caiwanpeng
+   date：          2026/10/18
+-------------------------------------------------
+   Change Activity:
+                   2026/10/18:
+-------------------------------------------------
+"""
+__author__ = 'caiwanpeng'
+
+import itertools
+import string
+
+# excel最大列数
+MAX_COLS = 16384
+DIGITS = '0123456789'
+
+
+def _build_letters():
+    letters = string.ascii_uppercase
+    names = list(letters)
+    names.extend(a + b for a, b in itertools.product(letters, letters))
+    names.extend(a + b + c for a, b, c in itertools.product(letters, letters, letters))
+    return tuple(names[:MAX_COLS])
+
+
+# 列号到列名：COLUMN_LETTERS[0] == 'A'，COLUMN_LETTERS[16383] == 'XFD'
+COLUMN_LETTERS = _build_letters()
+# 列名到列号
+COLUMN_INDEX = dict((name, col) for col, name in enumerate(COLUMN_LETTERS))
+
+
+def col_name(col):
+    """
+    @desc 列号转列名，0 -> A
+    :param col: 列号
+    :return:
+    """
+    return COLUMN_LETTERS[col]
+
+
+def cell_name(row, col, absolute=False):
+    """
+    @desc 行列号转单元格地址，(0, 0) -> A1
+    :param row: 行号
+    :param col: 列号
+    :param absolute: 是否使用绝对地址 $A$1
+    :return:
+    """
+    if absolute:
+        return '$%s$%d' % (COLUMN_LETTERS[col], row + 1)
+    return '%s%d' % (COLUMN_LETTERS[col], row + 1)
+
+
+def range_name(first_row, first_col, last_row, last_col, absolute=False):
+    """
+    @desc 区域地址，(0, 0, 1, 2) -> A1:C2，只有一个单元格时返回单元格地址
+    :return:
+    """
+    if first_row == last_row and first_col == last_col:
+        return cell_name(first_row, first_col, absolute)
+    if absolute:
+        return '$%s$%d:$%s$%d' % (COLUMN_LETTERS[first_col], first_row + 1, COLUMN_LETTERS[last_col], last_row + 1)
+    return '%s%d:%s%d' % (COLUMN_LETTERS[first_col], first_row + 1, COLUMN_LETTERS[last_col], last_row + 1)
+
+
+def col_range(first_col, last_col):
+    """
+    @desc 整列区域，(1, 3) -> B:D
+    :return:
+    """
+    return '%s:%s' % (COLUMN_LETTERS[first_col], COLUMN_LETTERS[last_col])
+
+
+def col_index(name):
+    """
+    @desc 列名转列号，A -> 0，不区分大小写，可以带$
+    :param name: 列名
+    :return:
+    """
+    try:
+        return COLUMN_INDEX[name.replace('$', '').upper()]
+    except KeyError:
+        raise ValueError(u'错误的列名：{}'.format(name))
+
+
+def cell_index(ref):
+    """
+    @desc 单元格地址转行列号，A1 -> (0, 0)
+    :param ref: 单元格地址，可以带$
+    :return: (row, col)
+    """
+    ref = ref.replace('$', '')
+    letters = ref.rstrip(DIGITS)
+    try:
+        return int(ref[len(letters):]) - 1, COLUMN_INDEX[letters.upper()]
+    except (KeyError, ValueError):
+        raise ValueError(u'错误的单元格地址：{}'.format(ref))
+
+
+def range_index(ref, whole_columns=True):
+    """
+    @desc 区域地址转行列号，A1:C2 -> (0, 0, 1, 2)；B:D 这样的整列区域返回 (None, 1, None, 3)
+    :param ref: 区域地址或单元格地址
+    :param whole_columns: 是否接受整列区域，为False时整列区域抛出ValueError，用于合并单元格等需要行号的地方
+    :return: (first_row, first_col, last_row, last_col)
+    """
+    first, _, last = ref.partition(':')
+    last = last or first
+    if first.replace('$', '').isalpha() and last.replace('$', '').isalpha():
+        if not whole_columns:
+            raise ValueError(u'需要包含行号的区域地址：{}'.format(ref))
+        return None, col_index(first), None, col_index(last)
+    return cell_index(first) + cell_index(last)
+
+
+def _as_list(values):
+    # numpy数组先转成列表，逐个元素访问更快
+    return values.tolist() if hasattr(values, 'tolist') else values
+
+
+def cell_names(rows, cols):
+    """
+    @desc 批量转换单元格地址
+    :param rows: 行号序列或数组
+    :param cols: 列号序列或数组
+    :return: 地址列表
+    """
+    letters = COLUMN_LETTERS
+    return ['%s%d' % (letters[col], row + 1) for row, col in zip(_as_list(rows), _as_list(cols))]
+
+
+def range_names(first_rows, first_cols, last_rows, last_cols):
+    """
+    @desc 批量转换区域地址，如动态生成的大量合并单元格，单个单元格也返回 A1:A1 的形式
+    :return: 地址列表
+    """
+    letters = COLUMN_LETTERS
+    return ['%s%d:%s%d' % (letters[first_col], first_row + 1, letters[last_col], last_row + 1)
+            for first_row, first_col, last_row, last_col in zip(
+                _as_list(first_rows), _as_list(first_cols), _as_list(last_rows), _as_list(last_cols))]
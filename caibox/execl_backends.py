@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+"""
+-------------------------------------------------
+   File Name：     execl_backends
+   Description :  XlsxWriterToExport的写入后端。
+                  xlsxwriter：功能完整的默认后端；
+                  xlsx：直接生成sheet xml的快速后端，使用内联字符串，不支持样式、批注；
+                  csv/tsv：纯文本后端。
+                  后端的workbook/worksheet提供和xlsxwriter相同的方法，导出类不需要区分。
+   Author :       caiwanpeng
+   date：          2026/10/18
+-------------------------------------------------
+   Change Activity:
+                   2026/10/18:
+-------------------------------------------------
+"""
+__author__ = 'caiwanpeng'
+
+import csv
+import datetime
+import decimal
+import io
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+import xlsxwriter
+
+from caibox.execl_address import COLUMN_LETTERS, cell_index, col_index, range_index, range_name
+
+EXCEL_MAX_ROWS = 1048576
+# xml中不允许出现的控制字符
+INVALID_XML_CHARS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class XlsxWriterBackend(object):
+    """
+    默认后端，使用xlsxwriter.Workbook
+    """
+    name = 'xlsxwriter'
+    suffix = '.xlsx'
+    # 单个标签页的最大行数，None表示不限制
+    max_rows = EXCEL_MAX_ROWS
+    # 是否只能按行号从小到大写入
+    sequential = False
+
+    def create_workbook(self, output, options):
+        if options.get('compresslevel') is not None:
+            return CompressedWorkbook(output, options)
+        return xlsxwriter.Workbook(output, options)
+
+
+def repack_zip(target, compresslevel):
+    """
+    @desc 按指定的压缩级别重新打包zip文件，逐个成员流式复制，不把整个文件读入内存
+    :param target: 文件路径，或可读写、可截断的文件对象
+    :param compresslevel: zlib压缩级别 0-9
+    :return:
+    """
+    if isinstance(target, str):
+        tmp_path = target + '.repack'
+        try:
+            with zipfile.ZipFile(target) as source, open(tmp_path, 'wb') as output:
+                _copy_members(source, output, compresslevel)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return
+    # 文件对象先复制出来，再在原位置写入新的内容
+    with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as copy:
+        target.seek(0)
+        shutil.copyfileobj(target, copy)
+        copy.seek(0)
+        target.seek(0)
+        target.truncate()
+        with zipfile.ZipFile(copy) as source:
+            _copy_members(source, target, compresslevel)
+
+
+def _copy_members(source, output, compresslevel):
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=compresslevel) as package:
+        for info in source.infolist():
+            with source.open(info) as member, \
+                    package.open(info.filename, 'w', force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as handle:
+                shutil.copyfileobj(member, handle, 1024 * 1024)
+
+
+class CompressedWorkbook(xlsxwriter.Workbook):
+    """
+    可以指定压缩级别的xlsxwriter.Workbook，options中的compresslevel：1最快，9文件最小。
+    xlsxwriter没有压缩级别的参数，关闭时先按默认级别打包，再按compresslevel重新打包，
+    多了一次解压和压缩，适合用较高的级别换取更小的文件
+    """
+
+    def __init__(self, filename=None, options=None):
+        options = dict(options or {})
+        self.compresslevel = options.pop('compresslevel', None)
+        super(CompressedWorkbook, self).__init__(filename, options)
+
+    def close(self):
+        closed = self.fileclosed
+        super(CompressedWorkbook, self).close()
+        if not closed and self.compresslevel is not None:
+            repack_zip(self.filename, self.compresslevel)
+
+
+class RawFormat(object):
+    """快速后端和csv后端的格式对象，只保存属性，不参与输出"""
+
+    def __init__(self, properties=None):
+        self.properties = properties or {}
+
+
+def cell_args(args):
+    # 把 ('A1', ...) 形式的参数转换成 (row, col, ...)
+    if args and isinstance(args[0], str):
+        return cell_index(args[0]) + tuple(args[1:])
+    return args
+
+
+def range_args(args):
+    # 把 ('A1:C2', ...) 形式的参数转换成 (first_row, first_col, last_row, last_col, ...)
+    if args and isinstance(args[0], str):
+        return range_index(args[0], whole_columns=False) + tuple(args[1:])
+    return args
+
+
+class SequentialWorksheet(object):
+    """
+    按行顺序写入的标签页基类：当前行的单元格先放在字典中，写到下一行时整行输出；
+    已经输出的行不能再修改，和xlsxwriter的constant_memory模式一致
+    """
+
+    def __init__(self, workbook, name, index):
+        self.workbook = workbook
+        self.name = name
+        self.index = index
+        self.current_row = None
+        self.current_cells = {}
+        self.row_count = 0
+        self.max_col = -1
+
+    def get_name(self):
+        return self.name
+
+    def write(self, *args):
+        args = cell_args(args)
+        row, col, value = args[0], args[1], args[2]
+        if row != self.current_row:
+            if self.current_row is not None and row < self.current_row:
+                # 已输出的行，忽略
+                return -2
+            self.flush_row()
+            self.current_row = row
+        self.current_cells[col] = value
+        if col > self.max_col:
+            self.max_col = col
+        return 0
+
+    write_string = write_number = write_datetime = write_boolean = write_formula = write_url = write
+
+    def write_blank(self, *args):
+        return 0
+
+    def write_row(self, *args):
+        row, col, values = cell_args(args)[:3]
+        for offset, value in enumerate(values):
+            self.write(row, col + offset, value)
+        return 0
+
+    def write_column(self, *args):
+        row, col, values = cell_args(args)[:3]
+        for offset, value in enumerate(values):
+            self.write(row + offset, col, value)
+        return 0
+
+    def merge_range(self, *args):
+        first_row, first_col, last_row, last_col, value = range_args(args)[:5]
+        self.write(first_row, first_col, value)
+        return 0
+
+    def write_comment(self, *args, **kwargs):
+        return 0
+
+    def data_validation(self, *args, **kwargs):
+        return 0
+
+    def set_column(self, *args, **kwargs):
+        return 0
+
+    def set_row(self, *args, **kwargs):
+        return 0
+
+    def autofilter(self, *args):
+        return 0
+
+    def freeze_panes(self, *args):
+        return 0
+
+    def flush_row(self):
+        if self.current_row is None or not self.current_cells:
+            return
+        self.write_cells(self.current_row, self.current_cells)
+        self.row_count += 1
+        self.current_cells = {}
+
+    def write_cells(self, row, cells):
+        raise NotImplementedError
+
+
+class RawXlsxWorksheet(SequentialWorksheet):
+    """直接输出sheet xml的标签页，数据行写到临时文件中，关闭时再组装到zip包"""
+
+    def __init__(self, workbook, name, index):
+        super(RawXlsxWorksheet, self).__init__(workbook, name, index)
+        self.sheet_data = tempfile.TemporaryFile(dir=workbook.tmpdir)
+        self.columns = {}
+        self.row_heights = {}
+        self.merges = []
+        self.filter_range = None
+        self.panes = None
+
+    def set_column(self, *args, **kwargs):
+        if args and isinstance(args[0], str):
+            first, _, last = args[0].partition(':')
+            args = (col_index(first), col_index(last or first)) + tuple(args[1:])
+        first_col, last_col = args[0], args[1]
+        width = args[2] if len(args) > 2 else kwargs.get('width')
+        if width is not None:
+            for col in range(first_col, last_col + 1):
+                self.columns[col] = width
+        return 0
+
+    def set_row(self, row, height=None, *args, **kwargs):
+        if height is not None:
+            self.row_heights[row] = height
+        return 0
+
+    def merge_range(self, *args):
+        first_row, first_col, last_row, last_col, value = range_args(args)[:5]
+        self.merges.append((first_row, first_col, last_row, last_col))
+        self.write(first_row, first_col, value)
+        return 0
+
+    def autofilter(self, *args):
+        self.filter_range = range_args(args)[:4]
+        return 0
+
+    def freeze_panes(self, *args):
+        row, col = cell_args(args)[:2]
+        self.panes = (row, col)
+        return 0
+
+    def write_cells(self, row, cells):
+        refs = self.workbook.col_refs
+        ref_row = row + 1
+        if len(refs) <= self.max_col:
+            self.workbook.extend_col_refs(self.max_col)
+        parts = []
+        for col in sorted(cells):
+            value = cells[col]
+            if value is None or value == '':
+                continue
+            prefix = refs[col]
+            if isinstance(value, str):
+                parts.append('%s%d" t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>'
+                             % (prefix, ref_row, escape(INVALID_XML_CHARS.sub(u'', value))))
+            elif isinstance(value, bool):
+                parts.append('%s%d" t="b"><v>%d</v></c>' % (prefix, ref_row, value))
+            elif isinstance(value, (int, decimal.Decimal)):
+                parts.append('%s%d"><v>%s</v></c>' % (prefix, ref_row, value))
+            elif isinstance(value, float):
+                if value != value or value in (float('inf'), float('-inf')):
+                    continue
+                parts.append('%s%d"><v>%r</v></c>' % (prefix, ref_row, value))
+            elif isinstance(value, (datetime.date, datetime.time)):
+                parts.append('%s%d" s="1"><v>%r</v></c>' % (prefix, ref_row, excel_date(value)))
+            else:
+                parts.append('%s%d" t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>'
+                             % (prefix, ref_row, escape(INVALID_XML_CHARS.sub(u'', str(value)))))
+        height = self.row_heights.get(row)
+        if height is not None:
+            head = '<row r="%d" ht="%s" customHeight="1">' % (ref_row, height)
+        else:
+            head = '<row r="%d">' % ref_row
+        self.sheet_data.write((head + ''.join(parts) + '</row>').encode('utf-8'))
+
+    def range_ref(self, first_row, first_col, last_row, last_col):
+        return range_name(first_row, first_col, last_row, last_col)
+
+    def write_xml(self, handle):
+        # 组装完整的sheet xml
+        self.flush_row()
+        handle.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                     b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                     b'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">')
+        view = '<sheetView%s workbookViewId="0">' % (' tabSelected="1"' if self.index == 0 else '')
+        if self.panes and any(self.panes):
+            row, col = self.panes
+            pane_name = 'bottomRight' if row and col else ('bottomLeft' if row else 'topRight')
+            view += '<pane%s%s topLeftCell="%s%d" activePane="%s" state="frozen"/>' % (
+                ' xSplit="%d"' % col if col else '', ' ySplit="%d"' % row if row else '',
+                COLUMN_LETTERS[col], row + 1, pane_name)
+        handle.write(('<sheetViews>%s</sheetView></sheetViews><sheetFormatPr defaultRowHeight="15"/>'
+                      % view).encode('utf-8'))
+        if self.columns:
+            cols = ''.join('<col min="%d" max="%d" width="%s" customWidth="1"/>' % (col + 1, col + 1, width)
+                           for col, width in sorted(self.columns.items()))
+            handle.write(('<cols>%s</cols>' % cols).encode('utf-8'))
+        handle.write(b'<sheetData>')
+        self.sheet_data.seek(0)
+        shutil.copyfileobj(self.sheet_data, handle)
+        self.sheet_data.close()
+        handle.write(b'</sheetData>')
+        if self.filter_range:
+            handle.write(('<autoFilter ref="%s"/>' % self.range_ref(*self.filter_range)).encode('utf-8'))
+        if self.merges:
+            merges = ''.join('<mergeCell ref="%s"/>' % self.range_ref(*merge) for merge in self.merges)
+            handle.write(('<mergeCells count="%d">%s</mergeCells>' % (len(self.merges), merges)).encode('utf-8'))
+        handle.write(b'</worksheet>')
+
+
+def excel_date(value):
+    # 转换成execl的日期序列号
+    if isinstance(value, datetime.datetime):
+        delta = value.replace(tzinfo=None) - datetime.datetime(1899, 12, 30)
+    elif isinstance(value, datetime.date):
+        delta = datetime.datetime(value.year, value.month, value.day) - datetime.datetime(1899, 12, 30)
+    else:
+        delta = datetime.datetime.combine(datetime.date(1899, 12, 30), value) - datetime.datetime(1899, 12, 30)
+    return delta.days + delta.seconds / 86400.0 + delta.microseconds / 86400000000.0
+
+
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>')
+
+RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>')
+
+
+class RawXlsxWorkbook(object):
+    """
+    快速后端的workbook：数据行直接拼接成xml，字符串内联在单元格中，不生成共享字符串表。
+    只保留列宽、行高、合并单元格、冻结和筛选，格式只区分日期，批注、数据验证等会被忽略
+    """
+
+    def __init__(self, output, options=None):
+        options = options or {}
+        self.output = output
+        self.tmpdir = options.get('tmpdir')
+        self.compresslevel = options.get('compresslevel')
+        self.sheets = []
+        self.fileclosed = False
+        # 预先生成的单元格引用前缀 '<c r="A'
+        self.col_refs = []
+        self.extend_col_refs(25)
+
+    def extend_col_refs(self, max_col):
+        for col in range(len(self.col_refs), max_col + 1):
+            self.col_refs.append('<c r="%s' % COLUMN_LETTERS[col])
+
+    def add_worksheet(self, name=None):
+        sheet = RawXlsxWorksheet(self, name or 'Sheet%d' % (len(self.sheets) + 1), len(self.sheets))
+        self.sheets.append(sheet)
+        return sheet
+
+    def add_format(self, properties=None):
+        return RawFormat(properties)
+
+    def worksheets(self):
+        return self.sheets
+
+    def close(self):
+        if self.fileclosed:
+            return
+        self.fileclosed = True
+        if not self.sheets:
+            self.add_worksheet()
+        kwargs = {'compression': zipfile.ZIP_DEFLATED, 'allowZip64': True}
+        if self.compresslevel is not None:
+            kwargs['compresslevel'] = self.compresslevel
+        with zipfile.ZipFile(self.output, 'w', **kwargs) as package:
+            package.writestr('[Content_Types].xml', self.content_types_xml())
+            package.writestr('_rels/.rels', RELS_XML)
+            package.writestr('xl/workbook.xml', self.workbook_xml())
+            package.writestr('xl/_rels/workbook.xml.rels', self.workbook_rels_xml())
+            package.writestr('xl/styles.xml', STYLES_XML)
+            for index, sheet in enumerate(self.sheets, 1):
+                with package.open('xl/worksheets/sheet%d.xml' % index, 'w', force_zip64=True) as handle:
+                    sheet.write_xml(handle)
+
+    def content_types_xml(self):
+        sheets = ''.join(
+            '<Override PartName="/xl/worksheets/sheet%d.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>' % index
+            for index in range(1, len(self.sheets) + 1))
+        return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                '<Override PartName="/xl/workbook.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                '<Override PartName="/xl/styles.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+                '%s</Types>' % sheets)
+
+    def workbook_xml(self):
+        sheets = ''.join('<sheet name=%s sheetId="%d" r:id="rId%d"/>' % (quoteattr(sheet.name), index, index)
+                         for index, sheet in enumerate(self.sheets, 1))
+        names = ''.join(
+            '<definedName name="_xlnm._FilterDatabase" localSheetId="%d" hidden="1">%s</definedName>' % (
+                sheet.index, escape("'%s'!%s" % (sheet.name.replace("'", "''"), absolute_range(sheet))))
+            for sheet in self.sheets if sheet.filter_range)
+        return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                '<bookViews><workbookView/></bookViews><sheets>%s</sheets>%s</workbook>'
+                % (sheets, '<definedNames>%s</definedNames>' % names if names else ''))
+
+    def workbook_rels_xml(self):
+        rels = ''.join(
+            '<Relationship Id="rId%d" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+            'Target="worksheets/sheet%d.xml"/>' % (index, index) for index in range(1, len(self.sheets) + 1))
+        rels += ('<Relationship Id="rId%d" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+                 'Target="styles.xml"/>' % (len(self.sheets) + 1))
+        return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">%s</Relationships>'
+                % rels)
+
+
+def absolute_range(sheet):
+    first_row, first_col, last_row, last_col = sheet.filter_range
+    return range_name(first_row, first_col, last_row, last_col, absolute=True)
+
+
+class RawXlsxBackend(XlsxWriterBackend):
+    """快速xlsx后端"""
+    name = 'xlsx'
+    sequential = True
+
+    def create_workbook(self, output, options):
+        return RawXlsxWorkbook(output, options)
+
+
+class CsvWorksheet(SequentialWorksheet):
+    """csv标签页，多个标签页依次写到同一个文件中，中间空一行"""
+
+    def write_cells(self, row, cells):
+        writer = self.workbook.writer
+        if self.index and self.row_count == 0:
+            writer.writerow([])
+        values = []
+        for col in range(self.max_col + 1):
+            value = cells.get(col)
+            values.append(u'' if value is None else value)
+        # 去掉行尾的空列
+        while values and values[-1] == u'':
+            values.pop()
+        writer.writerow(values)
+
+
+class CsvWorkbook(object):
+    """
+    csv后端的workbook，只输出单元格的值。文件带utf-8 BOM，execl可以直接打开中文内容
+    """
+
+    def __init__(self, output, options=None, delimiter=','):
+        self.output = output
+        self.sheets = []
+        self.fileclosed = False
+        if isinstance(output, str):
+            self.stream = io.open(output, 'w', encoding='utf-8-sig', newline='')
+        else:
+            self.stream = io.TextIOWrapper(output, encoding='utf-8-sig', newline='')
+        self.writer = csv.writer(self.stream, delimiter=delimiter)
+
+    def add_worksheet(self, name=None):
+        if self.sheets:
+            self.sheets[-1].flush_row()
+        sheet = CsvWorksheet(self, name or 'Sheet%d' % (len(self.sheets) + 1), len(self.sheets))
+        self.sheets.append(sheet)
+        return sheet
+
+    def add_format(self, properties=None):
+        return RawFormat(properties)
+
+    def worksheets(self):
+        return self.sheets
+
+    def close(self):
+        if self.fileclosed:
+            return
+        self.fileclosed = True
+        for sheet in self.sheets:
+            sheet.flush_row()
+        if isinstance(self.output, str):
+            self.stream.close()
+        else:
+            # 不关闭调用方传入的文件对象
+            self.stream.flush()
+            self.stream.detach()
+
+
+class CsvBackend(XlsxWriterBackend):
+    """csv后端"""
+    name = 'csv'
+    suffix = '.csv'
+    max_rows = None
+    sequential = True
+    delimiter = ','
+
+    def create_workbook(self, output, options):
+        return CsvWorkbook(output, options, delimiter=self.delimiter)
+
+
+class TsvBackend(CsvBackend):
+    """tsv后端"""
+    name = 'tsv'
+    suffix = '.tsv'
+    delimiter = '\t'
+
+
+BACKENDS = dict((backend.name, backend()) for backend in (XlsxWriterBackend, RawXlsxBackend, CsvBackend, TsvBackend))
+
+
+def get_backend(backend):
+    """
+    @desc 获取写入后端
+    :param backend: 后端名称 xlsxwriter、xlsx、csv、tsv，或者后端对象
+    :return:
+    """
+    if isinstance(backend, str):
+        try:
+            return BACKENDS[backend]
+        except KeyError:
+            raise ValueError(u"不支持的写入后端：{}".format(backend))
+    return backend
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+"""
+-------------------------------------------------
+   File Name：     execl_cache
+   Description :  导出文件的磁盘缓存，按内容哈希作为键，超出容量时按最近最少使用淘汰。
+   Author :       caiwanpeng
+   date：          2026/10/18
+-------------------------------------------------
+   Change Activity:
+                   2026/10/18:
+-------------------------------------------------
+"""
+__author__ = 'caiwanpeng'
+
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+
+class ExportCache(object):
+    """
+    导出文件缓存，一个键对应磁盘上的一个文件。
+    文件的mtime是写入时间，用来判断过期；atime是最近一次命中的时间，用来做LRU淘汰。
+    缓存文件的后缀按导出的文件类型保存，同一个目录可以同时缓存xlsx、csv等文件。
+    写入先写临时文件再改名，多进程共用同一个目录也不会读到写了一半的文件。
+    for example:
+    cache = ExportCache('/tmp/export_cache', max_bytes=1024 ** 3, ttl=3600)
+
+    class MyExport(XlsxWriterToExport):
+        export_cache = cache
+    """
+    TMP_SUFFIX = '.tmp'
+
+    def __init__(self, cache_dir, max_bytes=1024 ** 3, ttl=3600, suffix='.xlsx'):
+        """
+        :param cache_dir: 缓存目录
+        :param max_bytes: 缓存总大小上限
+        :param ttl: 缓存有效秒数，None表示不过期
+        :param suffix: get、put没有指定后缀时使用的缓存文件后缀
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.suffix = suffix
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        @desc 用任意可pickle的内容生成缓存键，内容无法pickle时返回None，表示不缓存
+        :param parts:
+        :return:
+        """
+        try:
+            content = pickle.dumps(parts, protocol=2)
+        except Exception:
+            return None
+        return hashlib.sha1(content).hexdigest()
+
+    def get_path(self, key, suffix=None):
+        return os.path.join(self.cache_dir, key + (self.suffix if suffix is None else suffix))
+
+    def get(self, key, suffix=None):
+        """
+        @desc 获取缓存文件路径，没有命中或已过期时返回None
+        :param key: 缓存键
+        :param suffix: 缓存文件后缀，默认为self.suffix
+        :return:
+        """
+        path = self.get_path(key, suffix)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        now = time.time()
+        if self.ttl is not None and now - stat.st_mtime > self.ttl:
+            self._remove(path)
+            return None
+        # 更新访问时间，保留写入时间
+        os.utime(path, (now, stat.st_mtime))
+        return path
+
+    def put(self, key, path=None, content=None, suffix=None):
+        """
+        @desc 把生成的文件或二进制内容放入缓存
+        :param key: 缓存键
+        :param path: 生成的文件路径
+        :param content: 生成的二进制内容或可读的文件对象，和path二选一
+        :param suffix: 缓存文件后缀，默认为self.suffix
+        :return: 缓存文件路径
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=self.TMP_SUFFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if path is not None:
+                    with open(path, 'rb') as src:
+                        shutil.copyfileobj(src, f)
+                elif hasattr(content, 'read'):
+                    shutil.copyfileobj(content, f)
+                else:
+                    f.write(content)
+            cache_path = self.get_path(key, suffix)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            self._remove(tmp_path)
+            raise
+        self.evict()
+        return cache_path
+
+    def evict(self):
+        """
+        @desc 删除过期的缓存，总大小超出上限时按最近访问时间从旧到新删除
+        :return:
+        """
+        now = time.time()
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.TMP_SUFFIX):
+                # 正在写入的临时文件
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if self.ttl is not None and now - stat.st_mtime > self.ttl:
+                self._remove(path)
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            self._remove(os.path.join(self.cache_dir, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if os.path.exists(path):
+                logging.error("delete export cache file is fail, error msg: {}".format(str(e)[:200]))
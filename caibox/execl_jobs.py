@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+"""
+-------------------------------------------------
+   File Name：     execl_jobs
+   Description :  导出任务调度。导出任务放入有界队列，由固定数量的工作线程(或进程)执行，
+                  调用方立即拿到任务句柄，不再在请求线程中同步生成文件。
+   Author :       caiwanpeng
+   date：          2026/10/18
+-------------------------------------------------
+   Change Activity:
+                   2026/10/18:
+-------------------------------------------------
+"""
+__author__ = 'caiwanpeng'
+
+import collections
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# 任务通道，按优先级从高到低：interactive 页面上等待下载的小导出，batch 后台的大批量导出
+LANES = ('interactive', 'batch')
+
+
+class ExportQueueFull(Exception):
+    """等待执行的任务数已达上限"""
+    pass
+
+
+def _run_export(export_class, data, export_name, kwargs):
+    # 在工作线程或子进程中生成文件，返回文件路径(create=False时返回二进制内容)
+    manager = export_class(data=data, export_name=export_name, auto_delete=False, **kwargs)
+    return manager.get_excel_url()
+
+
+def _remove_artifact(result):
+    # 删除任务生成的文件，内存模式的结果不需要删除
+    if isinstance(result, str) and os.path.exists(result):
+        try:
+            os.remove(result)
+        except OSError as e:
+            logging.error("delete export job file is fail, error msg: {}".format(str(e)[:200]))
+
+
+class ExportJob(object):
+    """
+    导出任务句柄，result/done/exception/add_done_callback同concurrent.futures.Future。
+    生成的文件一直保留，直到调用collect取走或discard删除；取走后文件由调用方负责删除。
+    """
+
+    def __init__(self, scheduler, export_class, data, export_name, lane, kwargs):
+        self.id = uuid.uuid4().hex[:12]
+        self.scheduler = scheduler
+        self.export_class = export_class
+        self.data = data
+        # 文件名加上任务id，同一个导出类的多个任务不会写到同一个文件
+        self.export_name = u'{}_{}'.format(export_name or export_class.export_name, self.id)
+        self.lane = lane
+        self.kwargs = kwargs
+        self.future = Future()
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.collected = False
+
+    @property
+    def status(self):
+        # pending 排队中，running 执行中，done 已完成，failed 失败，cancelled 已取消
+        if self.future.cancelled():
+            return 'cancelled'
+        if not self.future.done():
+            return 'running' if self.started else 'pending'
+        return 'failed' if self.future.exception() is not None else 'done'
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def exception(self, timeout=None):
+        return self.future.exception(timeout)
+
+    def done(self):
+        return self.future.done()
+
+    def add_done_callback(self, fn):
+        self.future.add_done_callback(lambda future: fn(self))
+
+    def cancel(self):
+        """
+        @desc 取消还在排队的任务，已经开始执行的任务不能取消
+        :return: 是否取消成功
+        """
+        return self.scheduler._cancel(self)
+
+    def collect(self, timeout=None):
+        """
+        @desc 取走生成的文件，调度器不再负责清理
+        :param timeout: 等待任务完成的秒数
+        :return: 文件路径或二进制内容
+        """
+        result = self.result(timeout)
+        self.scheduler._release(self)
+        self.collected = True
+        return result
+
+    def discard(self):
+        """
+        @desc 删除生成的文件；还在排队的任务直接取消，正在执行的任务在完成后由工作线程删除文件
+        :return:
+        """
+        self.scheduler._discard(self)
+
+
+class ExportScheduler(object):
+    """
+    导出任务调度器。
+    submit把任务放入对应通道的队列，排队的任务数超过max_queue时拒绝(或阻塞等待)，压力不会传到内存上；
+    max_workers个工作线程按通道优先级取任务执行，其中reserved_workers个只执行interactive任务，
+    大批量导出占满其他线程时，页面上的小导出仍然能马上执行。
+    use_processes为True时工作线程把任务交给进程池执行，导出类、数据和参数需要能被pickle。
+    for example:
+    scheduler = ExportScheduler(max_workers=4, max_queue=100)
+    job = scheduler.submit(OrderExport, lane='batch', start_date=start_date)
+    ...
+    path = job.collect(timeout=60)
+    """
+
+    def __init__(self, max_workers=4, max_queue=100, reserved_workers=1, use_processes=False, artifact_ttl=3600):
+        """
+        :param max_workers: 同时执行的任务数
+        :param max_queue: 最多排队的任务数
+        :param reserved_workers: 只执行interactive任务的工作线程数
+        :param use_processes: 是否在进程池中生成文件
+        :param artifact_ttl: 完成后没有取走的文件保留的秒数，超过后由purge删除；None表示一直保留
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.reserved_workers = min(reserved_workers, max_workers - 1) if max_workers > 1 else 0
+        self.artifact_ttl = artifact_ttl
+        self._queues = dict((lane, collections.deque()) for lane in LANES)
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._artifacts = {}
+        self._executor = ProcessPoolExecutor(max_workers=max_workers) if use_processes else None
+        self._workers = []
+        for index in range(max_workers):
+            lanes = LANES[:1] if index < self.reserved_workers else LANES
+            worker = threading.Thread(target=self._work, args=(lanes,), name='execl-export-{}'.format(index))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, export_class, data=None, export_name=None, lane='interactive', block=False, timeout=None,
+               **kwargs):
+        """
+        @desc 提交导出任务
+        :param export_class: XlsxWriterToExport的子类，data为None时在工作线程中调用get_execl_data获取数据
+        :param data: 数据
+        :param export_name: 文件名称，实际文件名为 名称_任务id，默认取export_class.export_name
+        :param lane: 任务通道，interactive或batch
+        :param block: 队列已满时是否等待
+        :param timeout: 等待的秒数，None表示一直等待
+        :param kwargs: 传给export_class的其他参数
+        :return: ExportJob
+        """
+        if lane not in self._queues:
+            raise ValueError(u'未知的任务通道：{}'.format(lane))
+        job = ExportJob(self, export_class, data, export_name, lane, kwargs)
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError(u'调度器已关闭')
+            if not self._cond.wait_for(lambda: self.pending() < self.max_queue, timeout if block else 0):
+                raise ExportQueueFull(u'排队的导出任务已达上限：{}'.format(self.max_queue))
+            self._queues[lane].append(job)
+            self._cond.notify_all()
+        return job
+
+    def pending(self):
+        # 排队中的任务数
+        return sum(len(jobs) for jobs in self._queues.values())
+
+    def _take(self, lanes):
+        # 按通道优先级取下一个任务，没有任务时等待；调度器关闭且队列为空时返回None
+        with self._cond:
+            while True:
+                for lane in lanes:
+                    if self._queues[lane]:
+                        job = self._queues[lane].popleft()
+                        # 唤醒等待入队的submit
+                        self._cond.notify_all()
+                        return job
+                if self._shutdown:
+                    return None
+                self._cond.wait()
+
+    def _work(self, lanes):
+        while True:
+            job = self._take(lanes)
+            if job is None:
+                return
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            job.started = time.time()
+            try:
+                if self._executor is not None:
+                    result = self._executor.submit(
+                        _run_export, job.export_class, job.data, job.export_name, job.kwargs).result()
+                else:
+                    result = _run_export(job.export_class, job.data, job.export_name, job.kwargs)
+            except Exception as e:
+                job.finished = time.time()
+                job.future.set_exception(e)
+            else:
+                with self._cond:
+                    job.finished = time.time()
+                    # 执行期间已经被丢弃的任务不再保留文件
+                    discarded = job.collected
+                    if not discarded:
+                        self._artifacts[job.id] = job
+                if discarded:
+                    _remove_artifact(result)
+                job.future.set_result(result)
+            # 任务数据不再需要
+            job.data = None
+
+    def _cancel(self, job):
+        with self._cond:
+            try:
+                self._queues[job.lane].remove(job)
+            except ValueError:
+                return False
+            self._cond.notify_all()
+        return job.future.cancel()
+
+    def _release(self, job):
+        with self._cond:
+            self._artifacts.pop(job.id, None)
+
+    def _discard(self, job):
+        if self._cancel(job):
+            job.collected = True
+            return
+        with self._cond:
+            job.collected = True
+            # 还在执行的任务由工作线程在完成时删除文件；失败、已取走或已删除的任务没有文件需要删除
+            if job.finished is None or self._artifacts.pop(job.id, None) is None:
+                return
+        _remove_artifact(job.future.result())
+
+    def artifacts(self):
+        # 已完成但没有取走的任务
+        with self._cond:
+            return list(self._artifacts.values())
+
+    def purge(self, max_age=None):
+        """
+        @desc 删除完成后超过max_age秒仍没有取走的文件
+        :param max_age: 秒数，默认为artifact_ttl
+        :return: 删除的任务数
+        """
+        max_age = self.artifact_ttl if max_age is None else max_age
+        if max_age is None:
+            return 0
+        now = time.time()
+        expired = [job for job in self.artifacts() if now - job.finished > max_age]
+        for job in expired:
+            job.discard()
+        return len(expired)
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """
+        @desc 关闭调度器，不再接受新任务
+        :param wait: 是否等待已提交的任务执行完
+        :param cancel_pending: 是否取消还在排队的任务
+        :return:
+        """
+        with self._cond:
+            self._shutdown = True
+            if cancel_pending:
+                for jobs in self._queues.values():
+                    while jobs:
+                        jobs.popleft().future.cancel()
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        return False
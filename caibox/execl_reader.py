@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+"""
+-------------------------------------------------
+   File Name：     execl_reader
+   Description :  按报表结构读取上传的xlsx文件，是XlsxWriterToExport的逆过程。
+                  直接从zip中用iterparse逐行解析sheet xml，读完一行即释放，内存占用不随文件行数增长；
+                  表头按报表结构映射回code，数据按批返回。
+   Author :       caiwanpeng
+   date：          2026/10/18
+-------------------------------------------------
+   Change Activity:
+                   2026/10/18:
+-------------------------------------------------
+"""
+__author__ = 'caiwanpeng'
+
+import datetime
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from caibox.execl_address import COLUMN_INDEX, DIGITS
+
+NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+# 内置的日期时间格式
+DATE_FORMAT_IDS = frozenset(list(range(14, 23)) + [45, 46, 47])
+# 去掉格式中引号、方括号里的内容和转义字符后，仍包含日期时间占位符的是日期格式
+DATE_FORMAT_IGNORE = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.|_.|\*.')
+DATE_FORMAT_TOKENS = re.compile(r'[dmyhs]', re.I)
+# 分组小计和合计行的标签
+SUMMARY_LABELS = (u'合计', u'小计')
+
+
+def is_date_format(format_code):
+    return bool(DATE_FORMAT_TOKENS.search(DATE_FORMAT_IGNORE.sub('', format_code)))
+
+
+class SchemaReader(object):
+    """
+    按报表结构读取xlsx：二级表头(以及一级表头)映射回每列的code，空单元格使用default。
+    共享字符串表需要整体载入，其余内容流式读取。
+    for example:
+    reader = SchemaReader(upload_file, OrderExport.report_schema, batch_size=1000)
+    for rows in reader.iter_batches():
+        Order.objects.bulk_create([Order(**row) for row in rows])
+    """
+
+    def __init__(self, file, schema, sheet=None, batch_size=1000, as_tuples=False, skip_summary=True, strict=True):
+        """
+        :param file: 文件路径或可seek的文件对象
+        :param schema: execl_schema.ReportSchema
+        :param sheet: 标签页名称或序号(从0开始)，默认第一个标签页
+        :param batch_size: iter_batches每批的行数
+        :param as_tuples: 为True时每行返回按报表结构列顺序的元组，否则返回{code: 值}
+        :param skip_summary: 是否跳过合计、小计行
+        :param strict: 表头中找不到报表结构的某一列时是否报错，为False时该列取default
+        """
+        self.file = file
+        self.schema = schema
+        self.sheet = sheet
+        self.batch_size = batch_size
+        self.as_tuples = as_tuples
+        self.skip_summary = skip_summary
+        self.strict = strict
+        # 序号等没有code的列不读取
+        self.columns = [column for column in schema.columns if column.code is not None]
+        head_rows = sorted(set(cell.cell[0] for cell in schema.head_cells))
+        self.head_rows = head_rows
+        self.data_row = head_rows[-1] + 1 if head_rows else max(schema.first_row, 0)
+
+    def __iter__(self):
+        for rows in self.iter_batches():
+            for row in rows:
+                yield row
+
+    def iter_batches(self):
+        """
+        @desc 按批返回数据行
+        :return:
+        """
+        with zipfile.ZipFile(self.file) as package:
+            sheet_path, date_1904 = self.find_sheet(package)
+            strings = self.read_shared_strings(package)
+            date_styles = self.read_date_styles(package)
+            epoch = datetime.datetime(1904, 1, 1) if date_1904 else datetime.datetime(1899, 12, 30)
+            heads = {}
+            indexes = None
+            batch = []
+            with package.open(sheet_path) as handle:
+                for row, cells in self.iter_rows(handle, strings, date_styles, epoch):
+                    if row < self.data_row:
+                        if row in self.head_rows:
+                            heads[row] = cells
+                        continue
+                    if indexes is None:
+                        indexes = self.map_columns(heads)
+                    if self.skip_summary and self.is_summary(cells):
+                        continue
+                    batch.append(self.make_row(cells, indexes))
+                    if len(batch) >= self.batch_size:
+                        yield batch
+                        batch = []
+            if batch:
+                yield batch
+
+    def find_sheet(self, package):
+        # 根据标签页名称或序号找到sheet xml的路径
+        workbook = ElementTree.fromstring(package.read('xl/workbook.xml'))
+        properties = workbook.find(NS + 'workbookPr')
+        date_1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+        sheets = workbook.find(NS + 'sheets')
+        sheets = [] if sheets is None else list(sheets)
+        if isinstance(self.sheet, int):
+            found = sheets[self.sheet] if self.sheet < len(sheets) else None
+        else:
+            found = next((sheet for sheet in sheets if self.sheet is None or sheet.get('name') == self.sheet), None)
+        if found is None:
+            raise ValueError(u'找不到标签页：{}'.format(self.sheet))
+        rels = ElementTree.fromstring(package.read('xl/_rels/workbook.xml.rels'))
+        rel_id = found.get(REL_NS + 'id')
+        target = next(rel.get('Target') for rel in rels.iter(PKG_REL_NS + 'Relationship') if rel.get('Id') == rel_id)
+        if target.startswith('/'):
+            return target[1:], date_1904
+        return posixpath.normpath(posixpath.join('xl', target)), date_1904
+
+    @staticmethod
+    def read_shared_strings(package):
+        # 共享字符串表，富文本把各段文字拼接起来
+        try:
+            handle = package.open('xl/sharedStrings.xml')
+        except KeyError:
+            return []
+        strings = []
+        with handle:
+            for event, elem in ElementTree.iterparse(handle):
+                if elem.tag == NS + 'si':
+                    strings.append(u''.join(text.text or u'' for text in elem.iter(NS + 't')))
+                    elem.clear()
+        return strings
+
+    @staticmethod
+    def read_date_styles(package):
+        # 数字格式为日期时间的样式序号
+        try:
+            styles = ElementTree.fromstring(package.read('xl/styles.xml'))
+        except KeyError:
+            return frozenset()
+        date_formats = set(DATE_FORMAT_IDS)
+        num_formats = styles.find(NS + 'numFmts')
+        for num_format in (num_formats if num_formats is not None else []):
+            if is_date_format(num_format.get('formatCode', '')):
+                date_formats.add(int(num_format.get('numFmtId')))
+        cell_xfs = styles.find(NS + 'cellXfs')
+        return frozenset(index for index, xf in enumerate(cell_xfs if cell_xfs is not None else [])
+                         if int(xf.get('numFmtId', 0)) in date_formats)
+
+    @staticmethod
+    def iter_rows(handle, strings, date_styles, epoch, chunk_size=64 * 1024):
+        """
+        @desc 逐行解析sheet xml，每行返回(行号, {列号: 值})，行号和列号从0开始
+        :return:
+        """
+        target = SheetRowTarget(strings, date_styles, epoch)
+        parser = ElementTree.XMLParser(target=target)
+        while True:
+            chunk = handle.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            # 每次只缓存一块数据解析出的行
+            if target.rows:
+                rows, target.rows = target.rows, []
+                for row in rows:
+                    yield row
+        parser.close()
+        for row in target.rows:
+            yield row
+
+    def map_columns(self, heads):
+        """
+        @desc 把表头映射到报表结构的列：优先按(一级表头, 二级表头)匹配，其次按唯一的二级表头匹配
+        :param heads: {行号: {列号: 表头文字}}
+        :return: 报表结构每一列在文件中的列号，找不到时为None
+        """
+        child_row = heads.get(self.head_rows[-1], {}) if self.head_rows else {}
+        parent_row = heads.get(self.head_rows[0], {}) if len(self.head_rows) > 1 else {}
+        pairs = {}
+        children = {}
+        parent = u''
+        for col in sorted(child_row):
+            # 合并单元格只有第一格有内容，向右延续
+            if parent_row.get(col) not in (None, u''):
+                parent = parent_row[col]
+            head = u'{}'.format(child_row[col]).strip()
+            pairs.setdefault((u'{}'.format(parent).strip(), head), col)
+            children.setdefault(head, []).append(col)
+        indexes = []
+        missing = []
+        for column in self.columns:
+            col = pairs.get((u'{}'.format(column.parent).strip(), u'{}'.format(column.head).strip()))
+            if col is None:
+                cols = children.get(u'{}'.format(column.head).strip(), [])
+                col = cols[0] if len(cols) == 1 else None
+            if col is None:
+                missing.append(column.head)
+            indexes.append(col)
+        if missing and self.strict:
+            raise ValueError(u'表头中缺少列：{}'.format(u'，'.join(u'{}'.format(head) for head in missing)))
+        return indexes
+
+    @staticmethod
+    def is_summary(cells):
+        first = cells.get(min(cells)) if cells else None
+        return isinstance(first, str) and first.startswith(SUMMARY_LABELS)
+
+    def make_row(self, cells, indexes):
+        values = []
+        for column, col in zip(self.columns, indexes):
+            value = cells.get(col) if col is not None else None
+            values.append(column.default if value is None or value == u'' else value)
+        if self.as_tuples:
+            return tuple(values)
+        return dict(zip([column.code for column in self.columns], values))
+
+
+class SheetRowTarget(object):
+    """
+    sheet xml的解析回调，不创建Element，每读完一行把(行号, {列号: 值})放入rows
+    """
+
+    def __init__(self, strings, date_styles, epoch):
+        self.strings = strings
+        self.date_styles = date_styles
+        self.epoch = epoch
+        self.rows = []
+        self.cells = None
+        self.next_row = 0
+        self.next_col = 0
+        self.row = 0
+        self.col = 0
+        self.cell_type = None
+        self.style = None
+        self.text = None
+        self.phonetic = False
+
+    def start(self, tag, attrib):
+        tag = tag[len(NS):]
+        if tag == 'c':
+            ref = attrib.get('r')
+            if ref:
+                col = COLUMN_INDEX[ref.rstrip(DIGITS)]
+            else:
+                col = self.next_col
+            self.col = col
+            self.next_col = col + 1
+            self.cell_type = attrib.get('t', 'n')
+            self.style = attrib.get('s')
+            self.text = []
+        elif tag == 'row':
+            ref = attrib.get('r')
+            self.row = int(ref) - 1 if ref else self.next_row
+            self.next_row = self.row + 1
+            self.next_col = 0
+            self.cells = {}
+        elif tag == 'rPh':
+            # 注音文字不属于单元格内容
+            self.phonetic = True
+
+    def data(self, text):
+        if self.text is not None and not self.phonetic:
+            self.text.append(text)
+
+    def end(self, tag):
+        tag = tag[len(NS):]
+        if tag == 'c':
+            self.end_cell()
+        elif tag == 'row':
+            self.rows.append((self.row, self.cells))
+            self.cells = None
+        elif tag == 'rPh':
+            self.phonetic = False
+        elif tag not in ('v', 't', 'is', 'r') and self.text:
+            # 公式等其他内容不计入单元格的值
+            self.text = []
+
+    def end_cell(self):
+        text, self.text = self.text, None
+        if not text:
+            return
+        value = u''.join(text)
+        cell_type = self.cell_type
+        if cell_type == 's':
+            value = self.strings[int(value)]
+        elif cell_type == 'b':
+            value = value == '1'
+        elif cell_type == 'n':
+            number = float(value)
+            if self.style and int(self.style) in self.date_styles:
+                value = self.epoch + datetime.timedelta(days=number)
+            else:
+                value = int(number) if number.is_integer() and 'E' not in value else number
+        self.cells[self.col] = value
+
+    def close(self):
+        return None
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+"""
+-------------------------------------------------
+   File Name：     execl_schema
+   Description :  报表结构。把add_table_head的各列配置编译成不可变的表头和列信息，同一个导出类只编译一次，
+                  每次导出只解析格式并写入，不再重复计算表头位置和列宽。
+   Author :       caiwanpeng
+   date：          2026/10/18
+-------------------------------------------------
+   Change Activity:
+                   2026/10/18:
+-------------------------------------------------
+"""
+__author__ = 'caiwanpeng'
+
+import itertools
+import threading
+from collections import namedtuple
+
+# 一个表头单元格：type为write或merge，cell为(row, col)或(first_row, first_col, last_row, last_col)
+HeadCell = namedtuple('HeadCell', 'type cell content comment')
+# 一列内容：format是格式属性字典、格式名、None(不使用格式)或CONTENT_FORMAT(没有指定，使用content_format)；
+# parent、head是一级、二级表头的文字
+SchemaColumn = namedtuple('SchemaColumn', 'code default width format type parent head')
+
+
+class _ContentFormat(object):
+    # 列没有指定format时的占位，和显式指定的None区分开；pickle后仍是同一个对象
+    def __repr__(self):
+        return 'CONTENT_FORMAT'
+
+    def __reduce__(self):
+        return 'CONTENT_FORMAT'
+
+
+CONTENT_FORMAT = _ContentFormat()
+
+
+def layout_group(parent_head, child_list, title=None, head_row=2, first_row=0, first_col=0):
+    """
+    @desc 计算一组列的表头单元格和列信息，规则和add_table_head相同
+    :param parent_head: 一级表头的显示文字
+    :param child_list: 这一列(或者多列)的内容信息，同add_table_head
+    :param title: 标题的批注
+    :param head_row: 表头占多少行
+    :param first_row: 开始行号，-1表示只有一行表头
+    :param first_col: 开始列号
+    :return: (表头单元格列表, 列信息列表)
+    """
+    child_list = [child_list] if isinstance(child_list, dict) else child_list
+    cells = []
+    # 表头只占一行的
+    if first_row == -1:
+        pass
+    # 表头只占一行的
+    elif head_row == 1:
+        first_row -= 1
+    # 合并一级表头
+    elif len(child_list) == 1:
+        if child_list[0].get('head'):
+            cells.append(HeadCell('write', (first_row, first_col), parent_head, title))
+        else:
+            cells.append(HeadCell('merge', (first_row, first_col, first_row + 1, first_col), parent_head, title))
+    else:
+        cells.append(HeadCell('merge', (first_row, first_col, first_row, first_col + len(child_list) - 1),
+                              parent_head, title))
+    columns = []
+    for col, child in enumerate(child_list, first_col):
+        head = child.get('head', parent_head)
+        width = child.get('width', None)
+        if width is None:
+            width = max(len(u'{}'.format(head)) * 2, 12)
+        columns.append(SchemaColumn(child.get('code'), child.get('default', ''), width, child.get('format', CONTENT_FORMAT),
+                                    child.get('type'), parent_head, head))
+        # 二级表头
+        cells.append(HeadCell('write', (first_row + 1, col), head, child.get('title', title)))
+    return cells, columns
+
+# 预先计算好的表头块。rows：[(行号, 连续单元格段[(first_col, 内容元组, 格式)], 合并单元格[(cell, 内容, 格式)])]；
+# comments：去重后的批注[(行号, first_col, last_col, 文字)]
+HeadBlock = namedtuple('HeadBlock', 'rows comments')
+
+
+def build_head_block(head_cells):
+    """
+    @desc 把表头单元格整理成按行写入的表头块：同一行相邻、同格式的单元格合并成一次write_row；
+    批注和上方覆盖它的单元格相同时(子列继承一级表头的批注)不再重复，同一行相邻的相同批注合并成一段
+    :param head_cells: 可迭代的(type, cell, content, format, comment)，cell为数字坐标
+    :return: HeadBlock
+    """
+    head_cells = sorted(head_cells, key=lambda item: (item[1][0], item[1][1]))
+    rows = []
+    comments = []
+    # 每列最近一个覆盖它的表头单元格的批注
+    covered = {}
+    for row, items in itertools.groupby(head_cells, key=lambda item: item[1][0]):
+        runs = []
+        merges = []
+        row_covered = {}
+        for c_type, cell, content, format, comment in items:
+            first_col = cell[1]
+            if c_type == 'merge':
+                last_col = cell[3]
+                merges.append((tuple(cell), content, format))
+            else:
+                last_col = first_col
+                if runs and runs[-1][0] + len(runs[-1][1]) == first_col and runs[-1][2] is format:
+                    runs[-1][1].append(content)
+                else:
+                    runs.append((first_col, [content], format))
+            cols = range(first_col, last_col + 1)
+            if comment and any(covered.get(col) != comment for col in cols):
+                last = comments[-1] if comments else None
+                if last and last[0] == row and last[2] == first_col - 1 and last[3] == comment:
+                    comments[-1] = (row, last[1], last_col, comment)
+                else:
+                    comments.append((row, first_col, last_col, comment))
+            for col in cols:
+                row_covered[col] = comment
+        covered.update(row_covered)
+        rows.append((row, tuple((first_col, tuple(contents), format) for first_col, contents, format in runs),
+                     tuple(merges)))
+    return HeadBlock(tuple(rows), tuple(comments))
+
+
+class ReportSchema(object):
+    """
+    不可变的报表结构，声明各组列，第一次使用时编译，之后直接复用编译结果；作为导出类的类属性时每个类只编译一次。
+    列的format、head_format、content_format使用属性字典或add_formats中的格式名，不能使用Format对象，
+    因为Format对象属于某一个workbook。
+    for example:
+    class OrderExport(XlsxWriterToExport):
+        report_schema = ReportSchema([
+            (u'序号', {'type': 'index'}),
+            (u'基本信息', [{'code': 'name', 'head': u'姓名'}, {'code': 'age', 'head': u'年龄', 'type': 'sum', 'format': 'int'}]),
+        ], group_by='city')
+
+        def add_sheets(self):
+            ws = self.workbook.add_worksheet(u'明细')
+            self.add_table(ws)
+    """
+    __slots__ = ('groups', 'head_row', 'first_row', 'first_col', 'head_format', 'content_format', 'group_by',
+                 '_compiled', '_lock')
+
+    def __init__(self, groups, head_row=2, first_row=0, first_col=0, head_format='head', content_format=None,
+                 group_by=None):
+        """
+        :param groups: 各组列，每组为(parent_head, child_list)或(parent_head, child_list, title)，参数同add_table_head
+        :param head_row: 表头占多少行
+        :param first_row: 开始行号，-1表示只有一行表头
+        :param first_col: 开始列号
+        :param head_format: 表头格式
+        :param content_format: 内容的默认格式
+        :param group_by: 分组小计的字段，同add_table_data
+        """
+        set_attr = super(ReportSchema, self).__setattr__
+        set_attr('groups', tuple(tuple(group) for group in groups))
+        set_attr('head_row', head_row)
+        set_attr('first_row', first_row)
+        set_attr('first_col', first_col)
+        set_attr('head_format', head_format)
+        set_attr('content_format', content_format)
+        set_attr('group_by', group_by)
+        set_attr('_compiled', None)
+        set_attr('_lock', threading.Lock())
+
+    def __setattr__(self, name, value):
+        raise AttributeError(u'ReportSchema is immutable')
+
+    def compile(self):
+        """
+        @desc 计算表头单元格、列信息和列宽分段，只计算一次
+        :return: (表头单元格, 列信息, 列宽分段[(first_col, last_col, width)], 表头块)
+        """
+        compiled = self._compiled
+        if compiled is not None:
+            return compiled
+        with self._lock:
+            if self._compiled is None:
+                cells, columns = [], []
+                col = self.first_col
+                for group in self.groups:
+                    parent_head, child_list = group[0], group[1]
+                    title = group[2] if len(group) > 2 else None
+                    group_cells, group_columns = layout_group(parent_head, child_list, title, self.head_row,
+                                                              self.first_row, col)
+                    cells.extend(group_cells)
+                    columns.extend(group_columns)
+                    col += len(group_columns)
+                # 相邻同宽的列合并成一次set_column
+                widths = []
+                for col, column in enumerate(columns, self.first_col):
+                    if widths and widths[-1][2] == column.width and widths[-1][1] == col - 1:
+                        widths[-1] = (widths[-1][0], col, column.width)
+                    else:
+                        widths.append((col, col, column.width))
+                # 按行号排序，写入时不用再排序
+                cells.sort(key=lambda item: item.cell[0])
+                # 表头格式在写入时才确定，表头块中的格式为None
+                head_block = build_head_block((cell.type, cell.cell, cell.content, None, cell.comment) for cell in cells)
+                super(ReportSchema, self).__setattr__('_compiled', (tuple(cells), tuple(columns), tuple(widths),
+                                                                    head_block))
+        return self._compiled
+
+    @property
+    def definition(self):
+        # 构造参数，结构相同的两个ReportSchema结果相同，用于生成导出缓存的键
+        return (self.groups, self.head_row, self.first_row, self.first_col, self.head_format, self.content_format,
+                self.group_by)
+
+    @property
+    def head_cells(self):
+        return self.compile()[0]
+
+    @property
+    def columns(self):
+        return self.compile()[1]
+
+    @property
+    def last_col(self):
+        # 表格之后的下一列
+        return self.first_col + len(self.columns)
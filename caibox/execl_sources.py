@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+"""
+-------------------------------------------------
+   File Name：     execl_sources
+   Description :  分页数据源。导出时按页获取数据，后台线程预取下一页，数据库读取和写入execl同时进行。
+   Author :       caiwanpeng
+   date：          2026/10/18
+-------------------------------------------------
+   Change Activity:
+                   2026/10/18:
+-------------------------------------------------
+"""
+__author__ = 'caiwanpeng'
+
+import queue
+import threading
+
+# 队列中表示数据源已读完的标记
+_END = object()
+
+
+class PagedSource(object):
+    """
+    分页数据源，子类重写fetch_page按页号返回一页数据，返回空列表表示没有更多数据。
+    数据源协议只有一个方法iter_pages，依次返回每一页的行列表，XlsxWriterToExport遇到带iter_pages的数据源时会用PrefetchSource预取。
+    for example:
+    class OrderSource(PagedSource):
+        def fetch_page(self, page, page_size):
+            return list(Order.objects.order_by('id')[page * page_size:(page + 1) * page_size])
+
+    class OrderExport(XlsxWriterToExport):
+        def get_execl_data(self):
+            return OrderSource(page_size=5000)
+    """
+    page_size = 1000
+
+    def __init__(self, page_size=None):
+        """
+        :param page_size: 每页行数，默认取类属性
+        """
+        if page_size:
+            self.page_size = page_size
+
+    def fetch_page(self, page, page_size):
+        """
+        @desc 获取一页数据，需要重写此接口
+        :param page: 页号，从0开始
+        :param page_size: 每页行数
+        :return: 行列表，空列表表示没有更多数据
+        """
+        raise NotImplementedError
+
+    def iter_pages(self):
+        page = 0
+        while True:
+            rows = self.fetch_page(page, self.page_size)
+            if not rows:
+                return
+            yield rows
+            # 不足一页说明已经是最后一页，省去一次查询
+            if len(rows) < self.page_size:
+                return
+            page += 1
+
+    def __iter__(self):
+        for rows in self.iter_pages():
+            for row in rows:
+                yield row
+
+
+class CursorSource(PagedSource):
+    """
+    DB-API游标数据源，用fetchmany分批读取查询结果
+    for example:
+    cursor = connection.cursor()
+    cursor.execute('select id, name from orders')
+    export = OrderExport(data=CursorSource(cursor, page_size=5000))
+    """
+
+    def __init__(self, cursor, page_size=None, close_cursor=False):
+        """
+        :param cursor: 已执行查询的游标
+        :param page_size: 每次fetchmany的行数，默认取类属性
+        :param close_cursor: 读完后是否关闭游标
+        """
+        super(CursorSource, self).__init__(page_size)
+        self.cursor = cursor
+        self.close_cursor = close_cursor
+
+    def iter_pages(self):
+        try:
+            while True:
+                rows = self.cursor.fetchmany(self.page_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            if self.close_cursor:
+                self.cursor.close()
+
+
+class PrefetchSource(object):
+    """
+    预取数据源：后台线程读取分页数据源的下一页，当前页在主线程写入。
+    队列最多缓存max_pages页，写入慢于读取时读取线程阻塞，内存占用有上限；
+    读取线程的异常在主线程取到该页时抛出；提前停止遍历时读取线程在当前页读完后退出。
+    只能遍历一次。
+    """
+
+    def __init__(self, source, max_pages=2, stats=None):
+        """
+        :param source: 带iter_pages的分页数据源
+        :param max_pages: 最多预取的页数
+        :param stats: 导出统计对象，等待读取线程的时间记入fetch阶段
+        """
+        self.source = source
+        self.max_pages = max_pages
+        self.stats = stats
+        self._queue = queue.Queue(maxsize=max(max_pages, 1))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _fetch(self):
+        pages = self.source.iter_pages()
+        try:
+            for rows in pages:
+                if not self._put(rows):
+                    return
+        except BaseException as e:
+            self._put(e)
+        else:
+            self._put(_END)
+        finally:
+            # 提前停止时关闭分页生成器，执行数据源的清理，如关闭游标
+            close = getattr(pages, 'close', None)
+            if close is not None:
+                close()
+
+    def _put(self, item):
+        # 队列满时定时检查是否已停止，避免主线程提前退出后读取线程一直阻塞
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self):
+        if self.stats is None:
+            return self._queue.get()
+        with self.stats.phase('fetch'):
+            return self._queue.get()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._fetch, name='execl-prefetch')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+
+    def __iter__(self):
+        self.start()
+        try:
+            while True:
+                rows = self._get()
+                if rows is _END:
+                    return
+                if isinstance(rows, BaseException):
+                    raise rows
+                for row in rows:
+                    yield row
+        finally:
+            self.close()
@@ -6,96 +6,637 @@ __author__ = "caiwanpeng"
 
 import sys
 import os, datetime
+import decimal
+import time
 import types
 import logging
+import contextlib
+import functools
+import asyncio
+import itertools
+import operator
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
 
-import xlsxwriter
+from caibox.execl_address import COLUMN_LETTERS, range_index
+from caibox.execl_backends import get_backend
+from caibox.execl_reader import SchemaReader
+from caibox.execl_schema import CONTENT_FORMAT, build_head_block, layout_group
+from caibox.execl_sources import PrefetchSource
 
-PY = sys.version_info[0]
-if int(PY) == 2:
-    basestring = basestring
-    unicode = unicode
-    from StringIO import StringIO
-else:
-    basestring = str
-    unicode = str
-    from io import StringIO
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 只支持python3(使用了async def)，保留basestring的名称
+basestring = str
+
+
+# 内存文件系统，fast配置的临时文件放在这里
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
+
+# 导出性能配置，按类属性profile或profile参数选择。
+# compresslevel:zip压缩级别(None为默认的6，xlsxwriter后端指定级别时关闭后重新打包)；tmpdir:临时文件目录；strings_to_numbers/strings_to_urls/strings_to_formulas:
+# 是否识别文本中的数字、网址、公式；constant_memory:流式写入，xlsxwriter此时使用内联字符串，不生成共享字符串表。
+# 实测(5万行×8列，以文本为主，写入+关闭，取3次中最快)：不使用配置、fast、balanced 8.3-9.0s 2536KB，差异在测量误差内；
+# small 11.1s 1862KB，内存占用约为其他配置的1/3
+EXPORT_PROFILES = {
+    # 最快：不识别网址和公式，默认压缩级别(指定级别需要重新打包，反而更慢)，临时文件放在内存文件系统
+    'fast': {'compresslevel': None, 'tmpdir': SHM_DIR, 'strings_to_numbers': False, 'strings_to_urls': False,
+             'strings_to_formulas': False, 'constant_memory': False},
+    # 均衡：不识别网址，默认压缩级别，共享字符串表
+    'balanced': {'compresslevel': None, 'tmpdir': None, 'strings_to_numbers': False, 'strings_to_urls': False,
+                 'strings_to_formulas': True, 'constant_memory': False},
+    # 文件和内存最小：流式写入，按最高压缩级别重新打包，耗时最长
+    'small': {'compresslevel': 9, 'tmpdir': None, 'strings_to_numbers': False, 'strings_to_urls': False,
+              'strings_to_formulas': True, 'constant_memory': True},
+}
+
+
+class FormatRegistry(object):
+    """
+    @desc workbook的格式注册表，属性相同的格式在同一个workbook中只创建一次
+    """
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._formats = {}
+
+    @staticmethod
+    def normalize(properties):
+        """
+        @desc 把格式属性转换为可哈希的键：属性名小写，颜色值小写
+        :param properties: 格式属性字典
+        :return:
+        """
+        items = []
+        for key, value in properties.items():
+            key = key.lower()
+            if key.endswith('color') and isinstance(value, basestring):
+                value = value.strip().lower()
+            items.append((key, value))
+        return tuple(sorted(items))
+
+    def get(self, properties=None):
+        """
+        @desc 获取属性对应的格式，不存在时才调用add_format创建
+        :param properties: 格式属性字典
+        :return: xlsxwriter的Format对象
+        """
+        key = self.normalize(properties or {})
+        format = self._formats.get(key)
+        if format is None:
+            format = self._formats[key] = self.workbook.add_format(dict(key))
+        return format
+
+    def __len__(self):
+        return len(self._formats)
+
+
+class ColumnAggregator(object):
+    """
+    @desc 统计行的累计器，写数据行的同时逐行累计，生成统计行时不需要再遍历数据源
+    支持的列类型：sum 合计，count 计数(非空值个数)，avg 平均值，min 最小值，max 最大值
+    """
+    AGGREGATES = ('sum', 'count', 'avg', 'min', 'max')
+
+    def __init__(self, col_type):
+        self.col_type = col_type
+        self.indexes = [index for index, this_type in enumerate(col_type) if this_type in self.AGGREGATES]
+        self.sums = [0.0] * len(col_type)
+        self.counts = [0] * len(col_type)
+        self.mins = [None] * len(col_type)
+        self.maxs = [None] * len(col_type)
+
+    def add(self, values):
+        """
+        @desc 累计一行数据
+        :param values: 一行各列的值
+        :return:
+        """
+        for index in self.indexes:
+            value = values[index]
+            if value is None or value == '':
+                continue
+            self.counts[index] += 1
+            if self.col_type[index] == 'count':
+                continue
+            value = float(value)
+            self.sums[index] += value
+            if self.mins[index] is None or value < self.mins[index]:
+                self.mins[index] = value
+            if self.maxs[index] is None or value > self.maxs[index]:
+                self.maxs[index] = value
+
+    def result(self, index):
+        """
+        @desc 获取某一列的统计结果，不是统计列时返回空字符串
+        :param index: 列号
+        :return:
+        """
+        this_type = self.col_type[index]
+        if this_type == 'sum':
+            return self.sums[index]
+        elif this_type == 'count':
+            return self.counts[index]
+        elif this_type == 'avg':
+            return self.sums[index] / self.counts[index] if self.counts[index] else u''
+        elif this_type == 'min':
+            return u'' if self.mins[index] is None else self.mins[index]
+        elif this_type == 'max':
+            return u'' if self.maxs[index] is None else self.maxs[index]
+        return u''
+
+    def merge(self, other):
+        """
+        @desc 累加另一个累计器的结果，用于合并各分片同一表格的统计
+        :param other: 列类型相同的ColumnAggregator
+        :return: self
+        """
+        for index in self.indexes:
+            self.counts[index] += other.counts[index]
+            self.sums[index] += other.sums[index]
+            if other.mins[index] is not None and (self.mins[index] is None or other.mins[index] < self.mins[index]):
+                self.mins[index] = other.mins[index]
+            if other.maxs[index] is not None and (self.maxs[index] is None or other.maxs[index] > self.maxs[index]):
+                self.maxs[index] = other.maxs[index]
+        return self
+
+    @staticmethod
+    def merge_summaries(parts):
+        """
+        @desc 合并同一表格的多份统计结果，分组按第一次出现的顺序
+        :param parts: [(分组小计字典, 合计累计器)]
+        :return: (分组小计字典, 合计累计器)
+        """
+        groups = {}
+        total = None
+        for part_groups, part_total in parts:
+            if total is None:
+                total = ColumnAggregator(part_total.col_type)
+            total.merge(part_total)
+            for key, group in part_groups.items():
+                merged = groups.get(key)
+                if merged is None:
+                    merged = groups[key] = ColumnAggregator(group.col_type)
+                merged.merge(group)
+        return groups, total
+
+    @staticmethod
+    def aggregate(this_type, values):
+        """
+        @desc 对一整列的值做统计，用于按列写入的数据源
+        :param this_type: 列类型
+        :param values: 这一列的值
+        :return: 统计结果，不是统计列时返回空字符串
+        """
+        if this_type not in ColumnAggregator.AGGREGATES:
+            return u''
+        # 去掉空值和NaN
+        values = [value for value in values if value is not None and value == value and value != '']
+        if this_type == 'count':
+            return len(values)
+        numbers = [float(value) for value in values]
+        if this_type == 'sum':
+            return sum(numbers)
+        if not numbers:
+            return u''
+        if this_type == 'avg':
+            return sum(numbers) / len(numbers)
+        return min(numbers) if this_type == 'min' else max(numbers)
+
+
+class _NullPhase(object):
+    # 不做任何记录的阶段计时
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class NullExportStats(object):
+    """
+    @desc 默认的导出统计对象，不做任何记录
+    """
+    _phase = _NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def add_rows(self, rows, cells):
+        pass
+
+    def finish(self, exporter):
+        pass
+
+
+NULL_STATS = NullExportStats()
+
+
+def stats_phase(name):
+    """
+    @desc 把方法的耗时记入导出统计的某个阶段
+    :param name: 阶段名称
+    :return:
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.stats.phase(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ExportStats(NullExportStats):
+    """
+    @desc 一次导出的统计信息：各阶段耗时(秒)、写入行数和单元格数、格式数量、输出字节数、内存峰值(KB)。
+    process_peak_rss 是进程启动以来的峰值内存，常驻的工作进程中只增不减；
+    peak_rss_growth 是本次导出使进程峰值增加的量，之前已有更高的峰值时为0
+    阶段：fetch 获取数据，head 表头和格式设置，rows 写入数据行，close 关闭workbook(压缩打包)；
+    阶段之间互不包含，嵌套时外层阶段暂停计时；total 为整个导出的耗时
+    for example:
+    class MyExport(XlsxWriterToExport):
+        stats_class = functools.partial(ExportStats, callback=lambda stats: statsd.send(stats.as_dict()))
+    """
+
+    def __init__(self, callback=None):
+        """
+        :param callback: 导出完成后的回调，参数为当前统计对象
+        """
+        self.callback = callback
+        self.phases = {}
+        self.total = 0
+        self.started = time.time()
+        self._stack = []
+        self.rows = 0
+        self.cells = 0
+        self.formats = 0
+        self.output_bytes = 0
+        self.process_peak_rss = None
+        self.peak_rss_growth = None
+        self._start_rss = self.get_peak_rss()
+        self.export_name = None
+
+    @staticmethod
+    def get_peak_rss():
+        # 进程的峰值内存(KB)，没有resource模块(Windows)时为None
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        now = time.time()
+        if self._stack:
+            # 暂停外层阶段
+            parent, start = self._stack[-1]
+            self.phases[parent] = self.phases.get(parent, 0) + now - start
+        self._stack.append((name, now))
+        try:
+            yield self
+        finally:
+            now = time.time()
+            name, start = self._stack.pop()
+            self.phases[name] = self.phases.get(name, 0) + now - start
+            if self._stack:
+                self._stack[-1] = (self._stack[-1][0], now)
+
+    def add_rows(self, rows, cells):
+        self.rows += rows
+        self.cells += cells
+
+    def finish(self, exporter):
+        """
+        @desc 导出完成时记录格式数量、输出大小和峰值内存，并调用回调
+        :param exporter: 导出对象
+        :return:
+        """
+        self.total = time.time() - self.started
+        self.export_name = exporter.export_name
+        formats = getattr(exporter, 'formats', None)
+        self.formats = len(formats) if formats is not None else 0
+        self.output_bytes = exporter.get_output_size()
+        self.process_peak_rss = self.get_peak_rss()
+        if self.process_peak_rss is not None:
+            self.peak_rss_growth = self.process_peak_rss - self._start_rss
+        if self.callback is not None:
+            self.callback(self)
+
+    def as_dict(self):
+        return {'export_name': self.export_name, 'phases': dict(self.phases), 'total': self.total, 'rows': self.rows,
+                'cells': self.cells, 'formats': self.formats, 'output_bytes': self.output_bytes,
+                'process_peak_rss': self.process_peak_rss, 'peak_rss_growth': self.peak_rss_growth}
+
+
+class SheetBuilder(object):
+    """
+    @desc 一个标签页的声明：名称、报表结构和数据源。
+    XlsxWriterToExport.add_sheet_builders在线程池中同时获取各标签页的数据并转换成值列表，再按声明顺序写入同一个workbook
+    for example:
+    class MonthReport(XlsxWriterToExport):
+        def get_sheet_builders(self):
+            return [SheetBuilder(u'订单', ORDER_SCHEMA, lambda: query_orders(self.kwargs['month'])),
+                    SheetBuilder(u'退款', REFUND_SCHEMA, lambda: query_refunds(self.kwargs['month']), add_sum_line=False)]
+    """
+
+    def __init__(self, name, schema, source, add_sum_line=True):
+        """
+        :param name: 标签页名称
+        :param schema: execl_schema.ReportSchema
+        :param source: 数据源，列表、可迭代对象，或者返回数据源的函数(在工作线程中调用)
+        :param add_sum_line: 是否需要加上统计行
+        """
+        self.name = name
+        self.schema = schema
+        self.source = source
+        self.add_sum_line = add_sum_line
+
+    def prepare(self):
+        """
+        @desc 获取数据并转换成按列顺序的值列表，分组小计的字段值放在每行最后；在工作线程中执行
+        :return: 值列表的列表
+        """
+        source = self.source() if callable(self.source) else self.source
+        rows = iter(source)
+        first = next(rows, None)
+        if first is None:
+            return []
+        rows = itertools.chain((first,), rows)
+        columns = self.schema.columns
+        accessors = XlsxWriterToExport.compile_accessors(
+            [column.code for column in columns], [column.default for column in columns],
+            [column.type for column in columns], first)
+        if self.schema.group_by is not None:
+            accessors.append(XlsxWriterToExport.compile_accessors([self.schema.group_by], [u''], [None], first)[0])
+        return [[accessor(obj) for accessor in accessors] for obj in rows]
 
 
 class XlsxWriterToExport(object):
     export_name = None
     file_dir = None
     is_private = True
+    # 流式导出：使用xlsxwriter的constant_memory模式，写完一行即落盘，内存占用不随行数增长
+    constant_memory = False
+    # 单个标签页的最大行数，超出后自动新建标签页并重复表头
+    max_sheet_rows = 1048576
+    # 对象销毁时是否删除生成的本地文件
+    auto_delete = True
+    # 分块输出时每块的字节数
+    chunk_size = 64 * 1024
+    # 内存模式下超过该字节数后转存到磁盘临时文件，None表示始终放在内存中
+    spool_max_size = None
+    # 内存模式下是否在生成后把内容复制到res，关闭后res为get_buffer()的结果，不再复制
+    eager_output = True
+    # 导出文件缓存 execl_cache.ExportCache，相同参数的导出直接返回缓存的文件
+    export_cache = None
+    # 导出统计对象的工厂，如ExportStats，每次导出创建一个；None表示不统计
+    stats_class = None
+    # 写入后端：xlsxwriter 功能完整；xlsx 直接生成xml的快速后端，不支持样式；csv、tsv 纯文本
+    backend = 'xlsxwriter'
+    # 分页数据源(带iter_pages，如execl_sources.PagedSource)最多预取的页数，0表示不使用后台线程预取
+    prefetch_pages = 2
+    # 导出性能配置：EXPORT_PROFILES中的名称(fast、balanced、small)或同样键的字典，None表示使用xlsxwriter的默认设置
+    profile = None
+    # 表头批注的写入方式：comment 批注(VML)；validation 数据验证的输入提示，列很多时生成更快；None 不写入
+    head_comment = 'comment'
+    # 多标签页声明 SheetBuilder 列表，设置后默认的add_sheets按它生成各标签页
+    sheet_builders = None
+    # 同时获取标签页数据的线程数
+    sheet_workers = 4
+    # 报表结构 execl_schema.ReportSchema，同一个类只编译一次，add_table按它写入表头和数据
+    report_schema = None
 
     def __init__(self, data=[], export_name=None, create=True, create_name=None, **kwargs):
         """
         @desc 使用XlsxWriter模块生成execl表格
-        :param data: 需要填充到execl的数据
+        :param data: 需要填充到execl的数据，可以是列表，也可以是任意可迭代对象或生成器；为None时调用get_execl_data获取
         :param export_name: 文件的名字
         :param create: 是将生成的文件放在磁盘还是内存，默认磁盘
         :param create_name:
+        :param kwargs: constant_memory:是否开启流式导出，auto_delete:销毁时是否删除本地文件，spool_max_size:内存模式转存磁盘的字节数，eager_output:内存模式是否把内容复制到res，默认取类属性；
+            cache_key:指定缓存键，默认由get_cache_key根据导出类、文件名和数据生成；stats:本次导出的统计对象，默认由stats_class创建；
+            backend:写入后端，默认取类属性；prefetch_pages:分页数据源最多预取的页数，默认取类属性；
+            profile:导出性能配置，默认取类属性，constant_memory参数优先于配置；head_comment:表头批注的写入方式，默认取类属性；
+            file_dir:文件保存目录，默认取类属性；summary_rows:是否写入小计、合计行，为False时只累计到table_summaries；
+            base_summaries:之前各分片的统计结果，按表格顺序与本次的累计合并后写入小计、合计行
         """
-        self.data = data
         self.is_close = False
         self.create = create
         self.create_name = create_name
+        self.profile = self.get_profile(kwargs.pop('profile', self.profile))
+        self.constant_memory = kwargs.pop('constant_memory', self.profile.get('constant_memory', self.constant_memory))
+        self.auto_delete = kwargs.pop('auto_delete', self.auto_delete)
+        self.spool_max_size = kwargs.pop('spool_max_size', self.spool_max_size)
+        self.eager_output = kwargs.pop('eager_output', self.eager_output)
+        self.cache_key = kwargs.pop('cache_key', None)
+        self.stats = kwargs.pop('stats', None) or (self.stats_class() if self.stats_class else NULL_STATS)
+        self.backend = get_backend(kwargs.pop('backend', self.backend))
+        self.prefetch_pages = kwargs.pop('prefetch_pages', self.prefetch_pages)
+        self.head_comment = kwargs.pop('head_comment', self.head_comment)
+        self.file_dir = kwargs.pop('file_dir', self.file_dir)
+        self.summary_rows = kwargs.pop('summary_rows', True)
+        self.base_summaries = kwargs.pop('base_summaries', None)
+        # add_table_data各表格的统计结果 [(分组小计字典, 合计累计器)]
+        self.table_summaries = []
         self.kwargs = kwargs
         self.res = None
+        self.workbook = None
+
+        if data is None:
+            with self.stats.phase('fetch'):
+                data = self.get_execl_data()
+        self.data = self.get_source(data)
+        self.export(export_name)
+        self.stats.finish(self)
 
+    def export(self, export_name=None):
+        """
+        @desc 准备输出位置并生成execl
+        :param export_name: 文件的名字
+        :return:
+        """
         if export_name:
             self.export_name = export_name
         else:
             self.export_name = self.get_export_name()
+        if self.export_cache is not None and self.cache_key is None:
+            self.cache_key = self.get_cache_key()
 
-        if create:
-            self.export_name = u'{}.xlsx'.format(self.export_name)
+        # 内存模式下多个线程共用self.output读取，定位和读取要在锁内完成
+        self.output_lock = threading.Lock()
+        if self.create:
+            self.export_name = u'{}{}'.format(self.export_name, self.backend.suffix)
             # 创建本地文件句柄
             self.output = os.path.join(os.getcwd(), self.file_dir, self.export_name)
 
             excel_path = os.path.dirname(self.output)
             if not os.path.isdir(excel_path):
                 os.makedirs(excel_path)
+        elif self.spool_max_size:
+            # 小文件留在内存，超过spool_max_size后自动转存到磁盘临时文件
+            self.output = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size)
         else:
-            self.output = StringIO()
+            self.output = BytesIO()
 
-        self.workbook = xlsxwriter.Workbook(self.output)
+        # 命中缓存时不再生成
+        if self.load_cache():
+            self.get_record()
+            return
+        self.workbook = self.backend.create_workbook(self.output, self.get_workbook_options())
+        self.formats = FormatRegistry(self.workbook)
         self.add_formats()
         self.create_excel()
 
+    def get_workbook_options(self):
+        """
+        @desc 获取创建Workbook的参数，可重写此接口
+        :return:
+        """
+        options = dict((key, value) for key, value in self.profile.items()
+                       if key != 'constant_memory' and value is not None)
+        if self.constant_memory:
+            # 按行顺序写入临时文件，已写完的行不再保留在内存中
+            options['constant_memory'] = True
+        return options
+
+    @classmethod
+    def read_execl(cls, file, schema=None, **kwargs):
+        """
+        @desc 按报表结构读取同样表头的xlsx文件，如用户修改后上传的导出文件
+        :param file: 文件路径或文件对象
+        :param schema: 报表结构，默认为类属性report_schema
+        :param kwargs: SchemaReader的其他参数：sheet、batch_size、as_tuples、skip_summary、strict
+        :return: SchemaReader，遍历得到每行数据，iter_batches按批返回
+        """
+        return SchemaReader(file, schema or cls.report_schema, **kwargs)
+
+    @staticmethod
+    def get_profile(profile):
+        """
+        @desc 获取导出性能配置，返回副本，修改后不影响EXPORT_PROFILES和传入的字典
+        :param profile: EXPORT_PROFILES中的名称，或配置字典，None表示不使用配置
+        :return: 配置字典
+        """
+        if profile is None:
+            return {}
+        if isinstance(profile, basestring):
+            try:
+                return dict(EXPORT_PROFILES[profile])
+            except KeyError:
+                raise ValueError(u"不支持的导出配置：{}".format(profile))
+        return dict(profile)
+
     def add_formats(self):
         """
         @desc 设置execl的格式
         :return:
         """
-        self.title_format = self.workbook.add_format(
+        self.title_format = self.get_format(
             {'align': 'center', 'valign': 'vcenter', 'font_size': 20, 'bold': True})  # 顶部大标题
-        self.head_format = self.workbook.add_format(
+        self.head_format = self.get_format(
             {'align': 'center', 'valign': 'vcenter', "bg_color": "#ebf5fa", 'border': 1})  # 表头格式
-        self.left_content = self.workbook.add_format({'align': 'left', 'valign': 'vcenter', 'border': 1})  # 文字格式
-        self.center_content = self.workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1})  # 文字格式居中
-        self.percent_format = self.workbook.add_format(
+        self.left_content = self.get_format({'align': 'left', 'valign': 'vcenter', 'border': 1})  # 文字格式
+        self.center_content = self.get_format({'align': 'center', 'valign': 'vcenter', 'border': 1})  # 文字格式居中
+        self.percent_format = self.get_format(
             {'num_format': '0.00%;[Red]-0.00%;_ * -??_ ;_ @_ ', 'border': 1})  # 比例格式
-        self.int_format = self.workbook.add_format(
+        self.int_format = self.get_format(
             {'num_format': '_ * #,##0_ ;_ * -#,##0_ ;_ * -??_ ;_ @_ ', 'border': 1})  # 整型格式
-        self.money_format = self.workbook.add_format(
+        self.money_format = self.get_format(
             {'num_format': '_ * #,##0.00_ ;_ * -#,##0.00_ ;_ * -??_ ;_ @_ ', 'border': 1})  # 浮点型格式
-        self.date_format = self.workbook.add_format(
+        self.date_format = self.get_format(
             {'num_format': 'yyyy-m-d h:mm:ss', 'align': 'left', 'valign': 'vcenter', 'border': 1})  # 日期
 
+    def get_format(self, properties):
+        """
+        @desc 从格式注册表获取格式，属性相同的格式只创建一次
+        :param properties: 格式属性字典；也可以是add_formats中的格式名，如int、money、date、percent；已经是Format对象或为None时原样返回
+        :return:
+        """
+        if isinstance(properties, dict):
+            return self.formats.get(properties)
+        if isinstance(properties, basestring):
+            return getattr(self, u'{}_format'.format(properties))
+        return properties
+
     def add_sheets(self):
-        # 将data数据填充到execl中
+        # 声明了多个标签页时按声明生成
+        if self.get_sheet_builders():
+            return self.add_sheet_builders()
+        # 将data数据填充到execl中，data只遍历一次，支持生成器
         ws = self.workbook.add_worksheet(self.export_name)
-        for row, item in enumerate(self.data):
-            if row > 1:
-                ws.write_row(row, 0, item, self.workbook.add_format({"font_color": "#333333"}))
-            else:
-                ws.write_row(row, 0, item)
-        self.set_ws_format(ws, len(self.data[1]), title_name=self.export_name)
+        rows = iter(self.data)
+        # 预读前两行：第一行要被标题合并覆盖，第二行决定列数
+        first_rows = list(itertools.islice(rows, 2))
+        if first_rows:
+            ws.write_row(0, 0, first_rows[0])
+        # 标题所在行必须在写入下一行之前设置好，constant_memory模式下已写完的行不能再修改
+        self.set_ws_format(ws, len(first_rows[1]), title_name=self.export_name)
+        content_format = self.get_format({"font_color": "#333333"})
+        row = 0
+        with self.stats.phase('rows'):
+            for row, item in enumerate(itertools.chain(first_rows[1:], rows), 1):
+                if row > 1:
+                    ws.write_row(row, 0, item, content_format)
+                else:
+                    ws.write_row(row, 0, item)
+        self.stats.add_rows(row + 1, (row + 1) * len(first_rows[1]))
+
+    def get_sheet_builders(self):
+        """
+        @desc 获取多标签页声明，默认为类属性sheet_builders，可重写此接口按导出参数生成
+        :return: SheetBuilder列表
+        """
+        return self.sheet_builders
+
+    def add_sheet_builders(self, builders=None, max_workers=None):
+        """
+        @desc 各标签页的数据在线程池中同时获取和预处理，主线程按顺序写入，写第一个标签页时后面的标签页仍在获取数据
+        :param builders: SheetBuilder列表，默认为get_sheet_builders()
+        :param max_workers: 线程数，默认为类属性sheet_workers
+        :return:
+        """
+        builders = builders or self.get_sheet_builders()
+        with ThreadPoolExecutor(max_workers=max_workers or self.sheet_workers) as executor:
+            futures = [executor.submit(builder.prepare) for builder in builders]
+            try:
+                for builder, future in zip(builders, futures):
+                    with self.stats.phase('fetch'):
+                        rows = future.result()
+                    worksheet = self.workbook.add_worksheet(builder.name)
+                    options = self.apply_schema(worksheet, builder.schema, source=rows)
+                    options['prepared'] = True
+                    self.add_table_data(worksheet, options, add_sum_line=builder.add_sum_line)
+            finally:
+                # 出错时不再等待还没开始的标签页
+                for future in futures:
+                    future.cancel()
 
     def get_execl_data(self):
-        # 获取execl的数据
+        # 获取execl的数据，可以返回分页数据源，逐页读取并预取下一页
         pass
 
+    def get_source(self, source):
+        """
+        @desc 分页数据源用后台线程预取，写入当前页的同时读取下一页；其他数据源原样返回
+        :param source: 数据源
+        :return:
+        """
+        if self.prefetch_pages and hasattr(source, 'iter_pages'):
+            return PrefetchSource(source, max_pages=self.prefetch_pages, stats=self.stats)
+        return source
+
     def date_to_string(self, value):
         if not value:
             return ""
@@ -116,24 +657,125 @@ class XlsxWriterToExport(object):
             value = getattr(obj, code, default)
         return value
 
+    @staticmethod
+    def compile_accessors(codes, defaults, col_type, sample):
+        """
+        @desc 把列配置编译成每列一个取值函数，按第一行数据的类型一次性选定取值方式，行循环中不再做类型判断
+        :param codes: 数据源里的字段名，也可以是函数
+        :param defaults: 默认值列表
+        :param col_type: 列类型列表，index 表示序号
+        :param sample: 第一行数据，用来决定按字典还是按属性取值；为None(数据源为空)时没有取值函数
+        :return: 取值函数列表，每个函数接收一行数据对象
+        """
+        if sample is None:
+            return []
+        is_dict = isinstance(sample, dict)
+        counter = itertools.count(1)
+        accessors = []
+        for code, default, this_type in zip(codes, defaults, col_type):
+            if this_type == 'index':
+                # 序号，所有序号列共用一个计数器
+                accessor = lambda obj, counter=counter: next(counter)
+            elif isinstance(code, (types.FunctionType, types.MethodType)):
+                def accessor(obj, code=code, default=default):
+                    try:
+                        return code(obj)
+                    except:
+                        return default
+            elif is_dict:
+                accessor = operator.methodcaller('get', code, default)
+            elif not isinstance(code, basestring):
+                accessor = lambda obj, code=code, default=default: getattr(obj, code, default)
+            else:
+                def accessor(obj, getter=operator.attrgetter(code), default=default):
+                    try:
+                        return getter(obj)
+                    except AttributeError:
+                        return default
+            accessors.append(accessor)
+        return accessors
+
     def create_excel(self):
         u'''生成excel内容'''
         self.add_sheets()
-        self.workbook.close()
+        with self.stats.phase('close'):
+            self.workbook.close()
+        self.save_cache()
         self.get_record()
 
+    def get_cache_key(self):
+        """
+        @desc 生成导出缓存的键，默认由导出类、文件名、影响输出内容的配置、其他参数和数据计算，可重写此接口加入查询条件等；
+        数据是生成器等无法在生成前计算的对象时返回None，表示不使用缓存
+        :return:
+        """
+        if not isinstance(self.data, (list, tuple, dict)):
+            return None
+        builders = []
+        for builder in self.get_sheet_builders() or []:
+            if not isinstance(builder.source, (list, tuple, dict)):
+                # 标签页的数据在生成时才获取
+                return None
+            builders.append((builder.name, builder.schema.definition, builder.source, builder.add_sum_line))
+        export_class = u'{}.{}'.format(self.__class__.__module__, self.__class__.__name__)
+        # 临时文件目录不影响生成的内容
+        workbook_options = dict((key, value) for key, value in self.get_workbook_options().items() if key != 'tmpdir')
+        options = {
+            'backend': self.backend.name,
+            'workbook': workbook_options,
+            'head_comment': self.head_comment,
+            'max_sheet_rows': self.get_max_sheet_rows(),
+            'summary_rows': self.summary_rows,
+            'base_summaries': self.base_summaries,
+            'schema': self.report_schema.definition if self.report_schema is not None else None,
+            'sheet_builders': builders,
+        }
+        return self.export_cache.make_key(export_class, self.export_name, options, self.kwargs, self.data)
+
+    def load_cache(self):
+        """
+        @desc 从缓存中取出已生成的文件复制到输出位置；不使用硬链接，修改导出的文件不会影响缓存
+        :return: 是否命中缓存
+        """
+        if self.export_cache is None or self.cache_key is None:
+            return False
+        cache_path = self.export_cache.get(self.cache_key, suffix=self.backend.suffix)
+        if cache_path is None:
+            return False
+        try:
+            if self.create:
+                # 先删除旧文件，旧文件可能是之前版本留下的指向缓存的硬链接
+                if os.path.exists(self.output):
+                    os.remove(self.output)
+                shutil.copyfile(cache_path, self.output)
+            else:
+                with open(cache_path, 'rb') as f:
+                    shutil.copyfileobj(f, self.output)
+        except FileNotFoundError:
+            # 缓存文件在get之后被其他进程淘汰，当作没有命中，重新生成
+            return False
+        return True
+
+    def save_cache(self):
+        # 把生成的文件放入缓存
+        if self.export_cache is None or self.cache_key is None:
+            return
+        if self.create:
+            self.export_cache.put(self.cache_key, path=self.output, suffix=self.backend.suffix)
+        else:
+            self.export_cache.put(self.cache_key, content=self.get_buffer(), suffix=self.backend.suffix)
+
     def get_record(self):
         # 获取到生成的文件网址或二进制流
         if self.create:
-            file_path = os.path.join(os.getcwd(), self.file_dir, self.export_name)
             # 返回文件地址，实际使用重写
-            self.res = file_path
+            self.res = self.get_file_path()
         else:
             export_name = self.export_name
             if not export_name.endswith('.xlsx'):
                 export_name = u'%s.xlsx' % export_name
             # 返回二进制流
-            self.res = self.get_output()
+            self.res = self.get_output() if self.eager_output else self.get_buffer()
 
     def get_export_name(self):
         """
@@ -144,16 +786,125 @@ class XlsxWriterToExport(object):
             raise ValueError("需要配置导出文件名称：export_name")
         return self.export_name
 
+    def get_output_size(self):
+        u'''返回生成的excel内容的字节数'''
+        if self.create:
+            path = self.get_file_path()
+            return os.path.getsize(path) if os.path.exists(path) else 0
+        position = self.output.tell()
+        self.output.seek(0, os.SEEK_END)
+        size = self.output.tell()
+        self.output.seek(position)
+        return size
+
+    def get_file_path(self):
+        u'''返回生成的本地文件路径'''
+        return os.path.join(os.getcwd(), self.file_dir, self.export_name)
+
     def get_output(self):
         u'''返回生成的excel二进制内容'''
+        handle = self.open_output()
+        try:
+            return handle.read()
+        finally:
+            if self.create:
+                handle.close()
+
+    def get_buffer(self):
+        """
+        @desc 内存模式下不复制地获取生成的内容：输出是BytesIO时返回memoryview；
+        设置了spool_max_size时返回从头读取的文件句柄，文件句柄在当前对象关闭前有效
+        :return:
+        """
+        if isinstance(self.output, BytesIO):
+            return self.output.getbuffer()
+        return self.open_output()
+
+    def open_output(self):
+        u'''打开生成的excel内容，返回从头读取的文件句柄'''
+        if self.create:
+            return open(self.get_file_path(), 'rb')
         self.output.seek(0)
-        return self.output.read()
+        return self.output
+
+    def read_at(self, offset, size):
+        u'''内存模式下从指定位置读取一块内容；多个读取者共用self.output，定位和读取在锁内完成，多个线程同时读取也互不影响'''
+        with self.output_lock:
+            self.output.seek(offset)
+            return self.output.read(size)
+
+    def iter_buffer(self, chunk_size):
+        u'''按块切分BytesIO的缓冲区，不复制内容，也没有共用的读取位置'''
+        buffer = self.output.getbuffer()
+        for offset in range(0, len(buffer), chunk_size):
+            yield buffer[offset:offset + chunk_size]
+
+    def iter_output(self, chunk_size=None):
+        """
+        @desc 按固定大小分块返回生成的execl内容，不需要把整个文件读入内存；
+        每个生成器有自己的读取位置，多个线程中的多个生成器同时读取时互不影响；生成器持有当前对象，输出结束前文件不会被__del__删除
+        :param chunk_size: 每块的字节数，默认取类属性chunk_size
+        :return: 二进制块的生成器，内容在BytesIO中时为缓冲区的memoryview切片
+        """
+        chunk_size = chunk_size or self.chunk_size
+        if self.create:
+            with self.open_output() as handle:
+                while True:
+                    chunk = handle.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            return
+        if isinstance(self.output, BytesIO):
+            yield from self.iter_buffer(chunk_size)
+            return
+        offset = 0
+        while True:
+            chunk = self.read_at(offset, chunk_size)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+    async def aiter_output(self, chunk_size=None):
+        """
+        @desc iter_output的异步版本，读文件放到默认线程池中执行，不阻塞事件循环
+        :param chunk_size: 每块的字节数，默认取类属性chunk_size
+        :return: 二进制块的异步生成器
+        """
+        chunk_size = chunk_size or self.chunk_size
+        if self.create:
+            loop = asyncio.get_running_loop()
+            handle = self.open_output()
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(None, handle.read, chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                handle.close()
+            return
+        if isinstance(self.output, BytesIO):
+            # 内存缓冲区直接切片，不会阻塞事件循环
+            for chunk in self.iter_buffer(chunk_size):
+                yield chunk
+            return
+        # SpooledTemporaryFile超过spool_max_size后已经转存到磁盘，读取放到线程池中
+        loop = asyncio.get_running_loop()
+        offset = 0
+        while True:
+            chunk = await loop.run_in_executor(None, self.read_at, offset, chunk_size)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
 
     def get_response(self, create=True):
-        # 构建二进制流的http对象
-        # res = HttpResponse(self.get_output(),content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        # res['Content-Disposition'] = "attachment; filename={}.xlsx".format(self.get_export_name())
-        return
+        # 构建分块输出的http对象，实际使用重写，例如django：
+        # res = StreamingHttpResponse(self.iter_output(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        # res['Content-Disposition'] = "attachment; filename={}".format(self.export_name)
+        return self.iter_output()
 
     def merge_cell(self, ws, options):
         """
@@ -163,25 +914,30 @@ class XlsxWriterToExport(object):
         :return:
         """
         for i in options:
-            ws.merge_range(i["cell"], i["content"], i.get("format", None))
+            cell = i["cell"]
+            if isinstance(cell, basestring):
+                # 合并单元格需要明确的行号，B:D这样的整列区域会抛出ValueError
+                cell = range_index(cell, whole_columns=False)
+            ws.merge_range(cell[0], cell[1], cell[2], cell[3], i["content"], i.get("format", None))
 
     def excel_style(self, row, col):
         """ 用行列数量获取excel坐标. """
-        LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-        result = []
-        while col:
-            col, rem = divmod(col - 1, 26)
-            result[:0] = LETTERS[rem]
-        return ''.join(result)
+        return COLUMN_LETTERS[col - 1] if col else ''
 
     def get_excel_url(self):
         return self.res
 
     def close(self):
-        if not self.is_close:
-            self.workbook.close()
-            if isinstance(self.output, StringIO):
-                self.output.close()
+        # 初始化时出错，还没有创建输出位置
+        if not self.is_close and hasattr(self, 'output'):
+            if self.workbook is not None:
+                self.workbook.close()
+            if not self.create:
+                try:
+                    self.output.close()
+                except BufferError:
+                    # 仍有memoryview引用缓冲区，引用释放后缓冲区随BytesIO一起回收
+                    pass
             del self.data
             del self.output
             del self.workbook
@@ -192,152 +948,436 @@ class XlsxWriterToExport(object):
         self.close()
         # 删除本地文件
         try:
-            if self.file_dir and self.export_name:
-                path = os.path.join(os.getcwd(), self.file_dir, self.export_name)
+            if self.auto_delete and self.file_dir and self.export_name:
+                path = self.get_file_path()
                 if os.path.exists(path):
                     os.remove(path)
         except Exception as e:
             logging.error("delete excel file is fail, error msg: {}".format(str(e)[:200]))
 
+    @stats_phase('head')
     def add_table_head(self, worksheet, options=None, parent_head='', title=None, child_list=None):
         '''
         加入表头
         :param worksheet: 标签页
-        :param options: 表格配置信息。head_row:表头占多少行(默认占2行)， first_row:开始行号(-1表示只有一行表头)，first_col:开始列号，head_format:表头格式，source:数据源，content_format:内容格式，head_datas:表头内容
+        :param options: 表格配置信息。head_row:表头占多少行(默认占2行)， first_row:开始行号(-1表示只有一行表头)，first_col:开始列号，head_format:表头格式，source:数据源，content_format:内容格式，head_datas:表头内容。格式可以直接传属性字典
         :param parent_head: 一级表头的显示文字
         :param title: 标题的批注
-        :param child_list: 这一列(或者多列)的内容信息。 code:数据源里的字段名；default:默认值；head:二级表头的显示文字(可以是空字符串)；width:宽度；format:内容样式、格式；type:sum 表示累计，index 表示序号；title:批注。
+        :param child_list: 这一列(或者多列)的内容信息。 code:数据源里的字段名；default:默认值；head:二级表头的显示文字(可以是空字符串)；width:宽度；format:内容样式、格式(可以是属性字典)，没有该键时使用content_format，为None时不使用格式；type:sum 表示累计，count 计数，avg 平均值，min 最小值，max 最大值，index 表示序号；title:批注。
         '''
         options = options or {}
         head_row = options.get('head_row', 2)
         first_row = options.get('first_row', 0)
         first_col = options.get('first_col', 0)
-        head_format = options.get('head_format', None)
-        content_format = options.get('content_format', None)
+        head_format = self.get_format(options.get('head_format', None))
+        content_format = self.get_format(options.get('content_format', None))
         head_datas = options.get('head_datas', [])
 
-        child_list = [child_list] if isinstance(child_list, dict) else child_list
-        # 表头只占一行的
-        if first_row == -1:
-            pass
-        # 表头只占一行的
-        elif head_row == 1:
-            first_row -= 1
-        # 合并一级表头
-        else:
-            if len(child_list) == 1:
-                if child_list[0].get('head'):
-                    # worksheet.write(first_row, first_col, parent_head, head_format) # 无合并
-                    head_datas.append(
-                        {'type': 'write', "cell": (first_row, first_col), "content": parent_head, "format": head_format,
-                         'comment': title})
-                else:
-                    # worksheet.merge_range(first_row, first_col, first_row+1, first_col, parent_head, head_format)
-                    head_datas.append({'type': 'merge', 'cell': (first_row, first_col, first_row + 1, first_col),
-                                       "content": parent_head, "format": head_format, 'comment': title})
-            else:
-                # worksheet.merge_range(first_row, first_col, first_row, first_col + len(child_list) - 1, parent_head, head_format)
-                head_datas.append(
-                    {'type': 'merge', 'cell': (first_row, first_col, first_row, first_col + len(child_list) - 1),
-                     "content": parent_head, "format": head_format, 'comment': title})
-        for child in child_list:
+        head_cells, columns = layout_group(parent_head, child_list, title, head_row, first_row, first_col)
+        for head_cell in head_cells:
+            head_datas.append({'type': head_cell.type, 'cell': head_cell.cell, 'content': head_cell.content,
+                               'format': head_format, 'comment': head_cell.comment})
+        for column in columns:
             # 表格内容
-            options.setdefault('codes', []).append(child.get('code'))
-            options.setdefault('defaults', []).append(child.get('default', ''))
-            width = child.get('width', None)
-            if width is None:
-                width = len(unicode(child.get('head', parent_head))) * 2
-                width = 12 if width < 12 else width
-            column = {'width': width, "format": child.get('format', content_format)}
-            options.setdefault('columns', []).append(column)
-            options.setdefault('type', []).append(child.get('type'))
+            options.setdefault('codes', []).append(column.code)
+            options.setdefault('defaults', []).append(column.default)
+            # 没有指定format时使用content_format，显式指定为None时不使用格式
+            format = content_format if column.format is CONTENT_FORMAT else self.get_format(column.format)
+            options.setdefault('columns', []).append({'width': column.width, 'format': format})
+            options.setdefault('type', []).append(column.type)
             # 设置列宽
-            worksheet.set_column(first_col, first_col, width=width)
-            # 二级表头
-            # worksheet.write(first_row + 1, first_col, child.get('head', ''), head_format)
-            head_datas.append(
-                {'type': 'write', "cell": (first_row + 1, first_col), "content": child.get('head', parent_head),
-                 "format": head_format, 'comment': child.get('title', title)})
+            worksheet.set_column(first_col, first_col, width=column.width)
             first_col += 1
 
         options['first_col'] = first_col
         options['head_datas'] = head_datas
 
+    @stats_phase('head')
+    def apply_schema(self, worksheet, schema=None, source=None):
+        """
+        @desc 按报表结构写入列宽，生成add_table_data的表格配置，代替逐组调用add_table_head
+        :param worksheet: 标签页
+        :param schema: 报表结构，默认为类属性report_schema
+        :param source: 数据源，默认为self.data
+        :return: 表格配置信息
+        """
+        schema = schema or self.report_schema
+        head_cells, columns, widths, head_block = schema.compile()
+        head_format = self.get_format(schema.head_format)
+        content_format = self.get_format(schema.content_format)
+        for first_col, last_col, width in widths:
+            worksheet.set_column(first_col, last_col, width=width)
+        formats = {}
+        column_options = []
+        for column in columns:
+            # 同一格式只解析一次
+            key = id(column.format)
+            if key not in formats:
+                formats[key] = content_format if column.format is CONTENT_FORMAT else self.get_format(column.format)
+            column_options.append({'width': column.width, 'format': formats[key]})
+        return {
+            'head_row': schema.head_row,
+            'first_row': schema.first_row,
+            'first_col': schema.last_col,
+            'head_format': head_format,
+            'content_format': content_format,
+            'source': self.data if source is None else source,
+            'group_by': schema.group_by,
+            'codes': [column.code for column in columns],
+            'defaults': [column.default for column in columns],
+            'type': [column.type for column in columns],
+            'columns': column_options,
+            'head_datas': [{'type': head_cell.type, 'cell': head_cell.cell, 'content': head_cell.content,
+                            'format': head_format, 'comment': head_cell.comment} for head_cell in head_cells],
+            # 预先计算好的表头块，add_table_data直接写入
+            'head_block': head_block,
+        }
+
+    def add_table(self, worksheet, schema=None, source=None, add_sum_line=True):
+        """
+        @desc 按报表结构写入整个表格
+        :param worksheet: 标签页
+        :param schema: 报表结构，默认为类属性report_schema
+        :param source: 数据源，默认为self.data
+        :param add_sum_line: 是否需要加上统计行
+        :return: 表格之后的下一个空行号
+        """
+        options = self.apply_schema(worksheet, schema, source)
+        return self.add_table_data(worksheet, options, add_sum_line=add_sum_line)
+
+    @stats_phase('rows')
     def add_table_data(self, worksheet, options, add_sum_line=True):
         '''
-        加入表格信息
+        加入表格信息，数据源只遍历一次，每行生成后立即写入，不在内存中保留整表数据
         :param worksheet: 标签页
-        :param options: 表格配置信息。first_row:开始行号；first_col:开始列号；head_format:表头格式；source:数据源；codes:数据源里的字段名；defaults:默认值列表；columns:内容样式、格式；type:sum 表示累计，index 表示序号。
+        :param options: 表格配置信息。first_row:开始行号；first_col:开始列号；head_format:表头格式；source:数据源(列表或生成器)；prepared:数据源的每行已经是按列顺序的值列表；codes:数据源里的字段名；defaults:默认值列表；columns:内容样式、格式；type:sum 表示累计，count 计数，avg 平均值，min 最小值，max 最大值，index 表示序号；group_by:按该字段(或函数)分组，在合计行前加上各组的小计行，数据源不需要事先排序。
         :param add_sum_line: 是否需要加上统计行
+        :return: 表格之后的下一个空行号
         '''
-        data = []
         head_row = options.get('head_row', 2)
         first_row = options.get('first_row', 0)
         columns = options.get('columns', [])
         codes = options.get('codes', [])
         defaults = options.get('defaults', [])
         col_type = options.get('type', [])
-        source = options.get('source', self.data)
+        source = self.get_source(options.get('source', self.data))
         head_datas = options.get('head_datas', [])
-        # 各行数据
-        col_index = 0
-        for obj in source:
-            tem = []
-            for index in range(len(codes)):
-                code = codes[index]
-                default = defaults[index]
-                this_type = col_type[index]
-                # 序号
-                if this_type == 'index':
-                    col_index += 1
-                    tem.append(col_index)
-                else:
-                    value = self.get_object_value(obj, code, default)
-                    tem.append(value)
-            data.append(tem)
+
+        # 先写表头，constant_memory模式下只能按行号从小到大写入
+        head_block = options.get('head_block')
+        if head_block is not None:
+            self.write_head_block(worksheet, head_block, options.get('head_format'))
+        else:
+            self.write_table_head(worksheet, head_datas)
+
+        group_by = options.get('group_by')
+        col_count = len(codes)
+        formats = [column.get('format') for column in columns]
+
+        # 预读第一行，据此编译各列的取值函数
+        rows = iter(source)
+        first = next(rows, None)
+        if first is not None:
+            rows = itertools.chain((first,), rows)
+        # prepared:数据源的每行已经是按列顺序的值列表(如SheetBuilder预处理的结果)，分组字段的值在最后
+        prepared = options.get('prepared', False)
+        if not prepared:
+            accessors = self.compile_accessors(codes, defaults, col_type, first)
+        write = worksheet.write
+        cols = list(zip(range(col_count), formats))
+
+        # 统计列在写行的同时累计，不再对数据源做第二次遍历
+        total = ColumnAggregator(col_type)
+        accumulate = add_sum_line and total.indexes
+        groups = {}
+        if group_by is not None:
+            if prepared:
+                group_key = operator.itemgetter(col_count)
+            elif first is not None:
+                group_key = self.compile_accessors([group_by], [u''], [None], first)[0]
+
+        # 各行数据，超出单页最大行数时换到新的标签页
+        data_row = first_row + 1 if head_row == 1 else first_row + 2
+        row_index = data_row
+        max_row = self.get_max_sheet_rows()
+        sheet_name = worksheet.get_name()
+        sheet_no = 1
+        for obj in rows:
+            if row_index >= max_row:
+                sheet_no += 1
+                worksheet = self.add_next_sheet(sheet_name, options, sheet_no)
+                write = worksheet.write
+                row_index = data_row
+            values = obj if prepared else [accessor(obj) for accessor in accessors]
+            for index, format in cols:
+                write(row_index, index, values[index], format)
+            if accumulate:
+                total.add(values)
+            if group_by is not None:
+                key = group_key(obj)
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = ColumnAggregator(col_type)
+                group.add(values)
+            row_index += 1
+        written = (sheet_no - 1) * (max_row - data_row) + row_index - data_row
+        self.stats.add_rows(written, written * col_count)
+
+        table_index = len(self.table_summaries)
+        self.table_summaries.append((groups, total))
+        if self.base_summaries and table_index < len(self.base_summaries):
+            # 分片导出的最后一个分片，小计、合计包含之前所有分片的数据
+            groups, total = ColumnAggregator.merge_summaries([self.base_summaries[table_index], (groups, total)])
+        if not self.summary_rows:
+            return row_index
+
+        # 分组小计行，按分组第一次出现的顺序
+        summaries = [(u'小计：{}'.format(key), group) for key, group in groups.items()]
         # 统计行
         if add_sum_line:
-            count_data = []
-            for index in range(len(codes)):
-                code = codes[index]
-                this_type = col_type[index]
-                if index == 0:
-                    count_data.append(u'合计：')
-                elif this_type == 'sum':
-                    amount = sum([float(self.get_object_value(obj, code, 0)) for obj in source])
-                    count_data.append(amount)
-                else:
-                    count_data.append(u'')
-            data.append(count_data)
-
-        row_index = first_row + 1 if head_row == 1 else first_row + 2
-        for row_data in data:
-            for col_index in range(len(codes)):
-                format = columns[col_index].get('format')
-                value = row_data[col_index]
-                worksheet.write(row_index, col_index, value, format)
+            summaries.append((u'合计：', total))
+        for label, aggregator in summaries:
+            if row_index >= max_row:
+                sheet_no += 1
+                worksheet = self.add_next_sheet(sheet_name, options, sheet_no)
+                row_index = data_row
+            self.write_summary_row(worksheet, row_index, label, aggregator, formats)
             row_index += 1
+        return row_index
 
-        # 写表头
-        for head_option in head_datas:
-            c_type = head_option.get('type')
-            cell = head_option.get('cell')
-            content = head_option.get('content')
-            format = head_option.get('format')
-            title = head_option.get('comment')
-            if isinstance(cell, basestring):
-                param = (cell, content, format)
-            elif isinstance(cell, (list, tuple)):
-                param = list(cell) + [content, format]
+    def get_max_sheet_rows(self):
+        # 单个标签页最多写入的行数，csv等没有行数限制的后端不分页
+        if self.backend.max_rows is None:
+            return sys.maxsize
+        return min(self.max_sheet_rows, self.backend.max_rows)
+
+    def write_table_head(self, worksheet, head_datas):
+        """
+        @desc 写入add_table_head生成的表头内容
+        :param worksheet: 标签页
+        :param head_datas: 表头内容
+        :return:
+        """
+        head_block = build_head_block(
+            (head_option.get('type'), self.get_head_cell(head_option), head_option.get('content'),
+             head_option.get('format'), head_option.get('comment')) for head_option in head_datas)
+        self.write_head_block(worksheet, head_block)
+
+    @stats_phase('head')
+    def write_head_block(self, worksheet, head_block, head_format=None):
+        """
+        @desc 按行号顺序写入整个表头块，批注按head_comment的方式写入
+        :param worksheet: 标签页
+        :param head_block: execl_schema.HeadBlock
+        :param head_format: 表头块中格式为None的单元格使用的格式
+        :return:
+        """
+        sequential = self.constant_memory or self.backend.sequential
+        for row, runs, merges in head_block.rows:
+            if sequential:
+                # 合并单元格会在下面的行填充空白，只能按行顺序写入时，先写完本行所有合并单元格在本行的部分
+                for cell, content, format in merges:
+                    format = head_format if format is None else format
+                    worksheet.write(row, cell[1], content, format)
+                    for col in range(cell[1] + 1, cell[3] + 1):
+                        worksheet.write_blank(row, col, None, format)
+            for first_col, contents, format in runs:
+                worksheet.write_row(row, first_col, contents, head_format if format is None else format)
+            for cell, content, format in merges:
+                worksheet.merge_range(cell[0], cell[1], cell[2], cell[3], content,
+                                      head_format if format is None else format)
+        if self.head_comment == 'validation':
+            # 选中单元格时显示的提示信息，不生成VML，最多255个字符
+            for row, first_col, last_col, text in head_block.comments:
+                worksheet.data_validation(row, first_col, row, last_col,
+                                          {'validate': 'any', 'input_message': u'{}'.format(text)[:255]})
+        elif self.head_comment == 'comment':
+            for row, first_col, last_col, text in head_block.comments:
+                worksheet.write_comment(row, first_col, text)
+
+    @staticmethod
+    def get_head_cell(head_option):
+        # 表头内容的单元格坐标，write为(row, col)，merge为(first_row, first_col, last_row, last_col)
+        cell = head_option.get('cell')
+        if isinstance(cell, basestring):
+            if ':' in cell:
+                return range_index(cell, whole_columns=False)
+            return range_index(cell, whole_columns=False)[:2]
+        elif isinstance(cell, (list, tuple)):
+            return tuple(cell)
+        raise RuntimeError(u'传递错误参数！')
+
+    def add_next_sheet(self, sheet_name, options, sheet_no):
+        """
+        @desc 当前标签页写满后新建一个续页，并重复表头和列宽
+        :param sheet_name: 第一个标签页的名称
+        :param options: 表格配置信息
+        :param sheet_no: 续页序号，从2开始
+        :return: 新的标签页
+        """
+        suffix = u'_{}'.format(sheet_no)
+        # execl标签页名称最长31个字符
+        next_sheet = self.workbook.add_worksheet(sheet_name[:31 - len(suffix)] + suffix)
+        for index, column in enumerate(options.get('columns', [])):
+            next_sheet.set_column(index, index, width=column.get('width'))
+        self.write_table_head(next_sheet, options.get('head_datas', []))
+        return next_sheet
+
+    @staticmethod
+    def get_column_kind(values):
+        """
+        @desc 根据一列数据的类型判断使用哪种格式：int、money、date，其他返回None；
+        格式由第一个非空值决定，之后有不能按该类型写入的值(如数字列中的'N/A')时也返回None，整列逐个单元格按类型写入
+        :param values: numpy数组或序列
+        :return:
+        """
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            return {'i': 'int', 'u': 'int', 'f': 'money', 'M': 'date'}.get(values.dtype.kind)
+        kind = None
+        for value in values:
+            if value is None or value == '':
+                continue
+            if isinstance(value, bool):
+                return None
+            if kind is not None:
+                if not isinstance(value, expected):
+                    return None
+            elif isinstance(value, int):
+                kind, expected = 'int', (int, float, decimal.Decimal)
+            elif isinstance(value, (float, decimal.Decimal)):
+                kind, expected = 'money', (int, float, decimal.Decimal)
+            elif isinstance(value, datetime.date):
+                kind, expected = 'date', datetime.date
             else:
-                raise RuntimeError(u'传递错误参数！')
-            if 'write' == c_type:
-                worksheet.write(*param)
-            elif 'merge' == c_type:
-                worksheet.merge_range(*param)
-            if title:
-                worksheet.write_comment(cell[0], cell[1], title)
+                return None
+        return kind
 
+    @staticmethod
+    def write_typed(write, row, col, value, format):
+        # 按类型写入单元格，空值、空字符串和NaN写成空白，和get_column_kind跳过的值一致
+        if value is None or value == '' or value != value:
+            return
+        write(row, col, value, format)
+
+    @stats_phase('rows')
+    def add_table_columns(self, worksheet, options, add_sum_line=True):
+        '''
+        按列写入表格信息，数据源是 字段名->数组/序列 的映射(如numpy数组、列表的字典)，不需要先转换成一行一个对象
+        :param worksheet: 标签页
+        :param options: 表格配置信息，同add_table_data。source:字段名到一列数据的映射；没有指定格式的列按数据类型使用int_format、money_format、date_format，百分比列可以指定 format:'percent'
+        :param add_sum_line: 是否需要加上统计行
+        :return: 表格之后的下一个空行号
+        '''
+        head_row = options.get('head_row', 2)
+        first_row = options.get('first_row', 0)
+        columns = options.get('columns', [])
+        codes = options.get('codes', [])
+        defaults = options.get('defaults', [])
+        col_type = options.get('type', [])
+        source = options.get('source', self.data)
+
+        self.write_table_head(worksheet, options.get('head_datas', []))
+
+        row_count = max([len(source[code]) for code in codes if code in source] or [0])
+        col_values = []
+        col_writers = []
+        formats = []
+        for code, default, this_type, column in zip(codes, defaults, col_type, columns):
+            if this_type == 'index':
+                values = list(range(1, row_count + 1))
+                kind = 'int'
+            elif code in source:
+                values = source[code]
+                kind = self.get_column_kind(values)
+                if numpy is not None and isinstance(values, numpy.ndarray):
+                    # 转成python原生类型，日期转成datetime
+                    values = values.astype('datetime64[us]').tolist() if kind == 'date' else values.tolist()
+            else:
+                # 数据源中没有的列每行都是默认值，不生成整列的列表
+                values = None
+                kind = None
+            format = column.get('format')
+            if format is None and kind is not None:
+                format = self.get_format(kind)
+            # 只记录方法名，换页后从新的标签页取写入方法
+            if kind == 'date':
+                writer = 'write_datetime'
+            elif kind is not None:
+                writer = 'write_number'
+            else:
+                writer = None
+            col_values.append(values)
+            col_writers.append(writer)
+            formats.append(format)
+
+        # 按整列写入，超出单页最大行数时换到新的标签页
+        data_row = first_row + 1 if head_row == 1 else first_row + 2
+        max_row = self.get_max_sheet_rows()
+        sheet_rows = max_row - data_row
+        sheet_name = worksheet.get_name()
+        sheet_no = 1
+        write_typed = self.write_typed
+        for start in range(0, row_count, sheet_rows):
+            if start:
+                sheet_no += 1
+                worksheet = self.add_next_sheet(sheet_name, options, sheet_no)
+            end = min(start + sheet_rows, row_count)
+            writers = [writer and getattr(worksheet, writer) for writer in col_writers]
+            col_items = list(zip(itertools.count(), col_values, writers, formats, defaults))
+            if self.constant_memory or self.backend.sequential:
+                # constant_memory模式和快速后端只能按行顺序写入
+                write = worksheet.write
+                for row_index, offset in enumerate(range(start, end), data_row):
+                    for col_index, values, writer, format, default in col_items:
+                        if values is None:
+                            write(row_index, col_index, default, format)
+                        elif writer is None:
+                            write(row_index, col_index, values[offset], format)
+                        else:
+                            write_typed(writer, row_index, col_index, values[offset], format)
+                continue
+            for col_index, values, writer, format, default in col_items:
+                if values is None:
+                    for row_index in range(data_row, data_row + end - start):
+                        worksheet.write(row_index, col_index, default, format)
+                elif writer is None:
+                    worksheet.write_column(data_row, col_index, values[start:end], format)
+                else:
+                    # 类型固定的列直接调用write_number/write_datetime，跳过逐个单元格的类型判断
+                    for row_index, value in enumerate(values[start:end], data_row):
+                        write_typed(writer, row_index, col_index, value, format)
+        row_index = data_row + (row_count - (sheet_no - 1) * sheet_rows if row_count else 0)
+        self.stats.add_rows(row_count, row_count * len(codes))
+
+        # 统计行
+        if add_sum_line:
+            if row_index >= max_row:
+                worksheet = self.add_next_sheet(sheet_name, options, sheet_no + 1)
+                row_index = data_row
+            for index, format in enumerate(formats):
+                values = col_values[index]
+                if values is None:
+                    values = itertools.repeat(defaults[index], row_count)
+                value = u'合计：' if index == 0 else ColumnAggregator.aggregate(col_type[index], values)
+                worksheet.write(row_index, index, value, format)
+            row_index += 1
+        return row_index
+
+    def write_summary_row(self, worksheet, row_index, label, aggregator, formats):
+        """
+        @desc 写入一行统计行，第一列为说明文字，其余列为统计结果
+        :param worksheet: 标签页
+        :param row_index: 行号
+        :param label: 第一列的说明文字
+        :param aggregator: 统计累计器 ColumnAggregator
+        :param formats: 各列的格式
+        :return:
+        """
+        for index, format in enumerate(formats):
+            value = label if index == 0 else aggregator.result(index)
+            worksheet.write(row_index, index, value, format)
+
+    @stats_phase('head')
     def set_ws_format(self, ws, col_count,
                       title_name=None, is_title=True, title_format=None,
                       field_format=None, extral_format=None):
@@ -352,7 +1392,7 @@ class XlsxWriterToExport(object):
         :param extral_format: 额外的格式
         :return:
         """
-        col = self.excel_style(None, col_count)
+        last_col = col_count - 1
 
         # 如果存在标题
         if is_title:
@@ -363,10 +1403,10 @@ class XlsxWriterToExport(object):
                 base_title_format.update(title_format)
             ws.set_row(0, title_hight)  # 设置第0行的行高
             # 和合并标题单元格
-            title_col = col if col_count <= 13 else "M"
+            title_col = min(last_col, 12)
             merge_obj = [
-                {"cell": "A1:{}1".format(title_col), "content": title_name or "样本标题",
-                 "format": self.workbook.add_format(base_title_format)}
+                {"cell": (0, 0, 0, title_col), "content": title_name or "样本标题",
+                 "format": self.get_format(base_title_format)}
             ]
             self.merge_cell(ws, merge_obj)
             # 字段的行号
@@ -379,15 +1419,94 @@ class XlsxWriterToExport(object):
         if field_format and isinstance(field_format, dict):
             base_format.update(field_format)
         # 设置格式
-        ws.set_row(field_row, None, self.workbook.add_format(base_format))
+        ws.set_row(field_row, None, self.get_format(base_format))
         base_extral = {"field_width": 15, "freeze_row": 2-1, "freeze_col": 2-1 }
         if extral_format and isinstance(extral_format, dict):
             base_extral.update(extral_format)
-        ws.set_column("B:{}".format(col), base_extral.get("field_width"))  # 设置有数据的区域的列宽
-        ws.autofilter("A{}:{}{}".format(field_row + 1, col, field_row + 1))  # 设置自动筛选区域,也就是在execl上可以点击自动筛选数据的列
+        ws.set_column(1, last_col, base_extral.get("field_width"))  # 设置有数据的区域的列宽
+        ws.autofilter(field_row, 0, field_row, last_col)  # 设置自动筛选区域,也就是在execl上可以点击自动筛选数据的列
         ws.freeze_panes(base_extral.get("freeze_row"), base_extral.get("freeze_col"))  # 设置冻结区域
 
 
+def _export_shard(export_class, rows, export_name, kwargs):
+    # 在子进程中生成一个分片文件，返回文件路径(create=False时返回二进制内容)和各表格的统计结果
+    manager = export_class(data=rows, export_name=export_name, auto_delete=False, **kwargs)
+    return manager.get_excel_url(), manager.table_summaries
+
+
+def export_sharded(export_class, source, rows_per_shard=500000, max_workers=None,
+                   export_name=None, bundle=False, mp_context=None, **kwargs):
+    """
+    @desc 把大数据源拆成多个分片，在进程池中分别生成execl文件，每个分片都会按export_class重复生成表头。
+    小计、合计行只写在最后一个分片中，统计的是所有分片的数据：最后一个分片等前面的分片完成后，带上它们的统计结果生成。
+    子进程不一定继承主进程运行时修改的类属性(spawn方式启动时)，file_dir作为参数传给每个分片
+    :param export_class: XlsxWriterToExport的子类(或同样参数的可序列化工厂函数)，以data、export_name关键字参数创建
+    :param source: 数据源，列表或生成器，每行数据需要能被pickle
+    :param rows_per_shard: 每个分片的行数
+    :param max_workers: 进程数，默认为cpu核数
+    :param export_name: 文件名称，分片文件名为 名称_序号，默认取export_class.export_name
+    :param bundle: 是否把所有分片打包成一个zip文件
+    :param mp_context: 进程池使用的multiprocessing上下文，默认为平台的默认方式
+    :param kwargs: 传给export_class的其他参数
+    :return: 分片文件路径列表；bundle为True时返回zip文件路径
+    """
+    export_name = export_name or export_class.export_name
+    if 'file_dir' not in kwargs and getattr(export_class, 'file_dir', None) is not None:
+        kwargs['file_dir'] = export_class.file_dir
+    rows = iter(source)
+    results = []
+    # 已完成分片的统计结果，每个分片一个列表，按表格顺序
+    summaries = []
+
+    def collect(future):
+        result, table_summaries = future.result()
+        results.append(result)
+        summaries.append(table_summaries)
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+        # 同时在途的分片数有上限，避免一次性把整个数据源读进内存；多预读一个分片，用来判断当前分片是否为最后一个
+        max_pending = (max_workers or os.cpu_count() or 1) * 2
+        pending = []
+        chunk = list(itertools.islice(rows, rows_per_shard))
+        for index in itertools.count(1):
+            if not chunk:
+                break
+            next_chunk = list(itertools.islice(rows, rows_per_shard))
+            name = u'{}_{}'.format(export_name, index)
+            if next_chunk:
+                shard_kwargs = dict(kwargs, summary_rows=False)
+            else:
+                while pending:
+                    collect(pending.pop(0))
+                shard_kwargs = dict(kwargs)
+                if summaries:
+                    shard_kwargs['base_summaries'] = [ColumnAggregator.merge_summaries(parts)
+                                                      for parts in zip(*summaries)]
+            pending.append(executor.submit(_export_shard, export_class, chunk, name, shard_kwargs))
+            chunk = next_chunk
+            if len(pending) >= max_pending:
+                collect(pending.pop(0))
+        for future in pending:
+            collect(future)
+
+    if not bundle or not results:
+        return results
+    if isinstance(results[0], bytes):
+        # 内存模式，返回zip的二进制内容
+        output = BytesIO()
+        # xlsx本身已经压缩过，打包时不再压缩
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED, allowZip64=True) as bundle_file:
+            for index, content in enumerate(results, 1):
+                bundle_file.writestr(u'{}_{}.xlsx'.format(export_name, index), content)
+        return output.getvalue()
+    bundle_path = os.path.join(os.path.dirname(results[0]), u'{}.zip'.format(export_name))
+    with zipfile.ZipFile(bundle_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as bundle_file:
+        for path in results:
+            bundle_file.write(path, os.path.basename(path))
+            os.remove(path)
+    return bundle_path
+
+
 class ExportTest(XlsxWriterToExport):
     file_dir = "basic_dir\\"
 
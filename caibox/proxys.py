@@ -16,7 +16,19 @@ __author__ = 'caiwanpeng'
 __version__ = '1.1'
 
 import copy
+import inspect
+import logging
+import operator
 import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
 
 PY2 = sys.version_info[0] == 2
 
@@ -154,6 +166,654 @@ class ObjProxy(object):
     __copy__ = lambda x: copy.copy(x._get_current_object())
     __deepcopy__ = lambda x, o: copy.deepcopy(x._get_current_object(), memo=o)
 
+
+class ProxyGeneration(object):
+    """
+    代理缓存的版本号，多个CachedObjProxy可以共用一个，invalidate后这些代理下次访问时重新解析真实对象
+    for example:
+    registry_generation = ProxyGeneration()
+    config_proxy = CachedObjProxy(get_config, generation=registry_generation)
+    ...
+    # 配置更新后
+    registry_generation.invalidate()
+    """
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def invalidate(self):
+        # 只有一个写操作，不需要加锁；并发的invalidate少加一次也同样会让缓存失效
+        self.value += 1
+
+
+# 没有缓存的标记
+_MISSING = (None, None, None)
+
+
+class CachedObjProxy(ObjProxy):
+    """
+    缓存真实对象的代理。ObjProxy代理工厂函数时每次访问属性、每次运算都会调用一次工厂函数，
+    这里第一次访问时调用工厂函数并缓存结果，之后直接返回缓存，直到缓存失效：
+    超过ttl秒、generation的版本号变化或调用_invalidate。
+    缓存状态保存在一个元组里，读取时不加锁；缓存失效后只有一个线程调用工厂函数，其他线程等待它的结果。
+    for example:
+    def get_config():
+        return Registry.lookup('config')
+
+    config = CachedObjProxy(get_config, ttl=60)
+    config['name']
+    """
+    __slots__ = ('__state', '__ttl', '__generation', '__lock')
+
+    def __init__(self, local, ttl=None, generation=None):
+        """
+        :param local: 真实对象或返回真实对象的工厂函数
+        :param ttl: 缓存的秒数，None表示不过期
+        :param generation: ProxyGeneration，版本号变化后缓存失效
+        """
+        super(CachedObjProxy, self).__init__(local)
+        set_attr = object.__setattr__
+        # (真实对象, 过期时间, 缓存时的版本号)
+        set_attr(self, '_CachedObjProxy__state', _MISSING)
+        set_attr(self, '_CachedObjProxy__ttl', ttl)
+        set_attr(self, '_CachedObjProxy__generation', generation)
+        set_attr(self, '_CachedObjProxy__lock', threading.Lock())
+
+    def _get_current_object(self):
+        obj, expires, seen = self.__state
+        if seen is not None and (expires is None or time.monotonic() < expires):
+            generation = self.__generation
+            if generation is None or generation.value == seen:
+                return obj
+        return self.__resolve()
+
+    def __resolve(self):
+        with self.__lock:
+            # 等待锁的过程中其他线程可能已经解析过
+            obj, expires, seen = self.__state
+            generation = self.__generation
+            version = generation.value if generation is not None else 0
+            if seen is not None and seen == version and (expires is None or time.monotonic() < expires):
+                return obj
+            obj = super(CachedObjProxy, self)._get_current_object()
+            expires = time.monotonic() + self.__ttl if self.__ttl is not None else None
+            object.__setattr__(self, '_CachedObjProxy__state', (obj, expires, version))
+            return obj
+
+    def _invalidate(self):
+        """
+        @desc 清除缓存，下次访问时重新调用工厂函数。以下划线开头，避免遮住真实对象的同名属性
+        :return:
+        """
+        object.__setattr__(self, '_CachedObjProxy__state', _MISSING)
+
+
+class ContextProxy(ObjProxy):
+    """
+    上下文代理：通过contextvars.ContextVar解析真实对象，每个asyncio任务、每个线程看到的是自己绑定的对象，
+    同一个全局名称下不同请求各有各的数据库会话、当前用户、导出配置。解析只是一次ContextVar.get。
+    没有绑定对象时访问会抛出RuntimeError，repr、bool显示为未绑定。
+    for example:
+    current_user = ContextProxy('current_user')
+
+    async def handle(request):
+        with current_user._bound(request.user):
+            await do_something()   # 其中直接使用current_user.name
+    """
+    __slots__ = ('__var',)
+
+    def __init__(self, var):
+        """
+        :param var: contextvars.ContextVar或变量名称
+        """
+        if contextvars is None:
+            raise RuntimeError(u'ContextProxy需要python3.7以上的contextvars')
+        if not isinstance(var, contextvars.ContextVar):
+            var = contextvars.ContextVar(var)
+        super(ContextProxy, self).__init__(var)
+        object.__setattr__(self, '_ContextProxy__var', var)
+
+    def _get_current_object(self):
+        try:
+            return self.__var.get()
+        except LookupError:
+            raise RuntimeError(u'{}没有绑定对象'.format(self.__var.name))
+
+    def _bind(self, obj):
+        """
+        @desc 在当前上下文绑定真实对象
+        :param obj: 真实对象
+        :return: token，传给_unbind恢复之前的绑定
+        """
+        return self.__var.set(obj)
+
+    def _unbind(self, token):
+        self.__var.reset(token)
+
+    @contextmanager
+    def _bound(self, obj):
+        # with块内绑定obj，退出时恢复之前的绑定
+        token = self.__var.set(obj)
+        try:
+            yield obj
+        finally:
+            self.__var.reset(token)
+
+
+class ThreadLocalProxy(ObjProxy):
+    """
+    线程局部代理：每个线程绑定自己的真实对象，适合线程池中每个线程复用一个对象，如数据库连接。
+    传入factory时，线程第一次访问自动调用factory创建对象，之后一直复用。
+    for example:
+    db = ThreadLocalProxy(lambda: sqlite3.connect(DB_PATH))
+    db.execute('select 1')
+    """
+    __slots__ = ('__storage', '__factory')
+
+    def __init__(self, factory=None):
+        """
+        :param factory: 为线程创建真实对象的函数，None表示只能通过_bind绑定
+        """
+        storage = threading.local()
+        super(ThreadLocalProxy, self).__init__(storage)
+        object.__setattr__(self, '_ThreadLocalProxy__storage', storage)
+        object.__setattr__(self, '_ThreadLocalProxy__factory', factory)
+
+    def _get_current_object(self):
+        try:
+            return self.__storage.obj
+        except AttributeError:
+            if self.__factory is None:
+                raise RuntimeError(u'当前线程没有绑定对象')
+            obj = self.__storage.obj = self.__factory()
+            return obj
+
+    def _bind(self, obj):
+        self.__storage.obj = obj
+
+    def _unbind(self):
+        self.__storage.__dict__.pop('obj', None)
+
+
+class LocalStack(object):
+    """
+    上下文局部的栈，push、pop作用于当前上下文(asyncio任务或线程)，proxy()返回的代理总是指向栈顶。
+    栈保存为ContextVar中的元组，复制上下文创建任务时子任务不会修改父任务的栈。
+    for example:
+    export_configs = LocalStack('export_config')
+    current_config = export_configs.proxy()
+
+    with export_configs.pushed(config):
+        current_config['profile']
+    """
+
+    def __init__(self, name='local_stack'):
+        if contextvars is None:
+            raise RuntimeError(u'LocalStack需要python3.7以上的contextvars')
+        self._var = contextvars.ContextVar(name)
+
+    def push(self, obj):
+        """
+        @desc 入栈
+        :param obj: 真实对象
+        :return: token，传给reset恢复到入栈前
+        """
+        return self._var.set(self._var.get(()) + (obj,))
+
+    def pop(self):
+        """
+        @desc 出栈
+        :return: 栈顶对象，栈为空时返回None
+        """
+        stack = self._var.get(())
+        if not stack:
+            return None
+        self._var.set(stack[:-1])
+        return stack[-1]
+
+    def reset(self, token):
+        self._var.reset(token)
+
+    @property
+    def top(self):
+        stack = self._var.get(())
+        return stack[-1] if stack else None
+
+    def __len__(self):
+        return len(self._var.get(()))
+
+    @contextmanager
+    def pushed(self, obj):
+        # with块内obj在栈顶
+        token = self.push(obj)
+        try:
+            yield obj
+        finally:
+            self._var.reset(token)
+
+    def proxy(self):
+        return StackProxy(self._var)
+
+
+class StackProxy(ObjProxy):
+    """
+    指向LocalStack栈顶的代理，由LocalStack.proxy创建
+    """
+    __slots__ = ('__var',)
+
+    def __init__(self, var):
+        super(StackProxy, self).__init__(var)
+        object.__setattr__(self, '_StackProxy__var', var)
+
+    def _get_current_object(self):
+        stack = self.__var.get(())
+        if stack:
+            return stack[-1]
+        raise RuntimeError(u'{}为空'.format(self.__var.name))
+
+
+# 所有LazyObjProxy的弱引用，用于找出从未使用的延迟对象；代理会转发__hash__，不能放入WeakSet
+_LAZY_PROXIES = []
+
+
+def _forget_lazy_proxy(ref):
+    # 代理回收时从_LAZY_PROXIES中删除它的弱引用；已经失效的弱引用之间按身份比较，不会调用代理的__eq__
+    try:
+        _LAZY_PROXIES.remove(ref)
+    except ValueError:
+        pass
+
+
+class LazyObjProxy(ObjProxy):
+    """
+    延迟初始化的代理：模块加载时只创建代理，第一次使用时才调用factory创建真实对象，加快服务启动。
+    多个线程同时第一次使用时factory只调用一次。创建完成后代理的类切换为ResolvedLazyObjProxy，
+    之后每次访问直接返回真实对象，不再检查是否已初始化；子类保留自己的类，用__resolved标记是否已初始化。
+    调用方的代码不需要修改，untouched_lazy_proxies可以列出一直没有使用过的延迟对象。
+    for example:
+    city_table = LazyObjProxy(load_city_table, name='city_table')
+    ...
+    city_table['440100']
+    """
+    __slots__ = ('__obj', '__factory', '__name', '__lock', '__resolved', '__weakref__')
+
+    def __init__(self, factory, name=None):
+        """
+        :param factory: 创建真实对象的函数
+        :param name: 名称，默认为factory的模块和名称
+        """
+        super(LazyObjProxy, self).__init__(factory)
+        if name is None:
+            name = '{}.{}'.format(getattr(factory, '__module__', None) or '?',
+                                  getattr(factory, '__qualname__', None) or getattr(factory, '__name__', repr(factory)))
+        set_attr = object.__setattr__
+        set_attr(self, '_LazyObjProxy__factory', factory)
+        set_attr(self, '_LazyObjProxy__name', name)
+        set_attr(self, '_LazyObjProxy__lock', threading.Lock())
+        set_attr(self, '_LazyObjProxy__resolved', False)
+        _LAZY_PROXIES.append(weakref.ref(self, _forget_lazy_proxy))
+
+    def _get_current_object(self):
+        if self.__resolved:
+            return self.__obj
+        with self.__lock:
+            # 等待锁的过程中其他线程可能已经初始化完成
+            if not self.__resolved:
+                obj = self.__factory()
+                set_attr = object.__setattr__
+                set_attr(self, '_LazyObjProxy__obj', obj)
+                # 初始化后不再需要factory，不要让它引用的对象一直不能回收
+                set_attr(self, '_LazyObjProxy__factory', None)
+                set_attr(self, '_ObjProxy__local', None)
+                set_attr(self, '_LazyObjProxy__resolved', True)
+                if type(self) is LazyObjProxy:
+                    set_attr(self, '__class__', ResolvedLazyObjProxy)
+        return self.__obj
+
+    def __repr__(self):
+        # 查看未初始化的代理时不触发初始化
+        if self.__resolved:
+            return ObjProxy.__repr__(self)
+        return '<%s %s unresolved>' % (self.__class__.__name__, self.__name)
+
+
+class ResolvedLazyObjProxy(LazyObjProxy):
+    """
+    已经初始化的LazyObjProxy，直接返回真实对象
+    """
+    __slots__ = ()
+
+    def _get_current_object(self):
+        return self._LazyObjProxy__obj
+
+    __repr__ = ObjProxy.__repr__
+
+
+def untouched_lazy_proxies():
+    """
+    @desc 一直没有使用过的LazyObjProxy的名称，可以在服务运行一段时间后检查，删除不需要的对象
+    :return: 名称列表
+    """
+    proxies = [ref() for ref in list(_LAZY_PROXIES)]
+    return sorted(proxy._LazyObjProxy__name for proxy in proxies
+                  if proxy is not None and not proxy._LazyObjProxy__resolved)
+
+
+# 专用代理类可以定义的方法：(方法名, 参数, 表达式)，表达式中{obj}为真实对象
+_UNARY = [
+    ('__len__', 'len({obj})'), ('__iter__', 'iter({obj})'), ('__reversed__', 'reversed({obj})'),
+    ('__bool__', 'bool({obj})'), ('__neg__', '-{obj}'), ('__pos__', '+{obj}'), ('__abs__', 'abs({obj})'),
+    ('__invert__', '~{obj}'), ('__int__', 'int({obj})'), ('__float__', 'float({obj})'),
+    ('__complex__', 'complex({obj})'), ('__index__', '{obj}.__index__()'), ('__enter__', '{obj}.__enter__()'),
+    ('__hash__', 'hash({obj})'),
+]
+_BINARY = [
+    ('__getitem__', '{obj}[other]'), ('__contains__', 'other in {obj}'),
+    ('__lt__', '{obj} < other'), ('__le__', '{obj} <= other'), ('__eq__', '{obj} == other'),
+    ('__ne__', '{obj} != other'), ('__gt__', '{obj} > other'), ('__ge__', '{obj} >= other'),
+    ('__add__', '{obj} + other'), ('__sub__', '{obj} - other'), ('__mul__', '{obj} * other'),
+    ('__matmul__', '{obj} @ other'), ('__truediv__', '{obj} / other'), ('__floordiv__', '{obj} // other'),
+    ('__mod__', '{obj} % other'), ('__divmod__', 'divmod({obj}, other)'), ('__pow__', '{obj} ** other'),
+    ('__lshift__', '{obj} << other'), ('__rshift__', '{obj} >> other'), ('__and__', '{obj} & other'),
+    ('__xor__', '{obj} ^ other'), ('__or__', '{obj} | other'),
+    ('__radd__', 'other + {obj}'), ('__rsub__', 'other - {obj}'), ('__rmul__', 'other * {obj}'),
+    ('__rmatmul__', 'other @ {obj}'), ('__rtruediv__', 'other / {obj}'), ('__rfloordiv__', 'other // {obj}'),
+    ('__rmod__', 'other % {obj}'), ('__rdivmod__', 'divmod(other, {obj})'), ('__rpow__', 'other ** {obj}'),
+    ('__rlshift__', 'other << {obj}'), ('__rrshift__', 'other >> {obj}'), ('__rand__', 'other & {obj}'),
+    ('__rxor__', 'other ^ {obj}'), ('__ror__', 'other | {obj}'),
+]
+_OTHERS = [
+    ('__setitem__', 'key, value', '{obj}[key] = value'),
+    ('__delitem__', 'key', 'del {obj}[key]'),
+    ('__call__', '*args, **kwargs', 'return {obj}(*args, **kwargs)'),
+    ('__exit__', '*args', 'return {obj}.__exit__(*args)'),
+]
+# 所有类型都需要的方法
+_COMMON = """
+def __getattr__(self, name):
+    return getattr({obj}, name)
+
+def __setattr__(self, name, value):
+    setattr({obj}, name, value)
+
+def __delattr__(self, name):
+    delattr({obj}, name)
+
+def __dir__(self):
+    return dir({obj})
+
+def __repr__(self):
+    return repr({obj})
+
+def __str__(self):
+    return str({obj})
+
+def __copy__(self):
+    return copy.copy({obj})
+
+def __deepcopy__(self, memo):
+    return copy.deepcopy({obj}, memo)
+"""
+_SPECIALIZED_CLASSES = {}
+_SPECIALIZED_LOCK = threading.Lock()
+
+
+class SpecializedProxy(object):
+    """
+    specialized_proxy生成的专用代理类的基类，没有__dict__，每个实例只有一个槽保存真实对象(或工厂函数)
+    """
+    __slots__ = ('_SpecializedProxy__local',)
+
+    def __init__(self, local):
+        object.__setattr__(self, '_SpecializedProxy__local', local)
+
+    def _get_current_object(self):
+        local = self.__local
+        return local() if self.__factory else local
+
+
+def specialized_proxy(target_type, factory=False):
+    """
+    @desc 为某一类型生成专用的代理类：只定义该类型支持的运算方法，每个方法直接取真实对象，
+    不经过ObjProxy通用的lambda和_get_current_object。同一类型只生成一次。
+    for example:
+    DictProxy = specialized_proxy(dict)
+    config = DictProxy(real_config)
+
+    ConfigProxy = specialized_proxy(dict, factory=True)
+    config = ConfigProxy(get_config)
+    :param target_type: 真实对象的类型，代理只能代理该类型(或支持同样运算的子类)的对象
+    :param factory: 为True时代理工厂函数，每次访问调用一次，同ObjProxy代理函数
+    :return: 代理类
+    """
+    key = (target_type, bool(factory))
+    proxy_class = _SPECIALIZED_CLASSES.get(key)
+    if proxy_class is not None:
+        return proxy_class
+    with _SPECIALIZED_LOCK:
+        if key not in _SPECIALIZED_CLASSES:
+            _SPECIALIZED_CLASSES[key] = _build_specialized_proxy(target_type, bool(factory))
+    return _SPECIALIZED_CLASSES[key]
+
+
+def _build_specialized_proxy(target_type, factory):
+    obj = 'self._SpecializedProxy__local()' if factory else 'self._SpecializedProxy__local'
+    supported = lambda name: getattr(target_type, name, None) is not None
+    lines = [_COMMON]
+    for name, expr in _UNARY:
+        if supported(name):
+            lines.append('def {}(self):\n    return {}\n'.format(name, expr))
+    for name, expr in _BINARY:
+        if supported(name):
+            lines.append('def {}(self, other):\n    return {}\n'.format(name, expr))
+    for name, args, body in _OTHERS:
+        if supported(name):
+            lines.append('def {}(self, {}):\n    {}\n'.format(name, args, body))
+    # 类型自身的属性和方法生成转发的property，不用先查找失败再进入__getattr__；实例属性仍由__getattr__转发
+    attr_names = [name for name in dir(target_type) if not name.startswith('__') and name != '_get_current_object']
+    if factory:
+        for name in attr_names:
+            lines.append('def _attr_{0}(self):\n    return {1}.{0}\n'.format(name, obj))
+    namespace = {'copy': copy}
+    exec('\n'.join(lines).replace('{obj}', obj), namespace)
+    attrs = dict((name, value) for name, value in namespace.items() if name.startswith('__') and callable(value))
+    for name in attr_names:
+        getter = namespace['_attr_' + name] if factory else operator.attrgetter('{}.{}'.format(obj[5:], name))
+        attrs[name] = property(getter)
+    attrs['__slots__'] = ()
+    attrs['_SpecializedProxy__factory'] = factory
+    # 不可哈希的类型(如dict)没有生成__hash__，定义了__eq__的类__hash__为None，代理也不可哈希
+    type_name = target_type.__name__
+    name = '{}{}{}Proxy'.format(type_name[:1].upper(), type_name[1:], 'Factory' if factory else '')
+    return type(name, (SpecializedProxy,), attrs)
+
+
+class ProxyProfile(object):
+    """
+    代理的使用统计：每个属性名、每种运算(__getitem__、__iter__、__call__等)的调用次数，
+    以及按sample_rate抽样的耗时。多个ProfilingObjProxy可以共用一个，统计结果通过snapshot读取或start_dump定时输出。
+    for example:
+    profile = ProxyProfile(sample_rate=0.01, name='config')
+    config = ProfilingObjProxy(get_config, profile=profile)
+    profile.start_dump(interval=300)
+    ...
+    profile.snapshot()
+    """
+
+    def __init__(self, sample_rate=0.01, name='proxy'):
+        """
+        :param sample_rate: 记录耗时的比例，1表示每次都记录，0表示只计数；按每种操作的第N次调用抽样
+        :param name: 名称，输出统计时使用
+        """
+        self.name = name
+        self.enabled = True
+        self.interval = int(round(1.0 / sample_rate)) if sample_rate > 0 else 0
+        self._lock = threading.Lock()
+        self._calls = {}
+        # 操作 -> [抽样次数, 总耗时, 最大耗时]
+        self._timings = {}
+        self._dump_stop = None
+
+    def hit(self, name):
+        """
+        @desc 记录一次调用。计数不加锁，多线程同时调用时可能少计几次，换取每次调用的开销最小
+        :param name: 属性名或运算方法名
+        :return: 这次调用是否需要记录耗时
+        """
+        calls = self._calls
+        count = calls[name] = calls.get(name, 0) + 1
+        return self.interval and not count % self.interval
+
+    def timed(self, name, method, *args, **kwargs):
+        # 调用并记录耗时
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, elapsed):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                self._timings[name] = [1, elapsed, elapsed]
+            else:
+                timing[0] += 1
+                timing[1] += elapsed
+                if elapsed > timing[2]:
+                    timing[2] = elapsed
+
+    def snapshot(self, reset=False):
+        """
+        @desc 当前的统计结果，按调用次数从多到少排列
+        :param reset: 是否清空统计
+        :return: {操作: {'calls': 调用次数, 'sampled': 抽样次数, 'mean': 平均耗时(秒), 'max': 最大耗时(秒)}}
+        """
+        with self._lock:
+            calls, timings = self._calls, self._timings
+            if reset:
+                self._calls, self._timings = {}, {}
+            else:
+                calls, timings = dict(calls), dict((name, list(timing)) for name, timing in timings.items())
+        result = {}
+        for name, count in sorted(calls.items(), key=lambda item: -item[1]):
+            sampled, total, longest = timings.get(name, (0, 0.0, 0.0))
+            result[name] = {'calls': count, 'sampled': sampled, 'mean': total / sampled if sampled else None,
+                            'max': longest if sampled else None}
+        return result
+
+    def reset(self):
+        self.snapshot(reset=True)
+
+    def dump(self, snapshot=None):
+        # 把统计结果写入日志
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        lines = [u'proxy profile {}:'.format(self.name)]
+        for name, item in snapshot.items():
+            lines.append(u'  {:<24} calls={:<10} mean={} max={}'.format(
+                name, item['calls'], '-' if item['mean'] is None else '{:.1f}us'.format(item['mean'] * 1e6),
+                '-' if item['max'] is None else '{:.1f}us'.format(item['max'] * 1e6)))
+        logging.info('\n'.join(lines))
+
+    def start_dump(self, interval=60, callback=None, reset=True):
+        """
+        @desc 后台线程定时输出统计结果
+        :param interval: 间隔秒数
+        :param callback: 接收snapshot结果的函数，默认写入日志
+        :param reset: 每次输出后是否清空统计，为True时每次输出的是这段时间内的统计
+        :return:
+        """
+        self.stop_dump()
+        callback = callback or (lambda snapshot: self.dump(snapshot))
+        stop = self._dump_stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    callback(self.snapshot(reset=reset))
+                except Exception as e:
+                    logging.error("dump proxy profile is fail, error msg: {}".format(str(e)[:200]))
+
+        thread = threading.Thread(target=run, name='proxy-profile-{}'.format(self.name))
+        thread.daemon = True
+        thread.start()
+
+    def stop_dump(self):
+        if self._dump_stop is not None:
+            self._dump_stop.set()
+            self._dump_stop = None
+
+
+class ProfilingObjProxy(ObjProxy):
+    """
+    统计使用情况的代理：经过代理的每次属性访问和运算都计入ProxyProfile，找出哪些代码路径使用共享资源最多，
+    不需要外部的profiler。profile.enabled为False时只多一次判断。
+    for example:
+    session = ProfilingObjProxy(get_session, sample_rate=0.001)
+    ...
+    session._get_profile().snapshot()
+    """
+    __slots__ = ('__profile',)
+
+    def __init__(self, local, profile=None, sample_rate=0.01):
+        """
+        :param local: 真实对象或返回真实对象的工厂函数
+        :param profile: ProxyProfile，多个代理可以共用；默认新建一个
+        :param sample_rate: 新建ProxyProfile时记录耗时的比例
+        """
+        super(ProfilingObjProxy, self).__init__(local)
+        object.__setattr__(self, '_ProfilingObjProxy__profile', profile or ProxyProfile(sample_rate))
+
+    def _get_profile(self):
+        return self.__profile
+
+    def __getattr__(self, name):
+        # 属性按属性名统计
+        profile = self.__profile
+        if profile.enabled and profile.hit(name):
+            return profile.timed(name, ObjProxy.__getattr__, self, name)
+        return ObjProxy.__getattr__(self, name)
+
+
+def _profiled(name, method):
+    # 包装ObjProxy的运算方法，按方法名统计；固定参数个数的方法不用*args转发，没有抽样时开销更小
+    code = method.__code__
+    arg_count = -1 if code.co_flags & (inspect.CO_VARARGS | inspect.CO_VARKEYWORDS) else code.co_argcount
+    if arg_count == 1:
+        def wrapper(self):
+            profile = self._ProfilingObjProxy__profile
+            if profile.enabled and profile.hit(name):
+                return profile.timed(name, method, self)
+            return method(self)
+    elif arg_count == 2:
+        def wrapper(self, other):
+            profile = self._ProfilingObjProxy__profile
+            if profile.enabled and profile.hit(name):
+                return profile.timed(name, method, self, other)
+            return method(self, other)
+    elif arg_count == 3:
+        def wrapper(self, first, second):
+            profile = self._ProfilingObjProxy__profile
+            if profile.enabled and profile.hit(name):
+                return profile.timed(name, method, self, first, second)
+            return method(self, first, second)
+    else:
+        def wrapper(self, *args, **kwargs):
+            profile = self._ProfilingObjProxy__profile
+            if profile.enabled and profile.hit(name):
+                return profile.timed(name, method, self, *args, **kwargs)
+            return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name, _method in list(ObjProxy.__dict__.items()):
+    if _name.startswith('__') and callable(_method) and _name not in ('__init__', '__getattr__'):
+        setattr(ProfilingObjProxy, _name, _profiled(_name, _method))
+del _name, _method
+
+
 if __name__ == "__main__":
     class MyDict(dict):
         pass
@@ -4,17 +4,714 @@ __author__ = "caiwanpeng"
 
 """测试execl工具"""
 
+import asyncio
+import datetime
+import functools
+import io
+import multiprocessing
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from caibox.execl_utils import ExportTest
+import zipfile
+from unittest import mock
+
+import xlsxwriter
+
+from caibox import execl_address
+from caibox.execl_cache import ExportCache
+from caibox.execl_jobs import ExportQueueFull, ExportScheduler
+from caibox.execl_schema import ReportSchema, build_head_block
+from caibox.execl_sources import CursorSource, PagedSource
+from caibox.execl_utils import EXPORT_PROFILES, ExportStats, ExportTest, SheetBuilder, XlsxWriterToExport, export_sharded
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TableExport(XlsxWriterToExport):
+    """使用add_table_head/add_table_data导出的测试类"""
+    export_name = "表格测试"
+
+    def add_sheets(self):
+        ws = self.workbook.add_worksheet(u"明细")
+        options = {'first_row': 0, 'source': self.data, 'head_format': self.head_format}
+        self.add_table_head(ws, options, u'序号', child_list={'type': 'index'})
+        self.add_table_head(ws, options, u'基本信息', child_list=[
+            {'code': 'name', 'head': u'姓名'},
+            {'code': 'age', 'head': u'年龄', 'type': 'sum', 'format': self.int_format},
+        ])
+        self.add_table_data(ws, options)
+
+
+class SchemaExport(XlsxWriterToExport):
+    """使用报表结构导出的测试类，内容和TableExport相同"""
+    export_name = "表格测试"
+    report_schema = ReportSchema([
+        (u'序号', {'type': 'index'}),
+        (u'基本信息', [{'code': 'name', 'head': u'姓名'}, {'code': 'age', 'head': u'年龄', 'type': 'sum', 'format': 'int'}]),
+    ])
+
+    def add_sheets(self):
+        ws = self.workbook.add_worksheet(u"明细")
+        self.add_table(ws)
+
+
+class GatedExport(TableExport):
+    """等待gate打开后才生成的测试类"""
+    gate = threading.Event()
+
+    def add_sheets(self):
+        self.gate.wait(5)
+        super(GatedExport, self).add_sheets()
+
+
+class TitleExport(XlsxWriterToExport):
+    """带批注表头的测试类，子列继承一级表头的批注"""
+    export_name = "批注测试"
+
+    def add_sheets(self):
+        ws = self.workbook.add_worksheet(u"明细")
+        options = {'head_format': self.head_format, 'source': self.data}
+        self.add_table_head(ws, options, u'基本信息', title=u'用户资料', child_list=[
+            {'code': 'name', 'head': u'姓名'},
+            {'code': 'age', 'head': u'年龄', 'title': u'周岁'},
+        ])
+        self.add_table_head(ws, options, u'城市', title=u'常住城市', child_list=[{'code': 'city', 'head': u'城市'}])
+        self.add_table_data(ws, options, add_sum_line=False)
+
+
+class ColumnExport(XlsxWriterToExport):
+    """按列写入的测试类"""
+    export_name = "按列测试"
+
+    def add_sheets(self):
+        ws = self.workbook.add_worksheet(u"按列")
+        options = {'head_row': 1, 'source': self.data}
+        self.add_table_head(ws, options, child_list=[
+            {'type': 'index', 'head': u'序号'},
+            {'code': 'qty', 'head': u'数量', 'type': 'sum'},
+            {'code': 'price', 'head': u'单价', 'type': 'avg'},
+            {'code': 'rate', 'head': u'比例', 'format': 'percent'},
+            {'code': 'day', 'head': u'日期'},
+            {'code': 'name', 'head': u'名称', 'type': 'count'},
+            {'code': 'missing', 'head': u'缺失', 'default': '-'},
+        ])
+        self.last_row = self.add_table_columns(ws, options)
+
+
+def read_sheet_xml(path, index=1):
+    with zipfile.ZipFile(path) as zf:
+        return zf.read('xl/worksheets/sheet{}.xml'.format(index)).decode('utf-8')
+
 
 class TestExecl(unittest.TestCase):
 
+    def setUp(self):
+        self.file_dir = tempfile.mkdtemp()
+        # 只在本测试期间修改导出类的保存目录
+        for export_class in (TableExport, SchemaExport, TitleExport, ColumnExport):
+            patcher = mock.patch.object(export_class, 'file_dir', self.file_dir)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.file_dir, ignore_errors=True)
+
+    def export_sheet(self, export_class, index=1, **kwargs):
+        # 导出文件并读取第index个工作表的xml
+        manager = export_class(**kwargs)
+        return manager, read_sheet_xml(manager.get_excel_url(), index)
+
     def test_create_execl(self):
         name = "测试文件"
         data = [["标题"], ["name", "age", "hight"], ["才玩彭", 18, 90], ["fdf", 60, 130]]
         manager = ExportTest(name=name, data=data)
         print(manager.get_excel_url())
 
+    def test_constant_memory_generator(self):
+        source = ({'name': u'用户{}'.format(i), 'age': i} for i in range(1, 1001))
+        manager, sheet = self.export_sheet(TableExport, data=source, constant_memory=True)
+        self.assertTrue(manager.workbook.constant_memory)
+        # 2行表头 + 1000行数据 + 1行合计
+        self.assertIn('<row r="1003"', sheet)
+        # 第一行的合并表头在第二行表头之后才加入head_datas，也不能丢失
+        heads = dict(re.findall('<c r="([A-C][12])"[^>]*t="inlineStr"><is><t>([^<]*)</t>', sheet))
+        self.assertEqual(heads, {'A1': u'序号', 'B1': u'基本信息', 'A2': u'序号', 'B2': u'姓名', 'C2': u'年龄'})
+        self.assertLess(sheet.index('<row r="1"'), sheet.index('<row r="2"'))
+        self.assertIn('<v>500500</v>', sheet)
+
+    def test_format_registry_reuses_formats(self):
+        counts = []
+        for rows in (10, 200):
+            data = [["标题"], ["name", "age"]] + [["name", i] for i in range(rows)]
+            manager = ExportTest(name="格式测试", data=data)
+            counts.append(len(manager.workbook.formats))
+            self.assertIs(manager.get_format({'font_color': '#333333'}),
+                          manager.get_format({'FONT_COLOR': '#333333 '}))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_compile_accessors(self):
+        class Row(object):
+            name = u'张三'
+
+        codes = [None, 'name', 'age', lambda obj: obj['name'] * 2]
+        defaults = ['', '', 0, u'错误']
+        col_type = ['index', None, None, None]
+        accessors = XlsxWriterToExport.compile_accessors(codes, defaults, col_type, {})
+        self.assertEqual([f({'name': 'a'}) for f in accessors], [1, 'a', 0, 'aa'])
+        self.assertEqual([f({}) for f in accessors], [2, '', 0, u'错误'])
+        accessors = XlsxWriterToExport.compile_accessors(codes, defaults, col_type, Row())
+        self.assertEqual([f(Row()) for f in accessors], [1, u'张三', 0, u'错误'])
+        # 数据源为空时没有取值函数，没有字段名的列也不会出错
+        self.assertEqual(XlsxWriterToExport.compile_accessors(codes, defaults, col_type, None), [])
+
+    def test_empty_source(self):
+        class EmptyExport(TableExport):
+            file_dir = self.file_dir
+
+            def add_sheets(self):
+                ws = self.workbook.add_worksheet(u"明细")
+                options = {'source': self.data, 'group_by': 'a'}
+                self.add_table_head(ws, options, u'信息', child_list=[{'head': u'空列'}, {'code': 'a', 'type': 'sum'}])
+                self.last_row = self.add_table_data(ws, options)
+
+        manager, sheet = self.export_sheet(EmptyExport, data=[])
+        # 2行表头 + 1行合计
+        self.assertEqual(manager.last_row, 3)
+        self.assertIn(u'<row r="3"', sheet)
+
+    def test_aggregate_summary_rows(self):
+        class GroupExport(TableExport):
+            file_dir = self.file_dir
+
+            def add_sheets(self):
+                ws = self.workbook.add_worksheet(u"统计")
+                options = {'head_row': 1, 'source': self.data, 'group_by': 'dept'}
+                self.add_table_head(ws, options, child_list=[
+                    {'code': 'dept', 'head': u'部门'},
+                    {'code': 'age', 'head': u'人数', 'type': 'count'},
+                    {'code': 'age', 'head': u'平均', 'type': 'avg'},
+                    {'code': 'age', 'head': u'最小', 'type': 'min'},
+                    {'code': 'age', 'head': u'最大', 'type': 'max'},
+                ])
+                self.summary_row = self.add_table_data(ws, options)
+
+        source = iter([{'dept': 'a', 'age': 10}, {'dept': 'b', 'age': 30},
+                       {'dept': 'a', 'age': 20}, {'dept': 'b', 'age': ''}])
+        manager, sheet = self.export_sheet(GroupExport, data=source)
+        # 1行表头 + 4行数据 + 2行小计 + 1行合计
+        self.assertEqual(manager.summary_row, 8)
+        self.assertIn('<c r="B8"><v>3</v></c><c r="C8"><v>20</v></c>'
+                      '<c r="D8"><v>10</v></c><c r="E8"><v>30</v></c>', sheet)
+        self.assertIn('<c r="B6"><v>2</v></c><c r="C6"><v>15</v></c>', sheet)
+
+    def test_rollover_to_next_sheet(self):
+        class SmallSheetExport(TableExport):
+            file_dir = self.file_dir
+            max_sheet_rows = 12
+
+        source = ({'name': u'用户{}'.format(i), 'age': i} for i in range(25))
+        manager = SmallSheetExport(data=source)
+        names = [ws.get_name() for ws in manager.workbook.worksheets()]
+        self.assertEqual(names, [u'明细', u'明细_2', u'明细_3'])
+        # 每页2行表头 + 10行数据，最后一页5行数据 + 合计行
+        self.assertIn(u'<row r="8"', read_sheet_xml(manager.get_excel_url(), 3))
+        self.assertNotIn(u'<row r="9"', read_sheet_xml(manager.get_excel_url(), 3))
+
+    def test_export_sharded(self):
+        source = ({'name': u'用户{}'.format(i), 'age': i} for i in range(25))
+        # spawn方式启动的子进程没有测试中修改的类属性，保存目录要作为参数传入
+        paths = export_sharded(TableExport, source, rows_per_shard=10, max_workers=2,
+                               mp_context=multiprocessing.get_context('spawn'))
+        self.assertEqual([os.path.basename(path) for path in paths],
+                         [u'表格测试_1.xlsx', u'表格测试_2.xlsx', u'表格测试_3.xlsx'])
+        self.assertTrue(all(os.path.dirname(path) == self.file_dir for path in paths))
+        strings = [zipfile.ZipFile(path).read('xl/sharedStrings.xml').decode('utf-8') for path in paths]
+        self.assertTrue(all(u'姓名' in content for content in strings))
+        # 只有最后一个分片有合计行，合计的是所有分片：0到24的和
+        self.assertEqual([u'合计' in content for content in strings], [False, False, True])
+        self.assertIn('<v>300</v>', read_sheet_xml(paths[2]))
+
+    def test_iter_output_chunks(self):
+        manager = TableExport(data=[{'name': u'用户{}'.format(i), 'age': i} for i in range(500)])
+        with open(manager.get_excel_url(), 'rb') as f:
+            content = f.read()
+        chunks = list(manager.iter_output(chunk_size=1024))
+        self.assertTrue(all(len(chunk) <= 1024 for chunk in chunks))
+        self.assertEqual(b''.join(chunks), content)
+
+        async def collect():
+            return [chunk async for chunk in manager.aiter_output(chunk_size=1024)]
+        self.assertEqual(b''.join(asyncio.run(collect())), content)
+
+    def test_in_memory_buffer(self):
+        data = [{'name': u'用户{}'.format(i), 'age': i} for i in range(500)]
+        manager = TableExport(data=data, create=False)
+        view = manager.get_buffer()
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(view.tobytes(), manager.get_excel_url())
+        self.assertEqual(b''.join(manager.iter_output()), manager.get_excel_url())
+        # 交替读取的两个生成器各自从头输出完整内容
+        first, second = manager.iter_output(chunk_size=100), manager.iter_output(chunk_size=100)
+        chunks = list(zip(first, second))
+        self.assertEqual(b''.join(a for a, _ in chunks), manager.get_excel_url())
+        self.assertEqual(b''.join(b for _, b in chunks), manager.get_excel_url())
+
+        manager = TableExport(data=data, create=False, spool_max_size=1024)
+        # 多个线程同时分块读取转存到磁盘的内容
+        content = manager.get_output()
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            streams = []
+            threads = [threading.Thread(target=lambda: streams.append(b''.join(manager.iter_output(chunk_size=64))))
+                       for _ in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(streams, [content] * 20)
+
+        async def collect():
+            return [chunk async for chunk in manager.aiter_output(chunk_size=1024)]
+        self.assertEqual(b''.join(asyncio.run(collect())), content)
+        handle = manager.get_buffer()
+        self.assertNotIsInstance(handle, memoryview)
+        self.assertEqual(handle.read(), manager.get_excel_url())
+
+        # 不复制内容，res就是缓冲区；仍被引用时也可以关闭
+        manager = TableExport(data=data, create=False, eager_output=False)
+        self.assertIsInstance(manager.res, memoryview)
+        self.assertEqual(manager.res.tobytes(), manager.get_output())
+        manager.close()
+        self.assertTrue(manager.is_close)
+
+    def check_column_export(self, data, **kwargs):
+        manager, sheet = self.export_sheet(ColumnExport, data=data, **kwargs)
+        self.assertEqual(manager.last_row, 5)
+        self.assertIn('<c r="B5" s="{}"><v>6</v></c>'.format(manager.int_format._get_xf_index()), sheet)
+        self.assertIn('<c r="C5" s="{}"><v>2</v></c>'.format(manager.money_format._get_xf_index()), sheet)
+        self.assertIn('<c r="D2" s="{}"><v>0.5</v></c>'.format(manager.percent_format._get_xf_index()), sheet)
+        self.assertIn('<c r="E2" s="{}"><v>44197</v></c>'.format(manager.date_format._get_xf_index()), sheet)
+        self.assertIn('<c r="F5"><v>2</v></c>', sheet)
+        self.assertNotIn('r="C4"', sheet)
+
+    def test_columnar_lists(self):
+        data = {'qty': [1, 2, 3], 'price': [1.5, 2.5, None], 'rate': [0.5, 0.25, 1],
+                'day': [datetime.date(2021, 1, 1)] * 3, 'name': ['a', '', 'c']}
+        self.check_column_export(data)
+        self.check_column_export(data, constant_memory=True)
+        # 数字列中的空字符串写成空白，数据源中没有的列每行写默认值
+        for constant_memory in (False, True):
+            manager, sheet = self.export_sheet(ColumnExport, data={'qty': [1, '', 3]},
+                                               export_name='blank{}'.format(constant_memory),
+                                               constant_memory=constant_memory)
+            self.assertNotIn('r="B3"', sheet)
+            self.assertIn('<c r="B5" s="{}"><v>4</v></c>'.format(manager.int_format._get_xf_index()), sheet)
+            self.assertEqual(len(re.findall('<c r="G[2-4]"', sheet)), 3)
+
+    def test_columnar_mixed_lists(self):
+        # 列表中混有其他类型的值时逐个单元格按类型写入
+        data = {'rate': [0.5, 'N/A', 1], 'day': [datetime.date(2021, 1, 1), 'x', datetime.date(2021, 1, 2)]}
+        for constant_memory in (False, True):
+            manager, sheet = self.export_sheet(ColumnExport, data=data, export_name='mixed{}'.format(constant_memory),
+                                               constant_memory=constant_memory)
+            self.assertIn('<c r="D2" s="{}"><v>0.5</v></c>'.format(manager.percent_format._get_xf_index()), sheet)
+            self.assertRegex(sheet, '<c r="D3" (s="\\d+" )?t="(s|inlineStr)">')
+            self.assertRegex(sheet, '<c r="E3" (s="\\d+" )?t="(s|inlineStr)">')
+            self.assertIn('<c r="E4"><v>44198</v></c>', sheet)
+
+    def test_columnar_rollover(self):
+        class SmallColumnExport(ColumnExport):
+            file_dir = self.file_dir
+            max_sheet_rows = 3
+
+        # 换页后类型固定的列写入新的标签页
+        _, sheet = self.export_sheet(SmallColumnExport, index=2, data={'qty': [1, 2, 3]})
+        self.assertIn('<c r="B2" s="', sheet)
+        self.assertIn('<v>3</v>', sheet)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_columnar_numpy(self):
+        data = {'qty': numpy.arange(1, 4), 'price': numpy.array([1.5, 2.5, numpy.nan]),
+                'rate': numpy.array([0.5, 0.25, 1]), 'day': numpy.array(['2021-01-01'] * 3, dtype='datetime64[D]'),
+                'name': numpy.array(['a', '', 'c'])}
+        self.check_column_export(data)
+
+    def test_export_cache(self):
+        cache = ExportCache(os.path.join(self.file_dir, 'cache'), max_bytes=10 ** 6, ttl=60)
+
+        class CachedExport(TableExport):
+            file_dir = self.file_dir
+            export_cache = cache
+            builds = 0
+
+            def add_sheets(self):
+                CachedExport.builds += 1
+                super(CachedExport, self).add_sheets()
+
+        data = [{'name': u'用户{}'.format(i), 'age': i} for i in range(100)]
+        first = CachedExport(data=data).get_output()
+        manager = CachedExport(data=list(data))
+        self.assertEqual(CachedExport.builds, 1)
+        self.assertEqual(manager.get_output(), first)
+        # 命中时复制缓存文件，改写导出的文件不影响之后的命中
+        with open(manager.get_excel_url(), 'r+b') as f:
+            f.write(b'changed')
+        self.assertEqual(CachedExport(data=data).get_output(), first)
+        self.assertEqual(CachedExport(data=data, create=False).get_excel_url(), first)
+        CachedExport(data=data[:10])
+        self.assertEqual(CachedExport.builds, 2)
+        # 生成器无法预先计算缓存键，每次都重新生成
+        CachedExport(data=iter(data))
+        self.assertEqual(CachedExport.builds, 3)
+        # 写入后端、导出配置、表头选项不同时不使用同一个缓存
+        for options in ({'backend': 'csv'}, {'profile': 'small'}, {'head_comment': 'validation'}):
+            CachedExport(data=data, export_name='options', **options)
+        self.assertEqual(CachedExport.builds, 6)
+        # 缓存文件的后缀和导出的文件类型一致
+        self.assertEqual(sorted(os.path.splitext(name)[1] for name in os.listdir(cache.cache_dir)),
+                         ['.csv', '.xlsx', '.xlsx', '.xlsx', '.xlsx'])
+        # 命中后缓存文件被其他进程删除，当作没有命中
+        missing = os.path.join(cache.cache_dir, 'missing.xlsx')
+        with mock.patch.object(cache, 'get', return_value=missing):
+            expected = read_sheet_xml(io.BytesIO(first))
+            regenerated = CachedExport(data=data)
+            self.assertEqual(read_sheet_xml(regenerated.get_excel_url()), expected)
+            self.assertEqual(read_sheet_xml(io.BytesIO(CachedExport(data=data, create=False).get_excel_url())), expected)
+        self.assertEqual(CachedExport.builds, 8)
+
+        cache.max_bytes = 0
+        cache.evict()
+        self.assertEqual(os.listdir(cache.cache_dir), [])
+
+    def test_export_stats(self):
+        reports = []
+        manager = TableExport(data=[{'name': u'用户{}'.format(i), 'age': i} for i in range(50)],
+                              stats=ExportStats(callback=reports.append))
+        stats = reports[0]
+        self.assertIs(stats, manager.stats)
+        self.assertEqual(sorted(stats.phases), ['close', 'head', 'rows'])
+        self.assertEqual((stats.rows, stats.cells), (50, 150))
+        self.assertEqual(stats.formats, len(manager.formats))
+        self.assertEqual(stats.output_bytes, os.path.getsize(manager.get_excel_url()))
+        self.assertGreaterEqual(stats.total, sum(stats.phases.values()))
+        if stats.process_peak_rss is not None:
+            self.assertTrue(0 <= stats.peak_rss_growth <= stats.process_peak_rss)
+        # 默认按行写入的导出也记录rows阶段
+        class RowExport(XlsxWriterToExport):
+            file_dir = self.file_dir
+
+        data = [[u'标题'], ['name', 'age']] + [[u'用户{}'.format(i), i] for i in range(50)]
+        manager = RowExport(data=data, export_name='stats', stats=ExportStats())
+        self.assertEqual(sorted(manager.stats.phases), ['close', 'head', 'rows'])
+
+    def test_raw_xlsx_backend(self):
+        _, sheet = self.export_sheet(TableExport, data=[{'name': u'用户{}'.format(i), 'age': i} for i in range(50)],
+                                     backend='xlsx')
+        self.assertIn('<mergeCell ref="B1:C1"/>', sheet)
+        self.assertIn('<mergeCell ref="A1:A2"/>', sheet)
+        self.assertIn(u'用户49', sheet)
+
+    def test_csv_backend(self):
+        manager = TableExport(data=[{'name': u'用户{}'.format(i), 'age': i} for i in range(3)], backend='csv')
+        path = manager.get_excel_url()
+        self.assertTrue(path.endswith('.csv'))
+        with open(path, encoding='utf-8-sig') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[2], u'1,用户0,0')
+        self.assertEqual(lines[0], u'序号,基本信息')
+        self.assertTrue(lines[-1].startswith(u'合计'))
+        self.assertEqual(len(lines), 6)
+
+    def test_paged_source_prefetch(self):
+        class UserSource(PagedSource):
+            page_size = 7
+
+            def __init__(self):
+                super(UserSource, self).__init__()
+                self.threads = set()
+
+            def fetch_page(self, page, page_size):
+                self.threads.add(threading.current_thread().name)
+                start = page * page_size
+                return [{'name': u'用户{}'.format(i), 'age': i} for i in range(start, min(start + page_size, 30))]
+
+        source = UserSource()
+        reports = []
+        _, sheet = self.export_sheet(TableExport, data=source, stats=ExportStats(callback=reports.append))
+        # 合计行：0到29的和
+        self.assertIn('<v>435</v>', sheet)
+        self.assertEqual(reports[0].rows, 30)
+        self.assertIn('fetch', reports[0].phases)
+        self.assertEqual(source.threads, {'execl-prefetch'})
+
+    def test_paged_source_error(self):
+        class BrokenSource(PagedSource):
+            def fetch_page(self, page, page_size):
+                if page:
+                    raise ValueError('db error')
+                return [{'name': u'用户', 'age': 1}] * page_size
+
+        with self.assertRaises(ValueError):
+            TableExport(data=BrokenSource(page_size=10))
+
+    def test_cursor_source(self):
+        connection = sqlite3.connect(':memory:')
+        connection.execute('create table users (name text, age integer)')
+        connection.executemany('insert into users values (?, ?)', [(u'用户{}'.format(i), i) for i in range(25)])
+        cursor = connection.execute('select name, age from users order by age')
+        self.assertEqual(len(list(CursorSource(cursor, page_size=10))), 25)
+        connection.close()
+
+    def test_report_schema(self):
+        data = [{'name': u'用户{}'.format(i), 'age': i} for i in range(20)]
+        table = TableExport(data=data, export_name='table')
+        # 同宽的列合并成一个<col>，其余内容相同
+        strip_cols = functools.partial(re.sub, '<cols>.*</cols>', '')
+        expected = strip_cols(read_sheet_xml(table.get_excel_url()))
+        schema = SchemaExport.report_schema
+        compiled = schema.compile()
+        for index in range(2):
+            _, sheet = self.export_sheet(SchemaExport, data=data, export_name='schema{}'.format(index))
+            self.assertIn('<col min="1" max="3" width="12.7109375" customWidth="1"/>', sheet)
+            self.assertEqual(strip_cols(sheet), expected)
+        # 每个类只编译一次
+        self.assertIs(schema.compile(), compiled)
+        self.assertEqual(schema.last_col, 3)
+        with self.assertRaises(AttributeError):
+            schema.first_row = 1
+
+    def test_content_format(self):
+        # 没有指定format的列使用content_format，显式指定为None的列不使用格式
+        child_list = [{'code': 'name', 'head': u'姓名'}, {'code': 'age', 'head': u'年龄', 'format': None}]
+
+        class ContentExport(XlsxWriterToExport):
+            export_name = u'内容格式'
+            file_dir = self.file_dir
+            report_schema = ReportSchema([(u'基本信息', child_list)], content_format={'bold': True})
+
+            def add_sheets(self):
+                ws = self.workbook.add_worksheet(u'明细')
+                options = {'source': self.data, 'content_format': {'bold': True}}
+                self.add_table_head(ws, options, u'基本信息', child_list=child_list)
+                self.add_table_data(ws, options, add_sum_line=False)
+                self.add_table(self.workbook.add_worksheet(u'结构'), add_sum_line=False)
+
+        manager = ContentExport(data=[{'name': u'用户', 'age': 1}])
+        bold = manager.get_format({'bold': True})._get_xf_index()
+        for index in (1, 2):
+            sheet = read_sheet_xml(manager.get_excel_url(), index)
+            self.assertIn('<c r="A3" s="{}" t="s">'.format(bold), sheet)
+            self.assertIn('<c r="B3"><v>1</v></c>', sheet)
+
+    def test_export_scheduler(self):
+        data = [{'name': u'用户{}'.format(i), 'age': i} for i in range(10)]
+        with ExportScheduler(max_workers=2) as scheduler:
+            jobs = [scheduler.submit(TableExport, data=data) for _ in range(3)]
+            paths = [job.collect(timeout=10) for job in jobs]
+            # 每个任务的文件名不同，对象销毁后文件仍保留
+            self.assertEqual(len(set(paths)), 3)
+            self.assertTrue(all(os.path.exists(path) for path in paths))
+            self.assertEqual(scheduler.artifacts(), [])
+            failed = scheduler.submit(TableExport, data=None)
+            with self.assertRaises(Exception):
+                failed.result(timeout=10)
+            self.assertEqual(failed.status, 'failed')
+
+    def test_export_scheduler_lanes(self):
+        GatedExport.gate.clear()
+        data = [{'name': u'用户', 'age': 1}]
+        scheduler = ExportScheduler(max_workers=2, max_queue=2, reserved_workers=1)
+        try:
+            batch = [scheduler.submit(GatedExport, data=data, lane='batch') for _ in range(2)]
+            # 非预留线程执行第一个批量任务，第二个排队
+            for _ in range(100):
+                if batch[0].status == 'running':
+                    break
+                time.sleep(0.01)
+            self.assertEqual(batch[1].status, 'pending')
+            # 预留线程仍然可以执行交互任务
+            interactive = scheduler.submit(TableExport, data=data)
+            self.assertTrue(os.path.exists(interactive.collect(timeout=5)))
+            scheduler.submit(GatedExport, data=data, lane='batch')
+            with self.assertRaises(ExportQueueFull):
+                scheduler.submit(GatedExport, data=data, lane='batch')
+            self.assertTrue(batch[1].cancel())
+            self.assertEqual(batch[1].status, 'cancelled')
+            GatedExport.gate.set()
+            self.assertTrue(os.path.exists(batch[0].result(timeout=5)))
+            self.assertEqual(scheduler.purge(max_age=0), 1)
+            self.assertFalse(os.path.exists(batch[0].result()))
+        finally:
+            GatedExport.gate.set()
+            scheduler.shutdown()
+
+    def test_export_scheduler_discard(self):
+        GatedExport.gate.clear()
+        data = [{'name': u'用户', 'age': 1}]
+        scheduler = ExportScheduler(max_workers=1, reserved_workers=0)
+        try:
+            running = scheduler.submit(GatedExport, data=data)
+            queued = scheduler.submit(GatedExport, data=data)
+            for _ in range(100):
+                if running.status == 'running':
+                    break
+                time.sleep(0.01)
+            # 排队的任务直接取消，执行中的任务完成后删除文件，不留在artifacts中
+            queued.discard()
+            self.assertEqual(queued.status, 'cancelled')
+            running.discard()
+            GatedExport.gate.set()
+            path = running.result(timeout=5)
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(scheduler.artifacts(), [])
+        finally:
+            GatedExport.gate.set()
+            scheduler.shutdown()
+
+    def test_export_profiles(self):
+        data = [{'name': u'http://example.com/{}'.format(i), 'age': i} for i in range(2000)]
+        fast = TableExport(data=data, export_name='fast', profile='fast')
+        small = TableExport(data=data, export_name='small', profile='small')
+        self.assertFalse(fast.constant_memory)
+        self.assertTrue(small.constant_memory)
+        self.assertEqual(small.get_workbook_options()['compresslevel'], 9)
+        self.assertGreater(fast.get_output_size(), small.get_output_size())
+        # 按最高压缩级别重新打包后文件更小，内容不变
+        default = TableExport(data=data, export_name='default', profile=dict(small.profile, compresslevel=None))
+        self.assertGreater(default.get_output_size(), small.get_output_size())
+        self.assertEqual(read_sheet_xml(default.get_excel_url()), read_sheet_xml(small.get_excel_url()))
+        # 配置是副本，修改不影响其他导出
+        small.profile['compresslevel'] = 0
+        self.assertEqual(EXPORT_PROFILES['small']['compresslevel'], 9)
+        # 不识别网址，没有超链接
+        self.assertNotIn('<hyperlink', read_sheet_xml(fast.get_excel_url()))
+        # 参数优先于配置
+        self.assertFalse(TableExport(data=data, export_name='cm', profile='small', constant_memory=False).constant_memory)
+        with self.assertRaises(ValueError):
+            TableExport(data=data, profile='tiny')
+
+    def test_read_execl(self):
+        data = [{'name': u'用户{}'.format(i), 'age': i} for i in range(25)]
+        for backend in ('xlsxwriter', 'xlsx'):
+            manager = SchemaExport(data=data, export_name=backend, backend=backend)
+            reader = SchemaExport.read_execl(manager.get_excel_url(), batch_size=10)
+            self.assertEqual([len(rows) for rows in reader.iter_batches()], [10, 10, 5])
+            # 合计行被跳过
+            self.assertEqual(list(reader), data)
+
+    def test_read_execl_columns(self):
+        # 列顺序调整、日期列、缺少的列
+        path = os.path.join(self.file_dir, 'upload.xlsx')
+        workbook = xlsxwriter.Workbook(path)
+        ws = workbook.add_worksheet()
+        ws.merge_range(0, 0, 0, 1, u'基本信息')
+        ws.write_row(1, 0, [u'年龄', u'姓名'])
+        ws.write_row(2, 0, [18, u'张三'])
+        ws.write(3, 1, u'李四')
+        ws.write_datetime(3, 0, datetime.datetime(2020, 1, 2), workbook.add_format({'num_format': 'yyyy-mm-dd'}))
+        workbook.close()
+        schema = ReportSchema([(u'基本信息', [{'code': 'name', 'head': u'姓名'},
+                                              {'code': 'age', 'head': u'年龄', 'default': 0}])])
+        rows = list(XlsxWriterToExport.read_execl(path, schema, as_tuples=True))
+        self.assertEqual(rows, [(u'张三', 18), (u'李四', datetime.datetime(2020, 1, 2))])
+        schema = ReportSchema([(u'基本信息', [{'code': 'name', 'head': u'姓名'}, {'code': 'city', 'head': u'城市'}])])
+        with self.assertRaises(ValueError):
+            list(XlsxWriterToExport.read_execl(path, schema))
+        rows = list(XlsxWriterToExport.read_execl(path, schema, strict=False))
+        self.assertEqual(rows[0], {'name': u'张三', 'city': u''})
+
+    def test_head_block(self):
+        head_block = build_head_block([
+            ('merge', (0, 0, 0, 1), u'基本信息', None, u'用户资料'),
+            ('write', (1, 0), u'姓名', None, u'用户资料'),
+            ('write', (1, 1), u'年龄', None, u'周岁'),
+            ('write', (0, 2), u'城市', None, u'常住城市'),
+            ('write', (1, 2), u'城市', None, u'常住城市'),
+        ])
+        self.assertEqual(head_block.rows, (
+            (0, ((2, (u'城市',), None),), (((0, 0, 0, 1), u'基本信息', None),)),
+            (1, ((0, (u'姓名', u'年龄', u'城市'), None),), ()),
+        ))
+        # 和上方单元格相同的批注不再重复
+        self.assertEqual(head_block.comments, ((0, 0, 1, u'用户资料'), (0, 2, 2, u'常住城市'), (1, 1, 1, u'周岁')))
+
+    def test_head_comment_modes(self):
+        data = [{'name': u'用户', 'age': 1, 'city': u'北京'}]
+        manager = TitleExport(data=data, export_name='comment')
+        with zipfile.ZipFile(manager.get_excel_url()) as f:
+            self.assertEqual(f.read('xl/comments1.xml').decode('utf-8').count('<comment '), 3)
+        manager, sheet = self.export_sheet(TitleExport, data=data, export_name='validation', head_comment='validation')
+        self.assertIn(u'prompt="用户资料" sqref="A1:B1"', sheet)
+        self.assertIn(u'prompt="周岁" sqref="B2"', sheet)
+        with zipfile.ZipFile(manager.get_excel_url()) as f:
+            self.assertNotIn('xl/comments1.xml', f.namelist())
+
+    def test_execl_address(self):
+        from xlsxwriter.utility import xl_col_to_name
+        self.assertEqual(len(execl_address.COLUMN_LETTERS), 16384)
+        for col in (0, 25, 26, 701, 702, 16383):
+            self.assertEqual(execl_address.col_name(col), xl_col_to_name(col))
+            self.assertEqual(execl_address.col_index(xl_col_to_name(col)), col)
+        self.assertEqual(execl_address.range_name(0, 0, 1, 2), 'A1:C2')
+        self.assertEqual(execl_address.range_name(0, 0, 0, 0, absolute=True), '$A$1')
+        self.assertEqual(execl_address.col_range(1, 27), 'B:AB')
+        self.assertEqual(execl_address.range_index('$B$2:AA10'), (1, 1, 9, 26))
+        self.assertEqual(execl_address.range_index('B:D'), (None, 1, None, 3))
+        # 合并单元格需要行号，不接受整列区域
+        with self.assertRaises(ValueError):
+            execl_address.range_index('B:D', whole_columns=False)
+        manager = ExportTest(name='address', data=[[u'标题'], ['name', 'age']])
+        with self.assertRaises(ValueError):
+            manager.merge_cell(manager.workbook.add_worksheet(), [{'cell': 'B:D', 'content': u'整列'}])
+        with self.assertRaises(ValueError):
+            execl_address.cell_index('A')
+        self.assertEqual(execl_address.cell_names([0, 9], [0, 27]), ['A1', 'AB10'])
+        self.assertEqual(execl_address.range_names([0], [0], [1], [2]), ['A1:C2'])
+        if numpy is not None:
+            self.assertEqual(execl_address.cell_names(numpy.array([0, 1]), numpy.array([2, 3])), ['C1', 'D2'])
+
+    def test_sheet_builders(self):
+        # 两个标签页的数据同时获取时才能都通过barrier，依次获取时等待超时抛出BrokenBarrierError
+        barrier = threading.Barrier(2)
+
+        def concurrent_source(count):
+            def fetch():
+                barrier.wait(5)
+                return [{'name': u'用户{}'.format(i), 'age': i, 'city': u'城市{}'.format(i % 2)} for i in range(count)]
+            return fetch
+
+        class MultiExport(XlsxWriterToExport):
+            export_name = u'多标签页'
+            file_dir = self.file_dir
+            city_schema = ReportSchema(SchemaExport.report_schema.groups, group_by='city')
+            sheet_builders = [
+                SheetBuilder(u'用户', SchemaExport.report_schema, concurrent_source(10)),
+                SheetBuilder(u'分城市', city_schema, concurrent_source(4)),
+                SheetBuilder(u'空表', SchemaExport.report_schema, [], add_sum_line=False),
+            ]
+
+        manager, sheet = self.export_sheet(MultiExport, data=None)
+        self.assertFalse(barrier.broken)
+        with zipfile.ZipFile(manager.get_excel_url()) as f:
+            self.assertIn('xl/worksheets/sheet3.xml', f.namelist())
+        self.assertIn('<v>45</v>', sheet)
+        city = read_sheet_xml(manager.get_excel_url(), 2)
+        # 城市0：0+2，城市1：1+3，合计6
+        self.assertEqual([re.search('<c r="C{}"[^>]*><v>(\\d+)</v>'.format(row), city).group(1) for row in (7, 8, 9)],
+                         ['2', '4', '6'])
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=1)
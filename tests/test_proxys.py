@@ -0,0 +1,378 @@
+#! python
+# -*- coding: utf-8 -*-
+__author__ = "caiwanpeng"
+
+"""测试代理类"""
+
+import asyncio
+import copy
+import gc
+import threading
+import time
+import unittest
+
+from caibox import proxys
+from caibox.proxys import (CachedObjProxy, ContextProxy, LazyObjProxy, LocalStack, ObjProxy, ProfilingObjProxy,
+                           ProxyGeneration, ProxyProfile, ResolvedLazyObjProxy, SpecializedProxy, ThreadLocalProxy,
+                           specialized_proxy, untouched_lazy_proxies)
+
+
+class Counter(object):
+    """记录调用次数的工厂函数"""
+
+    def __init__(self, value=None, delay=0):
+        self.value = {'name': u'配置'} if value is None else value
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.value
+
+
+class TestObjProxy(unittest.TestCase):
+
+    def test_factory(self):
+        factory = Counter([1, 2, 3])
+        proxy = ObjProxy(factory)
+        self.assertEqual(len(proxy), 3)
+        self.assertEqual(proxy[0], 1)
+        self.assertIn(2, proxy)
+        # 每次访问都会调用工厂函数
+        self.assertEqual(factory.calls, 3)
+
+
+class TestCachedObjProxy(unittest.TestCase):
+
+    def test_cache(self):
+        factory = Counter()
+        proxy = CachedObjProxy(factory)
+        for _ in range(100):
+            self.assertEqual(proxy['name'], u'配置')
+        self.assertEqual(proxy.get('name'), u'配置')
+        self.assertEqual(factory.calls, 1)
+        proxy._invalidate()
+        self.assertEqual(len(proxy), 1)
+        self.assertEqual(factory.calls, 2)
+
+    def test_plain_object(self):
+        proxy = CachedObjProxy([1, 2])
+        proxy.append(3)
+        self.assertEqual(proxy, [1, 2, 3])
+
+    def test_ttl(self):
+        factory = Counter()
+        proxy = CachedObjProxy(factory, ttl=0.05)
+        proxy['name']
+        proxy['name']
+        self.assertEqual(factory.calls, 1)
+        time.sleep(0.06)
+        proxy['name']
+        self.assertEqual(factory.calls, 2)
+
+    def test_generation(self):
+        generation = ProxyGeneration()
+        first, second = Counter(), Counter([1])
+        proxies = [CachedObjProxy(first, generation=generation), CachedObjProxy(second, generation=generation)]
+        for proxy in proxies:
+            bool(proxy)
+            bool(proxy)
+        self.assertEqual((first.calls, second.calls), (1, 1))
+        # 一次invalidate让共用版本号的代理都失效
+        generation.invalidate()
+        for proxy in proxies:
+            bool(proxy)
+        self.assertEqual((first.calls, second.calls), (2, 2))
+
+    def test_threads(self):
+        factory = Counter(delay=0.05)
+        proxy = CachedObjProxy(factory)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(proxy['name'])) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 缓存失效时只有一个线程调用工厂函数
+        self.assertEqual(results, [u'配置'] * 8)
+        self.assertEqual(factory.calls, 1)
+
+
+class TestContextProxy(unittest.TestCase):
+
+    def test_unbound(self):
+        proxy = ContextProxy('unbound_user')
+        self.assertFalse(proxy)
+        self.assertEqual(repr(proxy), '<ContextProxy unbound>')
+        with self.assertRaises(RuntimeError):
+            proxy['name']
+
+    def test_tasks(self):
+        # 并发的任务各自绑定自己的对象
+        user = ContextProxy('task_user')
+
+        async def handle(index):
+            with user._bound({'id': index}):
+                await asyncio.sleep(0.01)
+                return user['id']
+
+        async def main():
+            return await asyncio.gather(*[handle(index) for index in range(5)])
+
+        self.assertEqual(asyncio.run(main()), list(range(5)))
+        self.assertFalse(user)
+
+    def test_bind(self):
+        proxy = ContextProxy('bind_value')
+        token = proxy._bind([1])
+        inner = proxy._bind([1, 2])
+        self.assertEqual(len(proxy), 2)
+        proxy._unbind(inner)
+        self.assertEqual(proxy, [1])
+        proxy._unbind(token)
+        self.assertFalse(proxy)
+
+
+class TestThreadLocalProxy(unittest.TestCase):
+
+    def test_factory(self):
+        proxy = ThreadLocalProxy(lambda: {'thread': threading.current_thread().name})
+        names = []
+        thread = threading.Thread(target=lambda: names.append(proxy['thread']), name='proxy-worker')
+        thread.start()
+        thread.join()
+        self.assertEqual(names, ['proxy-worker'])
+        self.assertEqual(proxy['thread'], threading.current_thread().name)
+
+    def test_bind(self):
+        proxy = ThreadLocalProxy()
+        with self.assertRaises(RuntimeError):
+            len(proxy)
+        proxy._bind([1, 2])
+        self.assertEqual(len(proxy), 2)
+        thread = threading.Thread(target=lambda: self.assertFalse(proxy))
+        thread.start()
+        thread.join()
+        proxy._unbind()
+        self.assertFalse(proxy)
+
+
+class TestLocalStack(unittest.TestCase):
+
+    def test_stack(self):
+        stack = LocalStack('test_stack')
+        top = stack.proxy()
+        self.assertFalse(top)
+        self.assertIsNone(stack.pop())
+        with stack.pushed({'profile': 'fast'}):
+            stack.push({'profile': 'small'})
+            self.assertEqual(top['profile'], 'small')
+            self.assertEqual(len(stack), 2)
+            self.assertEqual(stack.pop(), {'profile': 'small'})
+            self.assertEqual(top['profile'], 'fast')
+        self.assertEqual(len(stack), 0)
+        self.assertIsNone(stack.top)
+
+    def test_tasks(self):
+        # 子任务复制父任务的上下文，子任务入栈不影响父任务
+        stack = LocalStack('task_stack')
+        top = stack.proxy()
+
+        async def child():
+            stack.push('child')
+            await asyncio.sleep(0)
+            return top._get_current_object()
+
+        async def main():
+            with stack.pushed('parent'):
+                result = await asyncio.gather(child(), child())
+                return result, top._get_current_object()
+
+        self.assertEqual(asyncio.run(main()), (['child', 'child'], 'parent'))
+
+
+class TestLazyObjProxy(unittest.TestCase):
+
+    def test_lazy(self):
+        factory = Counter()
+        proxy = LazyObjProxy(factory, name='lazy_config')
+        # 创建代理和查看代理都不会初始化
+        self.assertEqual(repr(proxy), '<LazyObjProxy lazy_config unresolved>')
+        self.assertIn('lazy_config', untouched_lazy_proxies())
+        self.assertEqual(factory.calls, 0)
+        self.assertEqual(proxy['name'], u'配置')
+        self.assertIs(type(proxy), ResolvedLazyObjProxy)
+        self.assertEqual(proxy.get('name'), u'配置')
+        self.assertEqual(repr(proxy), repr(factory.value))
+        self.assertNotIn('lazy_config', untouched_lazy_proxies())
+        self.assertEqual(factory.calls, 1)
+
+    def test_threads(self):
+        factory = Counter(delay=0.05)
+        proxy = LazyObjProxy(factory)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(proxy['name'])) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [u'配置'] * 8)
+        self.assertEqual(factory.calls, 1)
+
+    def test_failed(self):
+        # 初始化失败时保持未初始化，下次使用时重试
+        values = [ValueError(u'连接失败'), [1, 2]]
+
+        def factory():
+            value = values.pop(0)
+            if isinstance(value, Exception):
+                raise value
+            return value
+
+        proxy = LazyObjProxy(factory, name='lazy_retry')
+        with self.assertRaises(ValueError):
+            len(proxy)
+        self.assertIn('lazy_retry', untouched_lazy_proxies())
+        self.assertEqual(len(proxy), 2)
+
+    def test_subclass(self):
+        class ConfigProxy(LazyObjProxy):
+            __slots__ = ()
+
+            def describe(self):
+                return u'配置：{}'.format(self['name'])
+
+        factory = Counter()
+        proxy = ConfigProxy(factory, name='lazy_subclass')
+        self.assertIn('lazy_subclass', untouched_lazy_proxies())
+        # 子类初始化后保留自己的类和方法，不再列为未使用
+        self.assertEqual(proxy.describe(), u'配置：配置')
+        self.assertIs(type(proxy), ConfigProxy)
+        self.assertNotIn('lazy_subclass', untouched_lazy_proxies())
+        self.assertEqual(repr(proxy), repr(factory.value))
+        self.assertEqual(proxy.get('name'), u'配置')
+        self.assertEqual(factory.calls, 1)
+
+    def test_release(self):
+        # 初始化后不再引用factory，代理回收后弱引用也从注册表中删除
+        factory = Counter()
+        count = len(proxys._LAZY_PROXIES)
+        proxy = LazyObjProxy(factory, name='lazy_release')
+        self.assertEqual(len(proxys._LAZY_PROXIES), count + 1)
+        bool(proxy)
+        self.assertIsNone(proxy._ObjProxy__local)
+        self.assertIsNone(proxy._LazyObjProxy__factory)
+        del proxy
+        gc.collect()
+        self.assertEqual(len(proxys._LAZY_PROXIES), count)
+
+
+class TestSpecializedProxy(unittest.TestCase):
+
+    def test_dict(self):
+        DictProxy = specialized_proxy(dict)
+        self.assertIs(specialized_proxy(dict), DictProxy)
+        real = {'name': u'配置'}
+        proxy = DictProxy(real)
+        self.assertIsInstance(proxy, SpecializedProxy)
+        self.assertFalse(hasattr(proxy, '__dict__'))
+        self.assertEqual(proxy['name'], u'配置')
+        self.assertEqual(proxy.get('name'), u'配置')
+        self.assertEqual(list(proxy), ['name'])
+        self.assertIn('name', proxy)
+        proxy['age'] = 18
+        del proxy['name']
+        self.assertEqual(real, {'age': 18})
+        self.assertEqual(proxy, {'age': 18})
+        self.assertEqual(copy.deepcopy(proxy), {'age': 18})
+        self.assertFalse(DictProxy({}))
+        # dict不可哈希，代理也不可哈希；dict没有的运算代理也没有
+        self.assertIsNone(DictProxy.__hash__)
+        self.assertFalse(hasattr(DictProxy, '__add__'))
+
+    def test_number(self):
+        IntProxy = specialized_proxy(int)
+        proxy = IntProxy(5)
+        self.assertEqual((proxy + 1, 1 + proxy, proxy * 2, -proxy, proxy ** 2), (6, 6, 10, -5, 25))
+        self.assertEqual(divmod(proxy, 2), (2, 1))
+        self.assertEqual(hash(proxy), hash(5))
+        self.assertEqual([0, 1, 2, 3, 4, 5][proxy], 5)
+        self.assertTrue(proxy < 6)
+
+    def test_factory(self):
+        values = [[1, 2]]
+        proxy = specialized_proxy(list, factory=True)(lambda: values[-1])
+        proxy.append(3)
+        self.assertEqual(proxy, [1, 2, 3])
+        values.append([4])
+        self.assertEqual(len(proxy), 1)
+        self.assertEqual(proxy._get_current_object(), [4])
+
+    def test_instance_attributes(self):
+        class Order(object):
+            rate = 2
+
+            def __init__(self, amount):
+                self.amount = amount
+
+            def total(self):
+                return self.amount * self.rate
+
+        proxy = specialized_proxy(Order)(Order(3))
+        self.assertEqual(proxy.amount, 3)
+        self.assertEqual(proxy.total(), 6)
+        proxy.rate = 3
+        self.assertEqual(proxy.total(), 9)
+        with self.assertRaises(AttributeError):
+            proxy.missing
+
+
+class TestProfilingObjProxy(unittest.TestCase):
+
+    def test_counts(self):
+        proxy = ProfilingObjProxy(Counter(), sample_rate=0.5)
+        for _ in range(10):
+            proxy['name']
+        proxy.get('name')
+        list(proxy)
+        proxy['age'] = 18
+        snapshot = proxy._get_profile().snapshot()
+        # 按调用次数从多到少
+        self.assertEqual(list(snapshot)[0], '__getitem__')
+        self.assertEqual(snapshot['__getitem__']['calls'], 10)
+        # 每2次记录一次耗时
+        self.assertEqual(snapshot['__getitem__']['sampled'], 5)
+        self.assertGreater(snapshot['__getitem__']['mean'], 0)
+        self.assertEqual(snapshot['get']['calls'], 1)
+        self.assertIsNone(snapshot['get']['mean'])
+        self.assertEqual(snapshot['__iter__']['calls'], 1)
+        self.assertEqual(snapshot['__setitem__']['calls'], 1)
+
+    def test_shared_profile(self):
+        profile = ProxyProfile(sample_rate=0, name='shared')
+        first, second = ProfilingObjProxy([1], profile=profile), ProfilingObjProxy([1, 2], profile=profile)
+        self.assertEqual(len(first) + len(second), 3)
+        self.assertEqual(profile.snapshot(reset=True)['__len__'], {'calls': 2, 'sampled': 0, 'mean': None, 'max': None})
+        self.assertEqual(profile.snapshot(), {})
+        profile.enabled = False
+        self.assertEqual(first + [3], [1, 3])
+        self.assertEqual(profile.snapshot(), {})
+
+    def test_dump(self):
+        profile = ProxyProfile(sample_rate=1, name='dump')
+        proxy = ProfilingObjProxy(lambda: {'name': u'配置'}, profile=profile)
+        snapshots = []
+        profile.start_dump(interval=0.02, callback=snapshots.append)
+        try:
+            proxy['name']
+            time.sleep(0.1)
+        finally:
+            profile.stop_dump()
+        # 每次输出后清空，只有一次输出包含这次调用
+        self.assertEqual([snapshot['__getitem__']['calls'] for snapshot in snapshots if snapshot], [1])
+
+
+if __name__ == "__main__":
+    unittest.main()